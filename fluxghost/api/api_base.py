@@ -1,12 +1,24 @@
-import json
 import logging
-from select import select
+import selectors
+
+from fluxghost.utils import json_codec
 
 logger = logging.getLogger('API.BASE')
 
+# A connection watches only its websocket and a few device sockets, so poll()
+# beats an epoll instance (one more fd per connection). Unlike select() it
+# takes fds above FD_SETSIZE (1024), which a busy THREAD runmode server hands
+# out. Windows has neither, its select() has no such limit.
+ConnectionSelector = getattr(selectors, 'PollSelector', selectors.DefaultSelector)
+
 
 class ApiBase:
     POOL_TIME = 30.0
+    # Progress frames per second, see ProgressChannel
+    PROGRESS_RATE = 10.0
+    progress = None
+    # Encoder of send_json/send_ok payloads, accepts numpy arrays and scalars
+    json_dumps = staticmethod(json_codec.dumps)
     # Should implement
     # * rlist = [io1, io2, ...]
     # * running = True or False
@@ -19,26 +31,39 @@ class ApiBase:
             self.on_closed()
 
     def _serve_forever(self):
-        while self.running:
-            rl = select(self.rlist, (), (), self.POOL_TIME)[0]
-            for r in rl:
-                r.on_read()
-
-            self._on_loop()
-            self.on_loop()
+        with ConnectionSelector() as selector:
+            watched = []
+            while self.running:
+                if watched != self.rlist:
+                    watched = self._watch(selector, watched)
+                for key, _ in selector.select(self.POOL_TIME):
+                    key.fileobj.on_read()
+
+                self._on_loop()
+                self.on_loop()
+
+    def _watch(self, selector, watched):
+        # Handlers add and remove io objects on `rlist` directly; follow it
+        for io in watched:
+            if io not in self.rlist:
+                selector.unregister(io)
+        for io in self.rlist:
+            if io not in watched:
+                selector.register(io, selectors.EVENT_READ)
+        return list(self.rlist)
 
     def send_ok(self, **kw):
         if kw:
             kw['status'] = 'ok'
-            self.send_text(json.dumps(kw))
+            self.send_text(self.json_dumps(kw))
         else:
             self.send_text('{"status": "ok"}')
 
     def send_json(self, payload=None, **kw_payload):
         if payload:
-            self.send_text(json.dumps(payload))
+            self.send_text(self.json_dumps(payload))
         else:
-            self.send_text(json.dumps(kw_payload))
+            self.send_text(self.json_dumps(kw_payload))
 
     def send_continue(self):
         self.send_text('{"status": "continue"}')
@@ -81,8 +106,21 @@ class ApiBase:
         else:
             self.send_error(symbol, traceback=None)
 
+    def report_progress(self, final=False, **payload):
+        # Coalesced by the connection's progress channel when it has one
+        if self.progress:
+            self.progress.report(payload, final=final)
+        else:
+            self.send_json(payload)
+
     def send_progress(self, message, percentage, translation_key=None):
-        self.send_json(status='computing', message=message, percentage=percentage, translation_key=translation_key)
+        self.report_progress(
+            status='computing',
+            message=message,
+            percentage=percentage,
+            translation_key=translation_key,
+            final=percentage >= 1,
+        )
 
     def send_warning(self, message):
         self.send_json(status='warning', message=message)
@@ -7,6 +7,8 @@ from PIL import Image
 
 from fluxclient.robot.camera import FluxCamera
 from fluxclient.utils.version import StrictVersion
+from fluxghost.utils.metrics import CAMERA_FRAMES
+from fluxghost.utils.websocket import WebsocketError
 
 from .control_base import control_base_mixin
 from .fisheye_camera_mixin import FisheyeCameraMixin
@@ -14,6 +16,10 @@ from .fisheye_camera_mixin import FisheyeCameraMixin
 CRITICAL_VERSION = StrictVersion('1.0')
 logger = logging.getLogger('API.CAMERA')
 
+FRAMES_RECEIVED = CAMERA_FRAMES.labels('received')
+FRAMES_CORRECTED = CAMERA_FRAMES.labels('corrected')
+FRAMES_DROPPED = CAMERA_FRAMES.labels('dropped')
+
 
 """
 Control printer
@@ -78,6 +84,15 @@ def camera_api_mixin(cls):
                     super().on_command(message)
 
         def on_image(self, camera, image):
+            FRAMES_RECEIVED.inc()
+            try:
+                self._send_image(image)
+            except WebsocketError:
+                # The connection is closing
+                FRAMES_DROPPED.inc()
+                raise
+
+        def _send_image(self, image):
             is_low_resolution = self.is_next_image_low_resolution
             self.is_next_image_low_resolution = False
             logger.debug('on_image')
@@ -92,6 +107,7 @@ def camera_api_mixin(cls):
                 img = self.handle_fisheye_image(cv_img, downsample=1, is_low_resolution=is_low_resolution)
                 _, array_buffer = cv2.imencode('.jpg', img)
                 img_bytes = array_buffer.tobytes()
+                FRAMES_CORRECTED.inc()
                 self.send_binary(img_bytes)
             else:
                 self.send_binary(image)
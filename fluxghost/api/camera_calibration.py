@@ -27,13 +27,13 @@ from fluxghost.utils.camera.general import pad_image
 from fluxghost.utils.camera.perspective import calculate_regional_perspective_points, generate_grid_objects
 from fluxghost.utils.camera.solve_pnp import solve_pnp
 
-from .misc import BinaryHelperMixin, BinaryUploadHelper, OnTextMessageMixin
+from .misc import BinaryHelperMixin, BinaryUploadHelper, OffloadMixin, OnTextMessageMixin
 
 logger = logging.getLogger('API.CAMERA_CALIBRATION')
 
 
 def camera_calibration_api_mixin(cls):
-    class CameraCalibrationApi(OnTextMessageMixin, BinaryHelperMixin, cls):
+    class CameraCalibrationApi(OnTextMessageMixin, BinaryHelperMixin, OffloadMixin, cls):
         def __init__(self, *args, **kw):
             super().__init__(*args, **kw)
             # TODO: add all in one fisheye calibration
@@ -61,6 +61,8 @@ def camera_calibration_api_mixin(cls):
         def init_fisheye_params(self):
             self.fisheye_calibrate_heights = []
             self.fisheye_calibrate_imgs = []
+            if self._memory is not None:
+                self._memory.set('fisheye_images', 0)
             self.k = None
             self.d = None
             self.interrupted = False
@@ -70,6 +72,7 @@ def camera_calibration_api_mixin(cls):
 
         def cmd_interrupt(self, message):
             self.interrupted = True
+            self.cancel_offloaded()
             self.send_ok()
 
         def check_interrupted(self):
@@ -77,7 +80,7 @@ def camera_calibration_api_mixin(cls):
 
         def on_progress(self, progress):
             self.timer = time()
-            self.send_json(status='progress', progress=progress)
+            self.report_progress(status='progress', progress=progress, final=progress >= 1)
 
         def cmd_upload_image(self, message):
             message = message.split(' ')
@@ -122,11 +125,16 @@ def camera_calibration_api_mixin(cls):
 
             def upload_callback(buf):
                 img = Image.open(io.BytesIO(buf))
+                held = sum(img.nbytes for img in self.fisheye_calibrate_imgs)
+                # Decoded as BGR, 3 bytes a pixel
+                width, height = img.size
+                self.memory.admit('fisheye_images', held + width * height * 3)
                 img_cv = np.array(img)
                 img_cv = cv2.cvtColor(img_cv, cv2.COLOR_RGBA2BGR)
                 img_z = float(message[1])
                 self.fisheye_calibrate_heights.append(img_z)
                 self.fisheye_calibrate_imgs.append(img_cv)
+                self.memory.set('fisheye_images', held + img_cv.nbytes)
                 self.send_ok()
 
             file_length = int(message[0])
@@ -153,12 +161,12 @@ def camera_calibration_api_mixin(cls):
                 tvec_0 = np.dot([0, 1], tvec_polyfit)
                 self.send_ok(
                     ret=ret,
-                    k=k.tolist(),
-                    d=d.tolist(),
-                    rvec=rvec_0.tolist(),
-                    tvec=tvec_0.tolist(),
-                    rvec_polyfit=rvec_polyfit.tolist(),
-                    tvec_polyfit=tvec_polyfit.tolist(),
+                    k=k,
+                    d=d,
+                    rvec=rvec_0,
+                    tvec=tvec_0,
+                    rvec_polyfit=rvec_polyfit,
+                    tvec_polyfit=tvec_polyfit,
                 )
 
             except Exception as e:
@@ -229,9 +237,7 @@ def camera_calibration_api_mixin(cls):
                     _, array_buffer = cv2.imencode('.jpg', remap)
                     img_bytes = array_buffer.tobytes()
                     self.send_binary(img_bytes)
-                    self.send_ok(
-                        ret=calibrate_ret, k=k.tolist(), d=d.tolist(), rvec=rvecs[0].tolist(), tvec=tvecs[0].tolist()
-                    )
+                    self.send_ok(ret=calibrate_ret, k=k, d=d, rvec=rvecs[0], tvec=tvecs[0])
                 except Exception as e:
                     if self.check_interrupted():
                         return
@@ -299,18 +305,20 @@ def camera_calibration_api_mixin(cls):
                     img_cv = pad_image(img_cv, (0, 0, 0))
                 img_cv = get_remap_img(img_cv, k, d, is_fisheye=is_fisheye)
                 debug_imwrite('solve-pnp-input.png', img_cv)
-                if interest_area:
-                    x, y = interest_area['x'], interest_area['y']
-                    width, height = interest_area['width'], interest_area['height']
-                    interested_img = img_cv[y : y + height, x : x + width]
-                    corners = find_blob_centers(interested_img)
-                    if len(corners) > 0:
-                        corners = corners + np.array([x, y])
-                else:
-                    corners = find_blob_centers(img_cv)
                 projected_points = project_points(ref_points, rvec, tvec, k, d, is_fisheye=is_fisheye)
                 projected_points = remap_corners(projected_points, k, d, is_fisheye=is_fisheye).reshape(-1, 2)
+                self.offload(
+                    lambda found: on_corners(img_cv, projected_points, *found),
+                    find_pnp_corners,
+                    img_cv,
+                    interest_area,
+                    projected_points,
+                )
 
+            def on_corners(img_cv, projected_points, corners, match):
+                if interest_area:
+                    x, y = interest_area['x'], interest_area['y']
+                    width, height = interest_area['width'], interest_area['height']
                 if WRITE_DEBUG_IMG:
                     img_copy = img_cv.copy()
                     if interest_area:
@@ -323,7 +331,6 @@ def camera_calibration_api_mixin(cls):
                         cv2.circle(img_copy, tuple(p.astype(int)), 5, (255, 0, 0), 1)
 
                 result_img_points = None
-                match = match_projected_points(corners, projected_points)
                 if match is not None:
                     result_img_points = match.points
                     if WRITE_DEBUG_IMG:
@@ -362,7 +369,7 @@ def camera_calibration_api_mixin(cls):
                     result_img_points[:, 0] = np.clip(result_img_points[:, 0], min_x, max_x)
                     result_img_points[:, 1] = np.clip(result_img_points[:, 1], min_y, max_y)
 
-                self.send_ok(points=result_img_points.tolist())
+                self.send_ok(points=result_img_points)
                 _, array_buffer = cv2.imencode('.jpg', img_cv)
                 img_bytes = array_buffer.tobytes()
                 self.send_binary(img_bytes)
@@ -401,7 +408,7 @@ def camera_calibration_api_mixin(cls):
                 logger.info('[solve_pnp] Reprojection error: {}'.format(reproj_error))
                 self.calibration_params['rvec'] = new_rvec
                 self.calibration_params['tvec'] = new_tvec
-                self.send_ok(rvec=new_rvec.tolist(), tvec=new_tvec.tolist())
+                self.send_ok(rvec=new_rvec, tvec=new_tvec)
             except Exception as e:
                 self.send_json(status='fail', reason='solve pnp failed' + str(e))
 
@@ -479,7 +486,7 @@ def camera_calibration_api_mixin(cls):
             heights = np.array(json.loads(message[2]))
             rvec_polyfit = np.polyfit(heights, rvecs.reshape(-1, 3), 1)
             tvec_polyfit = np.polyfit(heights, tvecs.reshape(-1, 3), 1)
-            self.send_ok(rvec_polyfit=rvec_polyfit.tolist(), tvec_polyfit=tvec_polyfit.tolist())
+            self.send_ok(rvec_polyfit=rvec_polyfit, tvec_polyfit=tvec_polyfit)
 
         def cmd_detect_charuco(self, message):
             message = message.split(' ')
@@ -506,7 +513,7 @@ def camera_calibration_api_mixin(cls):
                     self.send_json(status='fail', reason='Failed to detect image.')
                     return
                 imgp, objp, found_ratio = res
-                self.send_ok(imgp=imgp.tolist(), objp=objp.tolist(), ratio=found_ratio)
+                self.send_ok(imgp=imgp, objp=objp, ratio=found_ratio)
 
             helper = BinaryUploadHelper(int(file_length), upload_callback)
             self.set_binary_helper(helper)
@@ -544,10 +551,10 @@ def camera_calibration_api_mixin(cls):
                 self.calibration_params['is_fisheye'] = is_fisheye
                 self.send_ok(
                     ret=ret,
-                    k=k.tolist(),
-                    d=d.tolist(),
-                    rvec=rvecs[0].tolist(),
-                    tvec=tvecs[0].tolist(),
+                    k=k,
+                    d=d,
+                    rvec=rvecs[0],
+                    tvec=tvecs[0],
                     indices=indices,
                     is_fisheye=is_fisheye,
                 )
@@ -676,3 +683,16 @@ def camera_calibration_api_mixin(cls):
         return calc_it(img)
 
     return CameraCalibrationApi
+
+
+def find_pnp_corners(img, interest_area, projected_points):
+    """Blob centers of img, within interest_area if given, and their match against projected_points."""
+    if interest_area:
+        x, y = interest_area['x'], interest_area['y']
+        width, height = interest_area['width'], interest_area['height']
+        corners = find_blob_centers(img[y : y + height, x : x + width])
+        if len(corners) > 0:
+            corners = corners + np.array([x, y])
+    else:
+        corners = find_blob_centers(img)
+    return corners, match_projected_points(corners, projected_points)
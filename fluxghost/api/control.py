@@ -12,6 +12,7 @@ from fluxclient.device.host2host_usb import FluxUSBError
 from fluxclient.robot.errors import RobotError, RobotSessionError
 from fluxclient.robot.robot import RawTasks
 from fluxclient.utils.version import StrictVersion
+from fluxghost.utils import command_timing
 
 from .control_base import control_base_mixin
 
@@ -161,7 +162,7 @@ def control_api_mixin(cls):
                 self.rlist.remove(socket)
                 del self.task_sockets[task_type]
 
-        def invoke_command(self, ref, args, wrapper=None):
+        def invoke_command(self, ref, args, wrapper=None, path=()):
             if not args:
                 return False
 
@@ -169,12 +170,13 @@ def control_api_mixin(cls):
             if cmd in ref:
                 obj = ref[cmd]
                 if isinstance(obj, dict):
-                    return self.invoke_command(obj, args[1:], wrapper)
+                    return self.invoke_command(obj, args[1:], wrapper, path + (cmd,))
                 else:
-                    if wrapper:
-                        wrapper(obj, *args[1:])
-                    else:
-                        obj(*args[1:])
+                    with command_timing.timed(self, ' '.join(path + (cmd,)), args[1:]):
+                        if wrapper:
+                            wrapper(obj, *args[1:])
+                        else:
+                            obj(*args[1:])
                     return True
             return False
 
@@ -330,8 +332,8 @@ def control_api_mixin(cls):
             def report(left, size):
                 if not flag:
                     flag.append(1)
-                    self.send_json(status='transfer', completed=0, size=size)
-                self.send_json(status='transfer', completed=(size - left), size=size)
+                    self.report_progress(status='transfer', completed=0, size=size)
+                self.report_progress(status='transfer', completed=(size - left), size=size, final=not left)
 
             path = file if file.startswith('/') else '/' + file
             buf = BytesIO()
@@ -632,8 +634,8 @@ def control_api_mixin(cls):
             def report(left, size):
                 if not flag:
                     flag.append(1)
-                    self.send_json(status='transfer', completed=0, size=size)
-                self.send_json(status='transfer', completed=(size - left), size=size)
+                    self.report_progress(status='transfer', completed=0, size=size)
+                self.report_progress(status='transfer', completed=(size - left), size=size, final=not left)
 
             buf = BytesIO()
             mimetype = self.robot.fetch_log(logname, buf, report)
@@ -648,8 +650,8 @@ def control_api_mixin(cls):
             def report(left, size):
                 if not flag:
                     flag.append(1)
-                    self.send_json(status='transfer', completed=0, size=size)
-                self.send_json(status='transfer', completed=(size - left), size=size)
+                    self.report_progress(status='transfer', completed=0, size=size)
+                self.report_progress(status='transfer', completed=(size - left), size=size, final=not left)
 
             buf = BytesIO()
             mimetype = self.robot.fetch_laser_records(buf, report)
@@ -664,8 +666,8 @@ def control_api_mixin(cls):
             def report(left, size):
                 if not flag:
                     flag.append(1)
-                    self.send_json(status='transfer', completed=0, size=size)
-                self.send_json(status='transfer', completed=(size - left), size=size)
+                    self.report_progress(status='transfer', completed=0, size=size)
+                self.report_progress(status='transfer', completed=(size - left), size=size, final=not left)
 
             buf = BytesIO()
             mimetype = self.robot.fetch_camera_calib_pictures(filename, buf, report)
@@ -680,8 +682,8 @@ def control_api_mixin(cls):
             def report(left, size):
                 if not flag:
                     flag.append(1)
-                    self.send_json(status='transfer', completed=0, size=size)
-                self.send_json(status='transfer', completed=(size - left), size=size)
+                    self.report_progress(status='transfer', completed=0, size=size)
+                self.report_progress(status='transfer', completed=(size - left), size=size, final=not left)
 
             buf = BytesIO()
             mimetype = self.robot.fetch_fisheye_params(buf, report)
@@ -696,8 +698,8 @@ def control_api_mixin(cls):
             def report(left, size):
                 if not flag:
                     flag.append(1)
-                    self.send_json(status='transfer', completed=0, size=size)
-                self.send_json(status='transfer', completed=(size - left), size=size)
+                    self.report_progress(status='transfer', completed=0, size=size)
+                self.report_progress(status='transfer', completed=(size - left), size=size, final=not left)
 
             buf = BytesIO()
             mimetype = self.robot.fetch_fisheye_3d_rotation(buf, report)
@@ -712,8 +714,8 @@ def control_api_mixin(cls):
             def report(left, size):
                 if not flag:
                     flag.append(1)
-                    self.send_json(status='transfer', completed=0, size=size)
-                self.send_json(status='transfer', completed=(size - left), size=size)
+                    self.report_progress(status='transfer', completed=0, size=size)
+                self.report_progress(status='transfer', completed=(size - left), size=size, final=not left)
 
             buf = BytesIO()
             mimetype = self.robot.fetch_auto_leveling_data(data_type, buf, report)
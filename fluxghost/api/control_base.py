@@ -1,6 +1,5 @@
 import logging
 import socket
-from io import BytesIO
 from uuid import UUID
 
 from fluxclient.device.host2host_usb import FluxUSBError
@@ -8,6 +7,9 @@ from fluxclient.encryptor import KeyObject
 from fluxclient.robot.errors import RobotError, RobotSessionError
 from fluxclient.robot.robot import FluxRobot
 from fluxghost import g
+from fluxghost.utils import command_timing
+
+from .misc import UploadBuffer
 
 logger = logging.getLogger('API.CONTROL_BASE')
 
@@ -22,6 +24,7 @@ def control_base_mixin(cls):
         target = None
 
         binary_handler = None
+        binary_sink = None
         cmd_mapping = None
         client_key = None
         robot = None
@@ -122,6 +125,10 @@ def control_base_mixin(cls):
                     self.send_fatal('DISCONNECTED')
                     raise
 
+        def get_binary_sink(self, length):
+            if self.binary_sink:
+                return self.binary_sink.reserve(length)
+
         def on_binary_message(self, buf):
             try:
                 if self.binary_handler:
@@ -133,44 +140,44 @@ def control_base_mixin(cls):
                 self.send_fatal(*e.error_symbol)
 
         def cb_upload_callback(self, robot, sent, size):
-            self.send_json(status='uploading', sent=sent)
+            self.report_progress(status='uploading', sent=sent, final=sent >= size)
 
         def simple_binary_transfer(self, method, mimetype, size, upload_to=None, cb=None):
             feed, finish = method(mimetype, size, upload_to)
-            last_reported = 0
+            completion = command_timing.completion(self)
 
             def binary_handler(buf):
-                nonlocal last_reported
                 sent = feed(buf)
-                translated_ratio = int(sent / size * 100)
-                if translated_ratio > last_reported:
-                    self.send_json(status='uploading', sent=sent)
-                    last_reported = translated_ratio
+                self.report_progress(status='uploading', sent=sent, final=sent >= size)
                 if sent == size:
                     self.binary_handler = None
-                    finish()
-                    cb()
+                    with completion():
+                        finish()
+                        cb()
 
             self.binary_handler = binary_handler
             self.send_continue()
 
         def simple_binary_receiver(self, size, continue_cb):
-            swap = BytesIO()
+            swap = UploadBuffer(size)
             upload_meta = {'sent': 0}
+            completion = command_timing.completion(self)
 
             def binary_handler(buf):
-                swap.write(buf)
-                sent = upload_meta['sent'] = upload_meta['sent'] + len(buf)
+                sent = upload_meta['sent'] = upload_meta['sent'] + swap.write(buf)
 
                 if sent < size:
                     pass
                 elif sent == size:
-                    self.binary_handler = None
-                    continue_cb(swap)
+                    self.binary_handler = self.binary_sink = None
+                    with completion():
+                        continue_cb(swap.getstream())
                 else:
+                    self.binary_sink = None
                     self.send_fatal('NOT_MATCH', 'binary data length error')
 
             self.binary_handler = binary_handler
+            self.binary_sink = swap
             self.send_continue()
 
         def on_closed(self):
@@ -0,0 +1,36 @@
+import logging
+
+from fluxghost.utils import command_timing, memory_budget
+
+from .misc import BinaryHelperMixin, OnTextMessageMixin
+
+logger = logging.getLogger('API.DIAGNOSTICS')
+
+
+def diagnostics_api_mixin(cls):
+    class DiagnosticsApi(OnTextMessageMixin, BinaryHelperMixin, cls):
+        def __init__(self, *args, **kw):
+            super().__init__(*args, **kw)
+            self.cmd_mapping = {
+                'command_stats': [self.cmd_command_stats],
+                'reset_command_stats': [self.cmd_reset_command_stats],
+                'memory': [self.cmd_memory],
+            }
+
+        def cmd_command_stats(self, params):
+            # params: optional route name, e.g. "control"
+            route = params.strip() or None
+            self.send_ok(
+                cmd='command_stats',
+                slow_command_ms=command_timing.SLOW_THRESHOLD * 1000,
+                commands=command_timing.snapshot(route),
+            )
+
+        def cmd_reset_command_stats(self, params):
+            command_timing.reset()
+            self.send_ok(cmd='reset_command_stats')
+
+        def cmd_memory(self, params):
+            self.send_ok(cmd='memory', **memory_budget.snapshot())
+
+    return DiagnosticsApi
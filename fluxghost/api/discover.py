@@ -1,6 +1,5 @@
 import json
 import logging
-from time import time
 
 from fluxghost import g
 
@@ -59,25 +58,10 @@ def discover_api_mixin(cls):
     class DiscoverApi(cls):
         def __init__(self, *args):
             super().__init__(*args)
-            self.lan_alive_devices = set()
             self.usb_alive_addr = {}
-            self.server.discover_devices.items()
             self.POOL_TIME = 1.0
-
-        def review_lan_devices(self):
-            t = time()
-            logger.debug('Review LAN device')
-            with self.server.discover_mutex:
-                for uuid, device in self.server.discover_devices.items():
-                    if t - device.last_update > 30:
-                        # Dead devices
-                        if uuid in self.lan_alive_devices:
-                            self.lan_alive_devices.remove(uuid)
-                            self.send_text(self.build_dead_response('lan', device))
-                    else:
-                        # Alive devices
-                        self.lan_alive_devices.add(uuid)
-                        self.send_text(self.build_response('lan', device))
+            # LAN devices are pushed by the server's registry as they change
+            self.server.device_registry.subscribe(self.send_text)
 
         def review_usb_devices(self):
             rmlist = []
@@ -97,8 +81,8 @@ def discover_api_mixin(cls):
                 self.send_text(self.build_response('h2h', usbdevice))
 
         def on_review_devices(self):
-            self.review_lan_devices()
             # self.review_usb_devices()
+            pass
 
         def on_text_message(self, message):
             try:
@@ -137,7 +121,7 @@ def discover_api_mixin(cls):
             self.POOL_TIME = min(self.POOL_TIME + 1.0, 3.0)
 
         def on_closed(self):
-            pass
+            self.server.device_registry.unsubscribe(self.send_text)
 
         def build_dead_response(self, source, device=None, uuid=None):
             return json.dumps(get_offline_message(source, device=device, uuid=uuid))
@@ -1,19 +1,84 @@
+import contextlib
 import logging
+import mmap
+import tempfile
+import weakref
+from concurrent.futures import CancelledError
 from io import BytesIO
-from time import time
+from threading import Lock, Timer
+from time import monotonic, time
+
+from fluxghost.utils import command_timing, json_codec, metrics, offload
+from fluxghost.utils.memory_budget import MemoryAccount, MemoryBudgetExceeded
 
 logger = logging.getLogger('API.MISC')
 
+# Uploads larger than this are spooled to an anonymous temp file instead of RAM
+SPOOL_THRESHOLD = 2**25
+# Cap on the bytes held by in-RAM uploads across all connections; an upload
+# which does not fit any more is spooled as well.
+RAM_LIMIT = 2**28
+
+_ram_lock = Lock()
+_ram_used = 0
+
+
+def configure_uploads(spool_threshold=None, ram_limit=None):
+    global SPOOL_THRESHOLD, RAM_LIMIT
+    if spool_threshold is not None:
+        SPOOL_THRESHOLD = spool_threshold
+    if ram_limit is not None:
+        RAM_LIMIT = ram_limit
+
+
+def upload_ram_usage():
+    return _ram_used
+
+
+def _acquire_ram(length):
+    global _ram_used
+    with _ram_lock:
+        if _ram_used + length > RAM_LIMIT:
+            return False
+        _ram_used += length
+        return True
+
+
+def _release_ram(length):
+    global _ram_used
+    with _ram_lock:
+        _ram_used -= length
+
 
 class BinaryHelperMixin:
     _binary_helper = None
+    _memory = None
+
+    @property
+    def memory(self):
+        """MemoryAccount of the connection, see fluxghost/utils/memory_budget.py."""
+        if self._memory is None:
+            self._memory = MemoryAccount(self.stats.route)
+        return self._memory
 
     def has_binary_helper(self):
         return self._binary_helper is not None
 
     def set_binary_helper(self, helper):
+        if helper is not None:
+            # Raises MemoryBudgetExceeded before the client is told to continue
+            self.memory.admit('upload', helper.length)
+            helper.completion = command_timing.completion(self)
+            # The callback admits what it makes of the bytes on its own
+            helper.received = lambda: self.memory.set('upload', 0)
+        elif self._memory is not None:
+            self._memory.set('upload', 0)
         self._binary_helper = helper
 
+    def get_binary_sink(self, length):
+        if self._binary_helper:
+            return self._binary_helper.reserve(length)
+
     def on_binary_message(self, buf):
         try:
             if self._binary_helper:
@@ -21,10 +86,133 @@ class BinaryHelperMixin:
                     self._binary_helper = None
             else:
                 raise RuntimeError('BAD_PROTOCOL', 'no binary accept')
+        except MemoryBudgetExceeded as e:
+            # Refused by the callback of a complete upload
+            logger.warning('Refused upload: %s', e)
+            self.set_binary_helper(None)
+            self.send_json(status='error', error='MEMORY_BUDGET_EXCEEDED', info=str(e))
         except RuntimeError as e:
             logger.error(e)
             self.send_fatal(e.args[0])
 
+    def on_closed(self):
+        if self._memory is not None:
+            self._memory.close()
+        super().on_closed()
+
+
+class OffloadMixin:
+    """Runs the CPU-bound work of commands in the offload pool, see fluxghost/utils/offload.py.
+
+    `offload(callback, fn, *args)` returns at once, and callback(result)
+    replies once fn is done; an exception of fn, or of callback, is replied
+    as status error.
+    `interrupt` and closing the connection cancel the jobs still running.
+    """
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self._offloaded = set()
+        # Guards _offloaded, changed from the connection and the pool's threads
+        self._offloaded_lock = Lock()
+
+    def offload(self, callback, fn, *args, **kwargs):
+        future = offload.submit(fn, *args, **kwargs)
+        with self._offloaded_lock:
+            self._offloaded.add(future)
+
+        def done(future):
+            with self._offloaded_lock:
+                self._offloaded.discard(future)
+            try:
+                result = future.result()
+            except CancelledError:
+                return
+            except Exception as e:
+                logger.error('%s failed: %r', fn.__name__, e)
+                self.send_json(status='error', info=str(e))
+                return
+            try:
+                callback(result)
+            except Exception as e:
+                logger.exception('Reply of %s failed', fn.__name__)
+                self.send_json(status='error', info=str(e))
+
+        future.add_done_callback(done)
+
+    def cancel_offloaded(self):
+        with self._offloaded_lock:
+            futures = list(self._offloaded)
+        for future in futures:
+            offload.cancel(future)
+
+    def cmd_interrupt(self, params):
+        self.cancel_offloaded()
+        self.send_ok()
+
+    def on_closed(self):
+        self.cancel_offloaded()
+        super().on_closed()
+
+
+class ProgressChannel:
+    """Coalesce the progress frames of one connection to at most `rate` per second.
+
+    `report()` sends at once if the last frame went out more than 1/rate
+    seconds ago; otherwise it keeps only the newest payload of each status and
+    a timer sends it when the interval is over. A `final` report, and
+    `flush()`, send whatever is held right away, so the last value always
+    reaches the client and never after the frame that follows it.
+    """
+
+    def __init__(self, send_text, rate):
+        self.send_text = send_text
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = Lock()
+        self.pending = {}
+        self.last_sent = 0
+        self.timer = None
+
+    def report(self, payload, final=False):
+        with self.lock:
+            self.pending[payload['status']] = payload
+            delay = self.last_sent + self.interval - monotonic()
+            if final or delay <= 0:
+                self._flush()
+            elif self.timer is None:
+                self.timer = Timer(delay, self._flush_late)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush_late(self):
+        try:
+            self.flush()
+        except Exception as e:
+            # The connection went away while a report was held back
+            logger.debug('Drop progress report: %r', e)
+
+    def _flush(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        self.last_sent = monotonic()
+        for payload in pending.values():
+            self.send_text(json_codec.dumps(payload))
+
+    def close(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            self.pending = {}
+
 
 class OnTextMessageMixin:
     def on_text_message(self, message):
@@ -39,7 +227,8 @@ class OnTextMessageMixin:
                     params = message[1]
 
                 if cmd in self.cmd_mapping:
-                    self.cmd_mapping[cmd][0](params, *self.cmd_mapping[cmd][1:])
+                    with command_timing.timed(self, cmd, params):
+                        self.cmd_mapping[cmd][0](params, *self.cmd_mapping[cmd][1:])
                 else:
                     logger.exception('Received message: %s' % (message))
                     raise ValueError('Undefined Command %s' % (cmd))
@@ -47,6 +236,10 @@ class OnTextMessageMixin:
                 logger.exception('Received Message: %s' % (message))
                 raise RuntimeError('PROTOCOL_ERROR', 'under uploading mode')
 
+        except MemoryBudgetExceeded as e:
+            logger.warning('Refused %s: %s', message, e)
+            self.send_json(status='error', error='MEMORY_BUDGET_EXCEEDED', info=str(e))
+
         except ValueError:
             logger.exception('Received Message: %s' % (message))
             self.send_json(status='Error', message='BAD_PARAM_TYPE')
@@ -56,11 +249,116 @@ class OnTextMessageMixin:
             self.send_fatal(e.args[0])
 
 
+class UploadBuffer:
+    """Preallocated target for an upload of a declared length.
+
+    The websocket codec receives a binary frame straight into a region given
+    by `reserve()`; any other chunk is copied in by `write()`. Regions are
+    assigned in arrival order.
+
+    Small uploads live in a BytesIO and `getvalue()` returns its bytes without
+    another copy: a BytesIO whose buffer is not exported any more shares it.
+    Uploads above `SPOOL_THRESHOLD`, or which would push the in-RAM total over
+    `RAM_LIMIT`, are spooled to an anonymous temp file mapped with mmap;
+    `getvalue()` then returns the mmap, which slices to bytes and can be used
+    wherever a bytes-like object is accepted.
+    """
+
+    def __init__(self, length):
+        if length < 0:
+            # Before _acquire_ram: nothing is held yet, so nothing leaks
+            raise ValueError('Bad upload length %i' % length)
+        self.length = length
+        self.spooled = length > SPOOL_THRESHOLD or not _acquire_ram(length)
+        metrics.UPLOAD_BYTES.labels('disk' if self.spooled else 'memory').observe(length)
+        self.offset = 0
+        self.reserved = []
+
+        if self.spooled:
+            self.stream = tempfile.TemporaryFile()
+            self.stream.truncate(length)
+            self.mmap = mmap.mmap(self.stream.fileno(), length) if length else None
+            self.view = memoryview(self.mmap) if length else memoryview(b'')
+            self._finalizer = None
+            logger.debug('Spool upload of %i bytes to disk', length)
+        else:
+            self.stream = BytesIO()
+            if length:
+                # Grow the buffer to its final size in one step
+                self.stream.seek(length - 1)
+                self.stream.write(b'\0')
+            self.view = self.stream.getbuffer()
+            self.mmap = None
+            # Give the RAM back even if the upload is abandoned half way
+            self._finalizer = weakref.finalize(self, _release_ram, length)
+
+    def reserve(self, length):
+        if self.view is None or self.offset + length > self.length:
+            return None
+        region = self.view[self.offset : self.offset + length]
+        self.offset += length
+        self.reserved.append(region)
+        return region
+
+    def write(self, buf):
+        for i, region in enumerate(self.reserved):
+            if region is buf:
+                # Already in place
+                del self.reserved[i]
+                length = len(region)
+                region.release()
+                return length
+
+        length = len(buf)
+        if self.view is not None and self.offset + length <= self.length:
+            self.view[self.offset : self.offset + length] = buf
+        self.offset += length
+        return length
+
+    def _release_view(self):
+        for region in self.reserved:
+            region.release()
+        self.reserved.clear()
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self._finalizer:
+            self._finalizer()
+
+    def getvalue(self):
+        self._release_view()
+        if self.spooled:
+            if self.mmap is None:
+                return b''
+            # The mapping keeps the (already unlinked) file alive on its own
+            self.stream.close()
+            return self.mmap
+        return self.stream.getvalue()
+
+    def getstream(self):
+        self._release_view()
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # Still exported somewhere, unmapped once collected
+                pass
+            self.mmap = None
+        self.stream.seek(self.length)
+        return self.stream
+
+
 class BinaryUploadHelper:
+    # Times the callback, set by BinaryHelperMixin.set_binary_helper
+    completion = contextlib.nullcontext
+    # Called once every byte arrived, before the callback; set by
+    # BinaryHelperMixin.set_binary_helper to end the upload's memory budget
+    received = None
+
     def __init__(self, length, callback, *args, **kwargs):
         self.length = length
         self.callback = callback
-        self.buf = BytesIO()
+        self.buf = UploadBuffer(length)
         self.buffered = 0
 
         self.progress_callback = kwargs.pop('progress_callback', None)
@@ -70,6 +368,11 @@ class BinaryUploadHelper:
 
         self.last_update = time()
 
+    def reserve(self, length):
+        if self.buf is None:
+            return None
+        return self.buf.reserve(length)
+
     def feed(self, buf):
         length = self.buf.write(buf)
         self.buffered += length
@@ -80,7 +383,12 @@ class BinaryUploadHelper:
                 self.progress_callback(self.buffered / self.length)
             return False
         elif self.buffered == self.length:
-            self.callback(self.buf.getvalue(), *self.args, **self.kwargs)
+            buf = self.buf.getvalue()
+            self.buf = None
+            if self.received:
+                self.received()
+            with self.completion():
+                self.callback(buf, *self.args, **self.kwargs)
             return True
         else:
             raise RuntimeError(
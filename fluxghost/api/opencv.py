@@ -10,13 +10,13 @@ from PIL import Image
 
 from fluxghost.utils.camera.corner_detection.find_corners import find_blob_centers
 
-from .misc import BinaryHelperMixin, BinaryUploadHelper, OnTextMessageMixin
+from .misc import BinaryHelperMixin, BinaryUploadHelper, OffloadMixin, OnTextMessageMixin
 
 logger = logging.getLogger('API.OPEN_CV')
 
 
 def opencv_mixin(cls):
-    class OpenCVApi(OnTextMessageMixin, BinaryHelperMixin, cls):
+    class OpenCVApi(OnTextMessageMixin, BinaryHelperMixin, OffloadMixin, cls):
         def __init__(self, *args, **kw):
             super().__init__(*args, **kw)
             self.cmd_mapping = {
@@ -24,6 +24,7 @@ def opencv_mixin(cls):
                 'sharpen': [self.cmd_sharpen],
                 'detect_blobs': [self.cmd_detect_blobs],
                 'image_contour': [self.cmd_image_contour],
+                'interrupt': [self.cmd_interrupt],
             }
             self.imgs = {}
             self.imgs_history = collections.deque([])
@@ -33,7 +34,16 @@ def opencv_mixin(cls):
                 self.imgs_history.remove(img_url)
             self.imgs_history.appendleft(img_url)
             if len(self.imgs_history) > 5:
-                self.imgs_history.pop()
+                self.imgs.pop(self.imgs_history.pop(), None)
+
+        def images_bytes(self, excluding=None):
+            return sum(img.nbytes for url, img in list(self.imgs.items()) if url != excluding)
+
+        def evict_images(self):
+            # Called by the memory budget, from the thread of another connection
+            self.imgs.clear()
+            self.imgs_history.clear()
+            self.memory.set('opencv_images', 0)
 
         def cmd_upload_image(self, params):
             params = params.split(' ')
@@ -42,10 +52,15 @@ def opencv_mixin(cls):
 
             def upload_callback(buf):
                 img = Image.open(io.BytesIO(buf))
+                # Decoded as BGRA, 4 bytes a pixel
+                width, height = img.size
+                self.memory.admit('opencv_images', self.images_bytes(img_url) + width * height * 4)
+                self.memory.cache('opencv_images', self.evict_images)
                 open_cv_img = np.array(img)
                 open_cv_img = cv2.cvtColor(open_cv_img, cv2.COLOR_RGBA2BGRA)
                 self.imgs[img_url] = open_cv_img
                 self.update_history(img_url)
+                self.memory.set('opencv_images', self.images_bytes())
                 self.send_ok()
 
             helper = BinaryUploadHelper(int(file_length), upload_callback)
@@ -75,9 +90,12 @@ def opencv_mixin(cls):
                 img = Image.open(io.BytesIO(buf)).convert('RGB')
                 open_cv_img = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
                 logger.info('Detecting blobs with params: {}'.format(kwargs))
-                centers = find_blob_centers(open_cv_img, **kwargs)
-                logger.info('Detected {} blobs'.format(len(centers)))
-                self.send_ok(points=[[float(x), float(y)] for x, y in centers])
+
+                def reply(centers):
+                    logger.info('Detected {} blobs'.format(len(centers)))
+                    self.send_ok(points=[[float(x), float(y)] for x, y in centers])
+
+                self.offload(reply, find_blob_centers, open_cv_img, **kwargs)
 
             helper = BinaryUploadHelper(int(file_length), upload_callback)
             self.set_binary_helper(helper)
@@ -101,26 +119,13 @@ def opencv_mixin(cls):
             alpha_threshold = int(options.get('alpha_threshold', 0))
 
             def upload_callback(buf):
-                img = Image.open(io.BytesIO(buf)).convert('RGBA')
-                arr = np.array(img)
-                alpha = arr[:, :, 3]
-                if (alpha < 255).any():
-                    mask = (alpha > alpha_threshold).astype(np.uint8) * 255
-                else:
-                    gray = cv2.cvtColor(arr, cv2.COLOR_RGBA2GRAY)
-                    mask = (gray < threshold).astype(np.uint8) * 255
-                # pad so content touching the image border still closes its contour
-                pad = 1
-                mask = cv2.copyMakeBorder(mask, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=0)
-                contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                result = []
-                for contour in contours:
-                    if cv2.contourArea(contour) < min_area:
-                        continue
-                    approx = cv2.approxPolyDP(contour, epsilon, True)
-                    result.append([[float(point[0][0] - pad), float(point[0][1] - pad)] for point in approx])
-                logger.info('Detected {} contours'.format(len(result)))
-                self.send_ok(contours=result)
+                arr = np.array(Image.open(io.BytesIO(buf)).convert('RGBA'))
+
+                def reply(result):
+                    logger.info('Detected {} contours'.format(len(result)))
+                    self.send_ok(contours=result)
+
+                self.offload(reply, image_contours, arr, threshold, epsilon, min_area, alpha_threshold)
 
             helper = BinaryUploadHelper(int(file_length), upload_callback)
             self.set_binary_helper(helper)
@@ -131,16 +136,46 @@ def opencv_mixin(cls):
             img_url = params[0]
             sharpness = float(params[1])
             radius = int(params[2])
-            if img_url not in self.imgs:
+            img = self.imgs.get(img_url)
+            if img is None:
                 return self.send_json(status='need_upload')
-            open_cv_image = self.imgs[img_url]
-            ksize = 2 * radius + 1
+            self.memory.touch('opencv_images')
             logger.info('Sharpening img: {} with sharpness {}, radius {}'.format(img_url, sharpness, radius))
-            gaussian_blur = cv2.GaussianBlur(open_cv_image, (ksize, ksize), 0)
-            unsharp_img = cv2.addWeighted(open_cv_image, 1 + sharpness, gaussian_blur, -sharpness, 0)
-            logger.info('Sharpen completed')
-            _, array_buffer = cv2.imencode('.png', unsharp_img)
-            img_bytes = array_buffer.tobytes()
-            self.send_binary(img_bytes)
+
+            def reply(img_bytes):
+                logger.info('Sharpen completed')
+                self.send_binary(img_bytes)
+
+            self.offload(reply, sharpen_png, img, sharpness, radius)
 
     return OpenCVApi
+
+
+def sharpen_png(img, sharpness, radius):
+    """img with an unsharp mask applied, encoded as PNG."""
+    ksize = 2 * radius + 1
+    gaussian_blur = cv2.GaussianBlur(img, (ksize, ksize), 0)
+    unsharp_img = cv2.addWeighted(img, 1 + sharpness, gaussian_blur, -sharpness, 0)
+    _, array_buffer = cv2.imencode('.png', unsharp_img)
+    return array_buffer.tobytes()
+
+
+def image_contours(arr, threshold, epsilon, min_area, alpha_threshold):
+    """Outer contours of the content of an RGBA image, see cmd_image_contour."""
+    alpha = arr[:, :, 3]
+    if (alpha < 255).any():
+        mask = (alpha > alpha_threshold).astype(np.uint8) * 255
+    else:
+        gray = cv2.cvtColor(arr, cv2.COLOR_RGBA2GRAY)
+        mask = (gray < threshold).astype(np.uint8) * 255
+    # pad so content touching the image border still closes its contour
+    pad = 1
+    mask = cv2.copyMakeBorder(mask, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=0)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    result = []
+    for contour in contours:
+        if cv2.contourArea(contour) < min_area:
+            continue
+        approx = cv2.approxPolyDP(contour, epsilon, True)
+        result.append(approx.reshape(-1, 2).astype(np.float64) - pad)
+    return result
@@ -18,6 +18,7 @@ from fluxclient.hw_profile import FCODE_VERSION_MAP
 from fluxclient.toolpath import FCodeV1MemoryWriter, FCodeV2MemoryWriter, GCodeMemoryWriter
 from fluxclient.toolpath.svgeditor_factory import SvgeditorFactory, SvgeditorImage
 from fluxclient.toolpath.toolpath import gcode2fcode, svgeditor2taskcode
+from fluxghost.utils import tracing
 from fluxghost.utils.username import get_username
 
 from .misc import BinaryHelperMixin, BinaryUploadHelper, OnTextMessageMixin
@@ -28,6 +29,8 @@ logger = logging.getLogger('API.SVGEDITOR')
 def laser_svgeditor_api_mixin(cls):
     class LaserSvgeditorApi(OnTextMessageMixin, BinaryHelperMixin, cls):
         fcode_metadata = None
+        # A new scene starts a trace, go and g2f join it
+        NEW_TRACE_COMMANDS = ('svgeditor_upload', 'upload_plain_svg', 'divide_svg', 'divide_svg_by_layer')
 
         def __init__(self, *args):
             self.pixel_per_mm = 10
@@ -35,6 +38,7 @@ def laser_svgeditor_api_mixin(cls):
             self.loop_compensation = 0.0
             self.is_task_interrupted = False
             self.curve_engraving_detail = None
+            self._msg_threads = []
             super().__init__(*args)
             self.fcode_metadata = {}
             self.cmd_mapping = {
@@ -75,7 +79,10 @@ def laser_svgeditor_api_mixin(cls):
             self.plain_svg = self.plain_svg.replace(b'encoding="UTF-16"', b'encoding="utf-8"')
             self.plain_svg = self.plain_svg.replace(b'encoding="utf-16"', b'encoding="utf-8"')
             try:
-                result = fluxsvg.divide(self.plain_svg, params=divide_params, loop_compensation=self.loop_compensation)
+                with tracing.stage('divide_svg'):
+                    result = fluxsvg.divide(
+                        self.plain_svg, params=divide_params, loop_compensation=self.loop_compensation
+                    )
 
                 self.send_json(name='strokes', length=result['strokes'].getbuffer().nbytes)
                 self.send_binary(result['strokes'].getbuffer())
@@ -105,9 +112,10 @@ def laser_svgeditor_api_mixin(cls):
             self.plain_svg = self.plain_svg.replace(b'encoding="UTF-16"', b'encoding="utf-8"')
             self.plain_svg = self.plain_svg.replace(b'encoding="utf-16"', b'encoding="utf-8"')
             try:
-                result = fluxsvg.divide_by_layer(
-                    self.plain_svg, params=divide_params, loop_compensation=self.loop_compensation
-                )
+                with tracing.stage('divide_svg_by_layer'):
+                    result = fluxsvg.divide_by_layer(
+                        self.plain_svg, params=divide_params, loop_compensation=self.loop_compensation
+                    )
                 if 'nolayer' in result:
                     self.send_json(name='nolayer', length=result['nolayer'].getbuffer().nbytes)
                     self.send_binary(result['nolayer'].getbuffer())
@@ -157,19 +165,22 @@ def laser_svgeditor_api_mixin(cls):
             def generate_svgeditor_image(buf, name, thumbnail_length):
                 thumbnail = buf[:thumbnail_length]
                 svg_data = buf[thumbnail_length:]
-                svg_image = SvgeditorImage(
-                    thumbnail,
-                    svg_data,
-                    self.pixel_per_mm,
-                    progress_callback=progress_callback,
-                    check_interrupted=self.check_interrupted,
-                    **svgeditor_image_params,
-                )
+                with tracing.stage('svg_image', bytes=len(svg_data)):
+                    svg_image = SvgeditorImage(
+                        thumbnail,
+                        svg_data,
+                        self.pixel_per_mm,
+                        progress_callback=progress_callback,
+                        check_interrupted=self.check_interrupted,
+                        **svgeditor_image_params,
+                    )
                 self.svg_image = svg_image
 
             def upload_callback(buf, name, thumbnail_length):
                 if self.has_binary_helper():
                     self.set_binary_helper(None)
+                # The size of the parsed image is not known, count its source
+                self.memory.admit('svg_image', len(buf) - thumbnail_length)
                 try:
                     generate_svgeditor_image(buf, name, thumbnail_length)
                     if self.check_interrupted():
@@ -240,8 +251,10 @@ def laser_svgeditor_api_mixin(cls):
             def upload_callback(buf, name):
                 if self.has_binary_helper():
                     self.set_binary_helper(None)
+                self.memory.admit('plain_svg', len(buf))
                 # todo divide buf as svg
-                self.plain_svg = buf
+                # Copied: a spooled upload is an mmap, which has no replace()
+                self.plain_svg = bytes(buf)
                 self.send_ok()
 
             logger.info('svg_editor')
@@ -279,6 +292,8 @@ def laser_svgeditor_api_mixin(cls):
 
                 if self.has_binary_helper():
                     self.set_binary_helper(None)
+                # Refused before anything is built when the budget is used up already
+                self.memory.admit('fcode', 0)
                 # todo divide buf as svg
                 thumbnail = process_thumbnail(buf[:thumbnail_length])
                 self.gcode_string = buf[thumbnail_length:]
@@ -297,31 +312,41 @@ def laser_svgeditor_api_mixin(cls):
                     writer = FCodeV1MemoryWriter('LASER', self.fcode_metadata, (thumbnail,))
                     default_travel_speed = 7500
 
-                    gcode2fcode(
-                        writer,
-                        self.gcode_string,
-                        travel_speed=default_travel_speed,
-                        progress_callback=progress_callback,
-                        check_interrupted=self.check_interrupted,
-                    )
+                    with tracing.stage('gcode2fcode', bytes=len(self.gcode_string)):
+                        gcode2fcode(
+                            writer,
+                            self.gcode_string,
+                            travel_speed=default_travel_speed,
+                            progress_callback=progress_callback,
+                            check_interrupted=self.check_interrupted,
+                        )
 
-                    writer.terminated()
+                    with tracing.stage('terminate'):
+                        writer.terminated()
 
                     if self.check_interrupted():
                         logger.info('cmd g2f interrupted')
                         return
 
-                    output_binary = writer.get_buffer()
+                    with tracing.stage('get_buffer') as span:
+                        output_binary = writer.get_buffer()
+                        span.set(bytes=len(output_binary))
+                    self.memory.set('fcode', len(output_binary))
                     time_need = float(writer.get_metadata().get(b'TIME_COST', 0))
 
                     traveled_dist = float(writer.get_metadata().get(b'TRAVEL_DIST', 0))
+                    tracing.annotate(time_cost=time_need, traveled_dist=traveled_dist)
                     self.send_progress('Finishing', 1.0, translation_key='finishing')
 
                     if send_fcode:
-                        self.send_json(
-                            status='complete', length=len(output_binary), time=time_need, traveled_dist=traveled_dist
-                        )
-                        self.send_binary(output_binary)
+                        with tracing.stage('send', bytes=len(output_binary)):
+                            self.send_json(
+                                status='complete',
+                                length=len(output_binary),
+                                time=time_need,
+                                traveled_dist=traveled_dist,
+                            )
+                            self.send_binary(output_binary)
                     else:
                         with open('/var/gcode/userspace/temp.fc', 'wb') as output_file:
                             output_file.write(output_binary)
@@ -332,6 +357,8 @@ def laser_svgeditor_api_mixin(cls):
                     file_name, line_number, _, _ = traceback_info[-1]
                     self.send_json(status='Error', message='{!s}\n{}, line: {}'.format(e, file_name, line_number))
                     raise e
+                finally:
+                    self.memory.set('fcode', 0)
 
             logger.info('task preview: gcode to fcode')
             file_length, thumbnail_length = map(int, params_str.split())
@@ -517,10 +544,13 @@ def laser_svgeditor_api_mixin(cls):
 
             self.factory_kwargs['hardware_name'] = hardware_name
             svgeditor2taskcode_kwargs['hardware_name'] = hardware_name
+            # Refused before anything is built when the budget is used up already
+            self.memory.admit('fcode', 0)
 
             try:
                 self.send_progress('Initializing', 0.03, translation_key='initializing')
-                factory = self.prepare_factory()
+                with tracing.stage('factory'):
+                    factory = self.prepare_factory()
                 self.fcode_metadata.update(
                     {
                         'CREATED_AT': datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
@@ -536,7 +566,8 @@ def laser_svgeditor_api_mixin(cls):
                 metadata = {}
                 magic_number = 4 if (is_rotary_task or not start_with_home) else 3
                 if output_fcode:
-                    thumbnail = factory.generate_thumbnail()
+                    with tracing.stage('thumbnail'):
+                        thumbnail = factory.generate_thumbnail()
                     if fcode_version == 2:
                         writer = FCodeV2MemoryWriter(self.fcode_metadata, (thumbnail,), magic_number)
                     else:
@@ -546,17 +577,19 @@ def laser_svgeditor_api_mixin(cls):
                     writer = GCodeMemoryWriter()
                 svgeditor2taskcode_kwargs['magic_number'] = magic_number
 
-                svgeditor2taskcode(
-                    writer,
-                    factory,
-                    progress_callback=progress_callback,
-                    check_interrupted=self.check_interrupted,
-                    **svgeditor2taskcode_kwargs,
-                )
+                with tracing.stage('taskcode'):
+                    svgeditor2taskcode(
+                        writer,
+                        factory,
+                        progress_callback=progress_callback,
+                        check_interrupted=self.check_interrupted,
+                        **svgeditor2taskcode_kwargs,
+                    )
                 if output_fcode:
                     time_need = writer.get_time_cost()
                     traveled_dist = writer.get_traveled()
-                writer.terminated()
+                with tracing.stage('terminate'):
+                    writer.terminated()
                 if output_fcode:
                     try:
                         metadata = writer.get_metadata()
@@ -569,18 +602,23 @@ def laser_svgeditor_api_mixin(cls):
                     logger.info('cmd go interrupted')
                     return
 
-                output_binary = writer.get_buffer()
-                print('time cost:', time_need, '\ntravel distance', traveled_dist)
+                with tracing.stage('get_buffer') as span:
+                    output_binary = writer.get_buffer()
+                    span.set(bytes=len(output_binary))
+                self.memory.set('fcode', len(output_binary))
+                logger.info('time cost: %s, travel distance: %s', time_need, traveled_dist)
+                tracing.annotate(time_cost=time_need, traveled_dist=traveled_dist)
                 self.send_progress('Finishing', 1.0, translation_key='finishing')
                 if send_fcode:
-                    self.send_json(
-                        status='complete',
-                        length=len(output_binary),
-                        time=time_need,
-                        traveled_dist=traveled_dist,
-                        metadata=metadata,
-                    )
-                    self.send_binary(output_binary)
+                    with tracing.stage('send', bytes=len(output_binary)):
+                        self.send_json(
+                            status='complete',
+                            length=len(output_binary),
+                            time=time_need,
+                            traveled_dist=traveled_dist,
+                            metadata=metadata,
+                        )
+                        self.send_binary(output_binary)
                 else:
                     with open('/var/gcode/userspace/temp.fc', 'wb') as output_file:
                         output_file.write(output_binary)
@@ -591,6 +629,8 @@ def laser_svgeditor_api_mixin(cls):
                 file_name, line_number, _, _ = traceback_info[-1]
                 self.send_json(status='Error', message='{!s}\n{}, line: {}'.format(e, file_name, line_number))
                 raise e
+            finally:
+                self.memory.set('fcode', 0)
 
         def cmd_interrupt(self, params):
             self.is_task_interrupted = True
@@ -601,8 +641,18 @@ def laser_svgeditor_api_mixin(cls):
                 return True
             return self.is_task_interrupted
 
+        def get_binary_sink(self, length):
+            # Receive straight into the upload buffer only when every earlier
+            # message thread is done with it.
+            self._msg_threads = [t for t in self._msg_threads if t.is_alive()]
+            if self._msg_threads:
+                return None
+            return super().get_binary_sink(length)
+
         def _handle_message(self, opcode, message):
+            message = self.detach_message(message)
             msg_thread = threading.Thread(target=super()._handle_message, args=[opcode, message])
             msg_thread.start()
+            self._msg_threads.append(msg_thread)
 
     return LaserSvgeditorApi
@@ -14,14 +14,14 @@ from fluxghost.utils.cmy_separation import cmyk_to_cmy, rgb_to_cmy
 from fluxghost.utils.contour import find_similar_contours
 from fluxghost.utils.opencv import findContours
 
-from .misc import BinaryHelperMixin, BinaryUploadHelper, OnTextMessageMixin
+from .misc import BinaryHelperMixin, BinaryUploadHelper, OffloadMixin, OnTextMessageMixin
 
 logger = logging.getLogger('API.UTILS')
 
 
 # General utility api
 def utils_api_mixin(cls):
-    class UtilsApi(OnTextMessageMixin, BinaryHelperMixin, cls):
+    class UtilsApi(OnTextMessageMixin, BinaryHelperMixin, OffloadMixin, cls):
         def __init__(self, *args, **kw):
             super().__init__(*args, **kw)
             self.cmd_mapping = {
@@ -34,6 +34,7 @@ def utils_api_mixin(cls):
                 'get_similar_contours': [self.get_similar_contours],
                 'get_all_similar_contours': [self.get_all_similar_contours],
                 'get_convex_hull': [self.get_convex_hull],
+                'interrupt': [self.cmd_interrupt],
             }
 
         def cmd_pdf2svg(self, params):
@@ -89,7 +90,7 @@ def utils_api_mixin(cls):
                 self.send_ok()
 
             def progress_callback(progress):
-                self.send_json(status='progress', progress=progress)
+                self.report_progress(status='progress', progress=progress, final=progress >= 1)
 
             helper = BinaryUploadHelper(int(file_size), upload_callback, progress_callback=progress_callback)
             self.set_binary_helper(helper)
@@ -188,8 +189,7 @@ def utils_api_mixin(cls):
                     is_spliced_img = False
                     if len(params) > 1 and params[1] == '1':
                         is_spliced_img = True
-                    data = find_similar_contours(cv_img, is_spliced_img)
-                    self.send_ok(data=data)
+                    self.offload(lambda data: self.send_ok(data=data), find_similar_contours, cv_img, is_spliced_img)
                 except Exception as e:
                     logger.exception('Error in get_similar_contours')
                     self.send_json(status='error', info=str(e))
@@ -209,8 +209,13 @@ def utils_api_mixin(cls):
                     is_spliced_img = False
                     if len(params) > 1 and params[1] == '1':
                         is_spliced_img = True
-                    data = find_similar_contours(cv_img, is_spliced_img, all_groups=True)
-                    self.send_ok(data=data)
+                    self.offload(
+                        lambda data: self.send_ok(data=data),
+                        find_similar_contours,
+                        cv_img,
+                        is_spliced_img,
+                        all_groups=True,
+                    )
                 except Exception as e:
                     logger.exception('Error in get_all_similar_contours')
                     self.send_json(status='error', info=str(e))
@@ -226,18 +231,7 @@ def utils_api_mixin(cls):
             def upload_callback(buf):
                 try:
                     image = Image.open(io.BytesIO(buf))
-                    cv_img = cv2.cvtColor(np.array(image), cv2.COLOR_RGBA2GRAY)
-                    cv_img = cv2.threshold(cv_img, 252, 255, cv2.THRESH_BINARY_INV)[1]
-                    contours = findContours(cv_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
-                    if len(contours) == 0:
-                        self.send_ok(data=[])
-                        return
-                    combined = np.vstack([c for c in contours])
-                    convex_hull = cv2.convexHull(combined)
-                    convex_hull_points = convex_hull.reshape(-1, 2)
-                    dists = np.linalg.norm(convex_hull_points, axis=1)
-                    convex_hull_points = np.roll(convex_hull_points, -np.argmin(dists), axis=0)
-                    self.send_ok(data=convex_hull_points.tolist())
+                    self.offload(lambda data: self.send_ok(data=data), convex_hull, np.array(image))
                 except Exception as e:
                     logger.exception('Error in get_convex_hull')
                     self.send_json(status='error', info=str(e))
@@ -248,3 +242,16 @@ def utils_api_mixin(cls):
             self.send_json(status='continue')
 
     return UtilsApi
+
+
+def convex_hull(img):
+    """Convex hull of the non-white content of an RGBA image, nearest point to the origin first."""
+    cv_img = cv2.cvtColor(img, cv2.COLOR_RGBA2GRAY)
+    cv_img = cv2.threshold(cv_img, 252, 255, cv2.THRESH_BINARY_INV)[1]
+    contours = findContours(cv_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+    if len(contours) == 0:
+        return []
+    combined = np.vstack([c for c in contours])
+    points = cv2.convexHull(combined).reshape(-1, 2)
+    dists = np.linalg.norm(points, axis=1)
+    return np.roll(points, -np.argmin(dists), axis=0)
@@ -1,3 +1,7 @@
 import os
 
 CERT_DIR = os.getenv('FLUX_GHOST_CERT_DIR', '.certs')
+
+
+def local_certs_exist():
+    return all(os.path.isfile(os.path.join(CERT_DIR, name)) for name in ('fullchain.pem', 'privkey.pem'))
@@ -101,6 +101,14 @@ def fetch_certs():
         return False
 
 
+def refresh_certs(on_update):
+    """fetch_certs() for a server already running on the local certificates:
+    call on_update() if new ones were saved."""
+    before = _hash_local_certs()
+    if fetch_certs() and _hash_local_certs() != before:
+        on_update()
+
+
 if __name__ == '__main__':
     res = fetch_certs()
     if not res:
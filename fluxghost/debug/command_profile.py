@@ -0,0 +1,149 @@
+"""cProfile capture of the commands of one connection.
+
+With `ghost.py --allow-profile`, a websocket opened with `?profile=1` runs
+every command it dispatches, and every upload callback, under cProfile
+(hooked in fluxghost/utils/command_timing.py). For each one it writes to
+PROFILE_DIR:
+
+    <route>-<command>-<time>-<n>.prof       pstats dump, for snakeviz or pstats
+    <route>-<command>-<time>-<n>.collapsed  "a;b;c <us>" stacks, for flamegraph.pl
+                                            or speedscope
+
+and then sends a `{"status": "profile", ...}` frame after the command's own
+replies, with both paths and the functions of the largest cumulative time.
+
+cProfile keeps caller/callee pairs, not whole stacks. The collapsed stacks
+are rebuilt by walking the call graph from its roots and splitting the time
+of a function among its callers by the time spent under each of them, like
+flameprof; recursion is cut at its first repeat, and call paths under
+COLLAPSE_RESOLUTION of the total time are left out.
+"""
+
+import contextlib
+import itertools
+import logging
+import os
+import re
+from time import strftime
+
+from fluxghost.debug import PROFILE_DIR
+from fluxghost.utils.websocket import WebsocketError
+
+__all__ = ['configure', 'profiled', 'wants_profile']
+
+logger = logging.getLogger('DEBUG.PROFILE')
+
+enabled = False
+directory = PROFILE_DIR
+# Functions listed in the profile frame
+TOP_FUNCTIONS = 15
+COLLAPSE_RESOLUTION = 1e-4
+
+_seq = itertools.count(1)
+
+
+def configure(allow=None, path=None):
+    global enabled, directory
+    if allow is not None:
+        enabled = allow
+    if path is not None:
+        directory = path
+
+
+def wants_profile(query):
+    """True if the connection's query string asks for profiling and the server allows it."""
+    return enabled and query.get('profile') in ('1', 'true')
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == '~':
+        # Built-in function, name is like "<built-in method time.sleep>"
+        return name
+    return '%s:%i(%s)' % (os.path.basename(filename), line, name)
+
+
+def collapse(stats):
+    """Collapsed stack lines from `pstats.Stats.stats`, times in microseconds."""
+    children = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            if caller != func:
+                children.setdefault(caller, []).append((func, edge[3]))
+    roots = [f for f, entry in stats.items() if not [c for c in entry[4] if c != f]]
+    smallest = sum(stats[root][3] for root in roots) * COLLAPSE_RESOLUTION
+
+    totals = {}
+    stack = [(root, (_label(root),), frozenset((root,)), 1.0) for root in roots]
+    while stack:
+        func, path, seen, share = stack.pop()
+        tt, ct = stats[func][2], stats[func][3]
+        own = tt * share
+        if own > 0:
+            key = ';'.join(path)
+            totals[key] = totals.get(key, 0.0) + own
+        if not ct:
+            continue
+        for child, edge_ct in children.get(func, ()):
+            if child in seen:
+                continue
+            child_ct = stats[child][3]
+            if child_ct and share * edge_ct >= smallest:
+                child_share = share * edge_ct / child_ct
+                stack.append((child, path + (_label(child),), seen | {child}, child_share))
+    return ['%s %i' % (key, round(t * 1e6)) for key, t in sorted(totals.items()) if round(t * 1e6)]
+
+
+def _summary(stats):
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+    return [
+        {'function': _label(func), 'calls': nc, 'tottime_ms': tt * 1000, 'cumtime_ms': ct * 1000}
+        for func, (_, nc, tt, ct, _) in rows
+    ]
+
+
+def _write(profiler, route, command):
+    import pstats
+
+    stats = pstats.Stats(profiler)
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(
+        directory, '%s-%s-%s-%i' % (route, re.sub(r'[^\w.-]+', '_', command), strftime('%Y%m%d-%H%M%S'), next(_seq))
+    )
+    stats.dump_stats(base + '.prof')
+    with open(base + '.collapsed', 'w') as f:
+        for line in collapse(stats.stats):
+            f.write(line + '\n')
+    return {
+        'prof': os.path.abspath(base + '.prof'),
+        'collapsed': os.path.abspath(base + '.collapsed'),
+        'calls': stats.total_calls,
+        'total_ms': stats.total_tt * 1000,
+        'top': _summary(stats.stats),
+    }
+
+
+@contextlib.contextmanager
+def _profiled(handler, command):
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        try:
+            report = _write(profiler, handler.stats.route, command)
+        except OSError as e:
+            logger.error('Can not write the profile of %s: %s', command, e)
+            report = {'error': str(e)}
+        with contextlib.suppress(WebsocketError):
+            handler.send_json(status='profile', cmd=command, **report)
+
+
+def profiled(handler, command):
+    """Context manager running one command of handler under cProfile, if its connection asked for it."""
+    if not getattr(handler, 'profile_commands', False):
+        return contextlib.nullcontext()
+    return _profiled(handler, command)
@@ -0,0 +1,122 @@
+"""Devices found by discovery, and the discover websockets following them.
+
+The discovery thread (fluxghost/discovery.py) feeds every discovery callback
+to `DeviceRegistry.add`, and calls `sweep` every DISCOVER_INTERVAL. The registry
+keeps one encoded `get_online_message` per device and pushes it to the
+subscribers only when it changed: a new device, a new status, name or
+address. A device not heard of for OFFLINE_AFTER seconds, or dropped from
+`devices` (see control_base.try_connect), is pushed once as offline.
+
+Beam Studio forgets a device it did not hear of for 15 s, so `sweep` also
+sends the encoded messages of all online devices again; that costs no
+encoding and no walk of the devices per connection.
+"""
+
+import json
+import logging
+from threading import Lock
+from time import time
+
+from fluxghost.api.discover import get_offline_message, get_online_message
+
+__all__ = ['DeviceRegistry']
+
+logger = logging.getLogger('DEVICES')
+
+OFFLINE_AFTER = 30.0
+# Listeners get an unchanged device again after this long, so that a copy
+# of it (a `--workers` process) does not see it go stale
+LISTENER_REFRESH = OFFLINE_AFTER / 3
+
+
+class DeviceRegistry:
+    def __init__(self):
+        self.mutex = Lock()
+        # uuid -> device, the first object discovery reported for it
+        self.devices = {}
+        # uuid -> encoded online message, for the devices pushed as online
+        self.messages = {}
+        self.subscribers = []
+        # Called with (uuid, device) when an add changed its message, e.g. to
+        # forward it to `--workers`
+        self.listeners = []
+        # uuid -> when the listeners last got it
+        self.notified = {}
+
+    def add(self, uuid, device):
+        t = time()
+        with self.mutex:
+            device = self.devices.setdefault(uuid, device)
+            changed = self._review(uuid, device, t)
+            if not self.listeners or (not changed and t - self.notified.get(uuid, 0) < LISTENER_REFRESH):
+                return
+            self.notified[uuid] = t
+        for listener in self.listeners:
+            listener(uuid, device)
+
+    def update(self, uuid, device):
+        """Like add, but device replaces the object known for uuid."""
+        with self.mutex:
+            self.devices[uuid] = device
+            self._review(uuid, device, time())
+
+    def subscribe(self, send):
+        """Call send(text) with every online device now, and with each change from now on."""
+        with self.mutex:
+            self.subscribers.append(send)
+            for message in self.messages.values():
+                self._send(send, message)
+
+    def unsubscribe(self, send):
+        with self.mutex:
+            if send in self.subscribers:
+                self.subscribers.remove(send)
+
+    def sweep(self):
+        with self.mutex:
+            t = time()
+            for uuid, device in self.devices.items():
+                self._review(uuid, device, t)
+            for uuid in [uuid for uuid in self.messages if uuid not in self.devices]:
+                del self.messages[uuid]
+                self._publish(json.dumps(get_offline_message('lan', uuid=uuid)))
+
+            for send in list(self.subscribers):
+                for message in self.messages.values():
+                    if not self._send(send, message):
+                        break
+
+    def _review(self, uuid, device, t):
+        # Return whether the device's message changed, and was published
+        previous = self.messages.get(uuid)
+        if t - device.last_update > OFFLINE_AFTER:
+            if previous is not None:
+                del self.messages[uuid]
+                self._publish(json.dumps(get_offline_message('lan', device=device)))
+                return True
+            return False
+
+        try:
+            message = json.dumps(get_online_message('lan', device))
+        except Exception:
+            logger.exception('Can not describe device %s', uuid)
+            return False
+        if message != previous:
+            self.messages[uuid] = message
+            self._publish(message)
+            return True
+        return False
+
+    def _publish(self, message):
+        for send in list(self.subscribers):
+            self._send(send, message)
+
+    def _send(self, send, message):
+        try:
+            send(message)
+            return True
+        except Exception as e:
+            # The connection is gone, it unsubscribes when it closes
+            logger.debug('Drop discover subscriber: %r', e)
+            self.subscribers.remove(send)
+            return False
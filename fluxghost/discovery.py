@@ -0,0 +1,117 @@
+"""Device discovery on its own thread.
+
+`DiscoveryThread` waits on the sockets of fluxclient's `DeviceDiscover`
+(`HttpServerBase.discover`) and feeds what it reads to the server's device
+registry (fluxghost/device_registry.py), so neither a burst of datagrams nor
+the registry's pushes ever delay an accept. Every DISCOVER_INTERVAL it
+sweeps the registry, reads the devices found over TCP and retries a failed
+discovery start.
+
+A round of reads stops after ROUND_DATAGRAMS datagrams, and the periodic
+work runs before the next round; what is left waits in the socket buffer,
+and what overflows it is counted by the kernel, see `socket_drops`.
+"""
+
+import logging
+import os
+import selectors
+import threading
+from time import monotonic, sleep
+
+from fluxghost.utils import metrics
+
+__all__ = ['DiscoveryThread']
+
+logger = logging.getLogger('DISCOVER')
+
+DISCOVER_INTERVAL = 5.0
+ROUND_DATAGRAMS = 64
+
+PROCESSED = metrics.DISCOVER_DATAGRAMS.labels('processed')
+MALFORMED = metrics.DISCOVER_DATAGRAMS.labels('malformed')
+
+
+def socket_drops(socks):
+    """Datagrams the kernel dropped on socks, from the last column of /proc/net/udp."""
+    try:
+        inodes = {str(os.fstat(sock.fileno()).st_ino) for sock in socks}
+    except (OSError, ValueError):
+        return 0
+    drops = 0
+    for table in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if fields[9] in inodes:
+                        drops += int(fields[12])
+        except (OSError, IndexError, ValueError, StopIteration):
+            continue
+    return drops
+
+
+class DiscoveryThread(threading.Thread):
+    def __init__(self, server):
+        super().__init__(name='discover', daemon=True)
+        self.server = server
+        self.running = True
+        self.selector = selectors.DefaultSelector()
+        # The DeviceDiscover whose sockets are registered
+        self.watching = None
+
+    def run(self):
+        next_review = monotonic()
+        try:
+            while self.running:
+                try:
+                    timeout = next_review - monotonic()
+                    if timeout <= 0:
+                        next_review = monotonic() + DISCOVER_INTERVAL
+                        self.review()
+                    elif not self.selector.get_map():
+                        # Nothing to wait on (and select() on Windows refuses to)
+                        sleep(timeout)
+                    elif self.selector.select(timeout):
+                        self.receive()
+                except Exception:
+                    logger.exception('Discovery error')
+        finally:
+            self.selector.close()
+
+    def review(self):
+        server = self.server
+        server.device_registry.sweep()
+        if server.discover is None:
+            try:
+                server.launch_discover()
+                logger.info('Discover started')
+            except OSError:
+                return
+
+        disc = server.discover
+        if self.watching is not disc:
+            for sock in server.discover_socks:
+                self.selector.register(sock, selectors.EVENT_READ)
+            self.watching = disc
+            metrics.DISCOVER_SOCKET_DROPS.set_function(lambda: socket_drops(disc.socks))
+
+        try:
+            for device in disc.tcp_devices:
+                server.on_discover_device(disc, device.uuid, device)
+        except Exception as e:
+            logger.error('Get tcp devices error {}'.format(e))
+
+    def receive(self):
+        disc = self.server.discover
+        for i in range(ROUND_DATAGRAMS):
+            if i and not self.selector.select(0):
+                return
+            try:
+                disc.try_receive(disc.socks, callback=self.server.on_discover_device, timeout=0.01)
+                PROCESSED.inc()
+            except Exception as e:
+                # a malformed datagram must never kill the server
+                MALFORMED.inc()
+                logger.debug('Discover error, recreate: %r', e)
+        metrics.DISCOVER_FULL_ROUNDS.inc()
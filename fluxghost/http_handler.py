@@ -1,14 +1,14 @@
 import logging
 import os
+import ssl
 import subprocess
-import urllib.error
 from http.server import BaseHTTPRequestHandler
 from io import StringIO
 from urllib.parse import urlparse
-from urllib.request import Request, urlopen
 
 from fluxghost import __version__
-from fluxghost.http_websocket_route import get_match_ws_service
+from fluxghost.http_websocket_route import match_ws_route
+from fluxghost.utils import metrics
 
 logger = logging.getLogger('HTTP')
 
@@ -16,6 +16,9 @@ logger = logging.getLogger('HTTP')
 class HttpHandler(BaseHTTPRequestHandler):
     server_version = 'FLUXGhost/%s' % __version__
     protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle a keep-alive
+    # client waits for its delayed ACK (~40 ms) before the body arrives.
+    disable_nagle_algorithm = True
 
     def __init__(self, request, client, server):
         request.settimeout(60.0)
@@ -47,52 +50,23 @@ class HttpHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         logger.debug('Start handling GET {}'.format(self.path))
         if self.path.startswith('/ws/'):
-            klass, kwargs = get_match_ws_service(self.path[4:])
+            # An upgrade request never keeps the HTTP connection alive, the
+            # ASYNC runmode relies on this to parse it on the event loop.
+            self.close_connection = True
+            route, klass, kwargs = match_ws_route(self.path[4:])
 
             if klass:
-                self.serve_websocket(klass, kwargs)
+                self.serve_websocket(klass, kwargs, route)
             else:
                 logger.exception('Websocket route error: %s' % self.path[4:])
                 self.response_404()
 
         elif self.path == '/':
             return self.serve_assets('index.html')
+        elif self.path == '/metrics':
+            self.serve_metrics()
         elif self.path.startswith('/api'):
-            try:
-                hostname = self.get_hostname()
-                print('Proxying %s' % hostname)
-                url = 'http://{}{}'.format(hostname, self.path)
-                req = Request(url=url)
-                req_headers = self.headers.items()
-                for header, value in req_headers:
-                    if str(header).lower().startswith('host'):
-                        req.add_header(header, hostname)
-                        continue
-                    if str(header).startswith('Accept-Encoding'):
-                        continue
-                    req.add_header(header, value)
-                try:
-                    resp = urlopen(req)
-                except urllib.error.HTTPError as e:
-                    if e.getcode():
-                        resp = e
-                    else:
-                        self.send_error(599, 'error proxying: {}'.format(unicode(e)))  # noqa: F821
-                        return
-                self.send_response(resp.getcode())
-                respheaders = resp.getheaders()
-                for header, value in respheaders:
-                    if str(header).startswith('Transfer-Encoding'):
-                        continue
-                    self.send_header(header, value)
-                self.end_headers()
-                resp_content = resp.read(4192)
-                while resp_content:
-                    self.wfile.write(resp_content)
-                    resp_content = resp.read(4192)
-                self.wfile.flush()
-            except OSError as e:
-                self.send_error(404, 'error trying to proxy: {!s}'.format(e))
+            self.server.proxy_handler.handle_request(self, 'GET', self.get_hostname())
         else:
             # self.send_response(200)
             # self.end_headers()
@@ -101,58 +75,21 @@ class HttpHandler(BaseHTTPRequestHandler):
             self.serve_assets(self.path[1:])
 
     def do_POST(self):
-        hostname = self.get_hostname()
-        print('Proxying %s' % hostname)
-        url = 'http://{}{}'.format(hostname, self.path)
-        req = Request(url=url)
-        req_headers = self.headers.items()
-        data_length = 0
-        print('Getting headers')
-        for header, value in req_headers:
-            if str(header).lower().startswith('host'):
-                req.add_header(header, hostname)
-                continue
-            if str(header).startswith('Accept-Encoding'):
-                continue
-            if header == 'Content-Length':
-                data_length = int(value) if value else 0
-            req.add_header(header, value)
-
-        print('Reading request %d' % data_length)
-        request_data = self.rfile.read(data_length)
-        print('Generating request')
-        try:
-            resp = urlopen(req, data=request_data)
-            print('Response generated')
-        except urllib.error.HTTPError as e:
-            if e.getcode():
-                resp = e
-                print('Response Error code ' + str(e.getcode()))
-            else:
-                print('Something went wrong..')
-                self.send_error(599, 'error proxying: {}'.format(unicode(e)))  # noqa: F821
-                return
-        print('Proxy response code %d' % resp.getcode())
-        self.send_response(resp.getcode())
-        respheaders = resp.getheaders()
-        for header, value in respheaders:
-            if str(header).startswith('Transfer-Encoding'):
-                continue
-            # print(self.path + " RESPH: " + header + " vs " + value)
-            self.send_header(header, value)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        print(self.path + ' end headers')
-        self.end_headers()
-        data = resp.read()
-        print(self.path + ' response readed')
-        self.wfile.write(data)
-        self.wfile.flush()
-        print(self.path + ' flushed')
+        self.server.proxy_handler.handle_request(self, 'POST', self.get_hostname(), cors=True)
 
     def serve_assets(self, path):
         self.server.assets_handler.handle_request(self, path)
 
-    def serve_websocket(self, ws_class, kwargs):
+    def serve_metrics(self):
+        buf = metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', metrics.CONTENT_TYPE)
+        self.send_header('Content-Length', len(buf))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(buf)
+
+    def serve_websocket(self, ws_class, kwargs, route=None):
         if not self.server.allow_foreign and 'Origin' in self.headers:
             url = urlparse(self.headers['Origin'])
             if url.scheme in ('chrome-extension', 'file'):
@@ -162,13 +99,30 @@ class HttpHandler(BaseHTTPRequestHandler):
                 self.response_404()
                 return
 
-        if self.server.ws_handler.handle_request(self):
+        deflate = self.server.ws_handler.negotiate_deflate(self, ws_class)
+        if self.server.ws_handler.handle_request(self, deflate=deflate):
             client = self.address_string()
             module = ws_class.__name__
 
             logger.debug('%s:%s connected' % (client, module))
             ws = ws_class(self.request, client, self.server, self.path, **kwargs)
-            ws.serve_forever()
+            if deflate is not None:
+                ws.enable_deflate(**deflate)
+            if route:
+                ws.stats = metrics.websocket_stats(route)
+            ws.stats.opened.inc()
+            ws.stats.connections.inc()
+            if self.server.runmode == 'ASYNC' and not isinstance(self.request, ssl.SSLSocket):
+                # The event loop owns the connection from now on, and counts
+                # it as closed. A TLS websocket stays in this thread: its
+                # socket becomes readable with part of a record, and a
+                # blocking read of the rest would stall the loop.
+                self.server.attach_websocket(ws)
+                return
+            try:
+                ws.serve_forever()
+            finally:
+                ws.stats.connections.dec()
             logger.debug('%s:%s disconnected' % (client, module))
 
     def response(self, code, message, body):
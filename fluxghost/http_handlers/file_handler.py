@@ -1,10 +1,11 @@
 import logging
 import os
-import platform
 import re
-import select
-import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
 from mimetypes import types_map as MIME_TYPE
+from threading import Lock
+from uuid import uuid4
 
 logger = logging.getLogger(__name__)
 
@@ -26,22 +27,65 @@ MIME_TYPE.update(
 )
 
 
-if platform.platform().startswith('Windows'):
+def get_last_modify(mtime):
+    return formatdate(mtime, usegmt=True)
 
-    def get_last_modify(filepath):
-        return time.strftime('%a, %d %b %Y %H:%M:%S UTC', time.gmtime(os.path.getmtime(filepath)))
-else:
 
-    def get_last_modify(filepath):
-        return time.strftime('%a, %d %b %Y %H:%M:%S %Z', time.gmtime(os.stat(filepath).st_mtime))
+BUF_SIZE = 65536
+# Assets up to CACHE_FILE_LIMIT bytes are kept in memory, least recently used
+# first out once they add up to more than CACHE_LIMIT bytes.
+CACHE_FILE_LIMIT = 2**18
+CACHE_LIMIT = 2**25
+# Served instead of the asset when the client accepts the encoding, in order
+# of preference.
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+# A Range header asking for more spans than this gets the whole file
+MAX_RANGES = 32
 
 
-BUF_SIZE = 65536
+class AssetCache:
+    """LRU of small asset bodies, keyed by path and validated by (mtime, size)."""
+
+    def __init__(self, limit=CACHE_LIMIT, file_limit=CACHE_FILE_LIMIT):
+        self.limit = limit
+        self.file_limit = file_limit
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, path, stat):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return None
+            if entry[0] != (stat.st_mtime_ns, stat.st_size):
+                del self.entries[path]
+                self.size -= len(entry[1])
+                return None
+            self.entries.move_to_end(path)
+            return entry[1]
+
+    def put(self, path, stat, data):
+        if len(data) > self.file_limit:
+            return
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old:
+                self.size -= len(old[1])
+            self.entries[path] = ((stat.st_mtime_ns, stat.st_size), data)
+            self.size += len(data)
+            while self.size > self.limit:
+                _, (_, dropped) = self.entries.popitem(last=False)
+                self.size -= len(dropped)
 
 
 class FileHandler:
-    def __init__(self, basedir):
+    def __init__(self, basedir, cache_control='no-cache'):
         self.basedir = os.path.abspath(basedir)
+        # Beam Studio assets change with every fluxghost update, let clients
+        # revalidate with the ETag instead of trusting a max-age.
+        self.cache_control = cache_control
+        self.cache = AssetCache()
 
     def clean_path(self, path):
         # Remove ? or # in url
@@ -70,53 +114,183 @@ class FileHandler:
         except BrokenPipeError as e:
             logger.debug('Error: %s', e)
 
-    def make_response(self, handler, filepath):
-        length = os.path.getsize(filepath)
+    def get_etag(self, stat, encoding=None):
+        etag = '%x-%x' % (stat.st_mtime_ns, stat.st_size)
+        return '"%s-%s"' % (etag, encoding) if encoding else '"%s"' % etag
 
-        req_range = handler.headers.get('Range', None)
-        start, until = self.proc_range_request(handler, length, req_range)
+    def is_not_modified(self, handler, stat, etag):
+        if_none_match = handler.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or 'W/' + etag in tags
 
+        if_modified_since = handler.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return int(stat.st_mtime) <= since
+        return False
+
+    def select_encoding(self, handler, filepath):
+        accept = handler.headers.get('Accept-Encoding', '')
+        if not accept or handler.headers.get('Range'):
+            return None, filepath
+        accepted = set()
+        for item in accept.split(','):
+            coding, _, params = item.strip().partition(';')
+            if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                continue
+            accepted.add(coding.strip().lower())
+        for encoding, suffix in PRECOMPRESSED:
+            if encoding in accepted and os.path.isfile(filepath + suffix):
+                return encoding, filepath + suffix
+        return None, filepath
+
+    def make_response(self, handler, filepath):
         fileName, fileExtension = os.path.splitext(filepath)
+        encoding, bodypath = self.select_encoding(handler, filepath)
+        stat = os.stat(bodypath)
+        length = stat.st_size
+        etag = self.get_etag(stat, encoding)
+
+        if self.is_not_modified(handler, stat, etag):
+            handler.send_response(304, 'Not Modified')
+            self.send_validators(handler, stat, etag)
+            if not handler.close_connection:
+                handler.send_header('Connection', 'Keep-Alive')
+            handler.end_headers()
+            return
+
+        mime = self.get_mime(fileExtension)
+        ranges = self.proc_range_request(handler, length, stat, etag)
+        if ranges == []:
+            handler.send_response(416, 'Range Not Satisfiable')
+            handler.send_header('Content-Range', 'bytes */%i' % length)
+            handler.send_header('Content-Length', 0)
+            if not handler.close_connection:
+                handler.send_header('Connection', 'Keep-Alive')
+            handler.end_headers()
+            return
+
+        if ranges is None:
+            handler.send_response(200, 'OK')
+            handler.send_header('Content-Type', mime)
+            pieces = [(0, length)]
+        elif len(ranges) == 1:
+            start, until = ranges[0]
+            handler.send_response(206, 'Partial Content')
+            handler.send_header('Content-Type', mime)
+            handler.send_header('Content-Range', 'bytes %i-%i/%i' % (start, until - 1, length))
+            pieces = ranges
+        else:
+            boundary = uuid4().hex
+            handler.send_response(206, 'Partial Content')
+            handler.send_header('Content-Type', 'multipart/byteranges; boundary=%s' % boundary)
+            pieces = []
+            for start, until in ranges:
+                pieces.append(
+                    (
+                        '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %i-%i/%i\r\n\r\n'
+                        % (boundary, mime, start, until - 1, length)
+                    ).encode()
+                )
+                pieces.append((start, until))
+            pieces.append(('\r\n--%s--\r\n' % boundary).encode())
 
-        handler.send_header('Content-Type', self.get_mime(fileExtension))
-        handler.send_header('Content-Length', length - start)
-        handler.send_header('Last-Modified', get_last_modify(filepath))
+        handler.send_header('Content-Length', sum(len(p) if isinstance(p, bytes) else p[1] - p[0] for p in pieces))
+        handler.send_header('Accept-Ranges', 'bytes')
+        self.send_validators(handler, stat, etag)
+        if encoding:
+            handler.send_header('Content-Encoding', encoding)
 
         if not handler.close_connection:
             handler.send_header('Connection', 'Keep-Alive')
 
+        body = None
+        if length <= self.cache.file_limit:
+            body = self.cache.get(bodypath, stat)
+            if body is None:
+                with open(bodypath, 'rb') as f:
+                    body = f.read()
+                self.cache.put(bodypath, stat, body)
+
         handler.end_headers()
-        handler.wfile.flush()
-
-        with open(filepath, 'rb') as f:
-            buf = bytearray(4096)
-            mv = memoryview(buf)
-            fd_dist = handler.wfile.fileno()
-
-            while True:
-                line = f.readinto(mv)
-                if line:
-                    sent = 0
-                    while sent != line:
-                        select.select((), (fd_dist,), ())
-                        sent += handler.wfile.write(mv[sent:line])
-                else:
-                    break
+        if body is not None:
+            view = memoryview(body)
+            for piece in pieces:
+                handler.wfile.write(piece if isinstance(piece, bytes) else view[piece[0] : piece[1]])
+        else:
+            with open(bodypath, 'rb') as f:
+                for piece in pieces:
+                    if isinstance(piece, bytes):
+                        handler.wfile.write(piece)
+                    else:
+                        # os.sendfile where available, plain writes on TLS sockets
+                        handler.connection.sendfile(f, piece[0], piece[1] - piece[0])
 
-    def proc_range_request(self, handler, file_length, request_range):
-        if request_range:
-            _s, _u = request_range.split('=')[1].split('-')
-            start = int((_s == '' and '0') or _s)
-            until = int((_u == '' and file_length) or _u)
-            until = until
+    def send_validators(self, handler, stat, etag):
+        handler.send_header('ETag', etag)
+        handler.send_header('Last-Modified', get_last_modify(stat.st_mtime))
+        handler.send_header('Cache-Control', self.cache_control)
+        # Whether a precompressed sibling was picked depends on Accept-Encoding
+        handler.send_header('Vary', 'Accept-Encoding')
 
-            handler.send_response(206, 'OK')
-            handler.send_header('Content-Range', 'bytes %i-%i/%i' % (start, until - 1, file_length))
-            handler.send_header('Accept-Ranges', 'bytes')
+    def if_range_matches(self, handler, stat, etag):
+        if_range = handler.headers.get('If-Range')
+        if not if_range:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith(('"', 'W/')):
+            # Strong comparison only
+            return if_range == etag
+        return if_range == get_last_modify(stat.st_mtime)
 
-            return start, until
-        else:
-            handler.send_response(200, 'OK')
-            handler.send_header('Content-Range', '%i' % (file_length,))
+    def proc_range_request(self, handler, file_length, stat, etag):
+        """Parse the Range header into sorted, merged (start, until) spans.
+
+        Return None to send the whole file (no or unusable Range, or If-Range
+        does not match) and [] when none of the spans can be satisfied.
+        """
+        request_range = handler.headers.get('Range')
+        if not request_range or not self.if_range_matches(handler, stat, etag):
+            return None
+
+        unit, _, specs = request_range.partition('=')
+        if unit.strip().lower() != 'bytes':
+            return None
 
-            return 0, file_length
+        ranges = []
+        for spec in specs.split(','):
+            first, sep, last = spec.strip().partition('-')
+            if not sep:
+                return None
+            try:
+                if first == '':
+                    suffix = int(last)
+                    if suffix <= 0:
+                        continue
+                    start, until = max(0, file_length - suffix), file_length
+                else:
+                    start = int(first)
+                    if last:
+                        until = int(last) + 1
+                        if until <= start:
+                            return None
+                    else:
+                        until = file_length
+            except ValueError:
+                return None
+            if start < file_length:
+                ranges.append((start, min(until, file_length)))
+
+        if len(ranges) > MAX_RANGES:
+            return None
+        merged = []
+        for start, until in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], until))
+            else:
+                merged.append((start, until))
+        return merged
@@ -0,0 +1,213 @@
+import logging
+from collections import deque
+from http.client import HTTPConnection, HTTPException
+from threading import Lock
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2**16
+UPSTREAM_TIMEOUT = 60.0
+# Idle upstream connections kept per host, and how long one may stay idle
+# before it is dropped instead of reused.
+MAX_IDLE = 8
+IDLE_TIMEOUT = 30.0
+
+# RFC 7230 6.1: meaningful for a single connection only, never forwarded
+HOP_BY_HOP = frozenset(
+    (
+        'connection',
+        'keep-alive',
+        'proxy-authenticate',
+        'proxy-authorization',
+        'proxy-connection',
+        'te',
+        'trailer',
+        'transfer-encoding',
+        'upgrade',
+    )
+)
+# Not forwarded upstream: the host is rewritten, the body is read uncompressed
+# and 100-continue is answered by BaseHTTPRequestHandler itself.
+SKIP_REQUEST = HOP_BY_HOP | {'host', 'accept-encoding', 'expect', 'content-length'}
+
+
+class ProxyHandler:
+    """Forward `/api/*` requests to the upstream host over pooled keep-alive connections.
+
+    Bodies are streamed in CHUNK_SIZE pieces in both directions; a chunked
+    request body is forwarded chunked, and a response without Content-Length
+    is sent to the client chunked (or until close for an HTTP/1.0 client).
+    """
+
+    def __init__(self, timeout=UPSTREAM_TIMEOUT):
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = Lock()
+
+    def acquire(self, host):
+        """Return (connection, reused)."""
+        now = monotonic()
+        with self.lock:
+            pool = self.idle.get(host)
+            while pool:
+                conn, since = pool.pop()
+                if now - since < IDLE_TIMEOUT:
+                    return conn, True
+                conn.close()
+        return HTTPConnection(host, timeout=self.timeout), False
+
+    def release(self, host, conn):
+        with self.lock:
+            pool = self.idle.setdefault(host, deque())
+            if len(pool) < MAX_IDLE:
+                pool.append((conn, monotonic()))
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            pools, self.idle = self.idle, {}
+        for pool in pools.values():
+            for conn, _ in pool:
+                conn.close()
+
+    def handle_request(self, handler, method, host, cors=False):
+        headers = [(k, v) for k, v in handler.headers.items() if k.lower() not in SKIP_REQUEST]
+        headers.append(('Host', host))
+        length = handler.headers.get('Content-Length')
+        chunked = 'chunked' in handler.headers.get('Transfer-Encoding', '').lower()
+        if chunked:
+            headers.append(('Transfer-Encoding', 'chunked'))
+        elif length:
+            try:
+                if int(length) < 0:
+                    raise ValueError(length)
+            except ValueError:
+                logger.error('Proxy %s %s: bad Content-Length %r', method, handler.path, length)
+                # The body can not be skipped without its length
+                handler.close_connection = True
+                handler.send_error(400, 'Bad Content-Length')
+                return
+            headers.append(('Content-Length', length))
+        has_body = chunked or bool(length and int(length))
+
+        logger.debug('Proxying %s %s to %s', method, handler.path, host)
+        try:
+            conn, resp = self.send_request(handler, method, host, headers, has_body, chunked, int(length or 0))
+        except (OSError, HTTPException) as e:
+            logger.error('Proxy %s %s failed: %s', method, handler.path, e)
+            handler.send_error(404, 'error trying to proxy: {!s}'.format(e))
+            return
+        except ValueError as e:
+            logger.error('Proxy %s %s: %s', method, handler.path, e)
+            # The rest of the body can not be skipped
+            handler.close_connection = True
+            handler.send_error(400, 'Bad chunk size')
+            return
+
+        try:
+            self.send_response(handler, resp, cors)
+        except (OSError, HTTPException) as e:
+            # Headers may be out already, the client connection can not be reused
+            logger.error('Proxy %s %s response failed: %s', method, handler.path, e)
+            handler.close_connection = True
+            conn.close()
+            return
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self.release(host, conn)
+
+    def send_request(self, handler, method, host, headers, has_body, chunked, length):
+        for attempt in range(2):
+            conn, reused = self.acquire(host)
+            body_sent = False
+            try:
+                conn.putrequest(method, handler.path, skip_host=True, skip_accept_encoding=True)
+                for header, value in headers:
+                    conn.putheader(header, value)
+                conn.endheaders()
+                if has_body:
+                    body_sent = True
+                    self.send_body(handler, conn, chunked, length)
+                return conn, conn.getresponse()
+            except (ConnectionError, HTTPException):
+                conn.close()
+                # A pooled connection the upstream closed meanwhile: retry
+                # once on a new one, unless the client body is consumed.
+                if not reused or body_sent or attempt:
+                    raise
+                logger.debug('Upstream %s closed an idle connection, reconnect', host)
+            except (OSError, ValueError):
+                conn.close()
+                raise
+
+    def send_body(self, handler, conn, chunked, length):
+        rfile = handler.rfile
+        if not chunked:
+            left = length
+            while left > 0:
+                data = rfile.read(min(CHUNK_SIZE, left))
+                if not data:
+                    raise ConnectionError('client body ended early')
+                conn.send(data)
+                left -= len(data)
+            return
+
+        while True:
+            line = rfile.readline(65537)
+            try:
+                size = int(line.split(b';', 1)[0].strip() or b'0', 16)
+            except ValueError:
+                raise ValueError('bad chunk size %r' % line[:64]) from None
+            if size == 0:
+                # Skip trailers up to the terminating empty line
+                while rfile.readline(65537).strip():
+                    pass
+                conn.send(b'0\r\n\r\n')
+                return
+            left = size
+            conn.send(b'%x\r\n' % size)
+            while left > 0:
+                data = rfile.read(min(CHUNK_SIZE, left))
+                if not data:
+                    raise ConnectionError('client body ended early')
+                conn.send(data)
+                left -= len(data)
+            rfile.readline(65537)
+            conn.send(b'\r\n')
+
+    def send_response(self, handler, resp, cors):
+        handler.send_response(resp.status, resp.reason)
+        for header, value in resp.getheaders():
+            if header.lower() not in HOP_BY_HOP:
+                handler.send_header(header, value)
+        if cors:
+            handler.send_header('Access-Control-Allow-Origin', '*')
+
+        chunked = resp.length is None and handler.request_version == 'HTTP/1.1'
+        if resp.length is None:
+            if chunked:
+                handler.send_header('Transfer-Encoding', 'chunked')
+            else:
+                handler.close_connection = True
+        handler.end_headers()
+
+        buf = bytearray(CHUNK_SIZE)
+        view = memoryview(buf)
+        wfile = handler.wfile
+        while True:
+            n = resp.readinto(buf)
+            if not n:
+                break
+            if chunked:
+                wfile.write(b'%x\r\n' % n)
+                wfile.write(view[:n])
+                wfile.write(b'\r\n')
+            else:
+                wfile.write(view[:n])
+        if chunked:
+            wfile.write(b'0\r\n\r\n')
+        wfile.flush()
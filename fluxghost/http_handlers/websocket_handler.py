@@ -1,4 +1,5 @@
 import base64
+import ipaddress
 import logging
 from hashlib import sha1
 
@@ -11,7 +12,12 @@ class WebSocketHandler:
     """WebSocketHandler handle websocket handshake. After handshake, handler
     will move to ws_class"""
 
-    def handle_request(self, handler):
+    def __init__(self, deflate='auto'):
+        # permessage-deflate: 'on', 'off' or 'auto' (remote clients only, it
+        # only costs CPU on a loopback connection)
+        self.deflate = deflate
+
+    def handle_request(self, handler, deflate=None):
         handler.close_connection = 1
         upgrade = handler.headers.get('Upgrade')
         conn = handler.headers.get('Connection')
@@ -33,9 +39,56 @@ class WebSocketHandler:
             handler.response_403(body='Bad WebSocket request')
             return False
 
-        self.handshake(handler, ws_key)
+        self.handshake(handler, ws_key, deflate=deflate)
         return True
 
+    def negotiate_deflate(self, handler, ws_class):
+        """Return the permessage-deflate parameters to accept, or None."""
+        if self.deflate == 'off' or not getattr(ws_class, 'COMPRESSION', False):
+            return None
+        if self.deflate == 'auto':
+            try:
+                if ipaddress.ip_address(handler.client_address[0]).is_loopback:
+                    return None
+            except ValueError:
+                pass
+
+        offers = ','.join(handler.headers.get_all('Sec-WebSocket-Extensions') or ())
+        for offer in offers.split(','):
+            name, *params = [item.strip() for item in offer.split(';')]
+            if name == 'permessage-deflate':
+                accepted = self._accept_deflate_offer(params)
+                if accepted is not None:
+                    return accepted
+        return None
+
+    def _accept_deflate_offer(self, params):
+        # RFC 7692 7.1: decline offers with unknown, repeated or bad parameters
+        accepted = {}
+        for param in params:
+            key, _, value = param.partition('=')
+            key, value = key.strip(), value.strip().strip('"')
+            if key in accepted:
+                return None
+            if key in ('server_no_context_takeover', 'client_no_context_takeover'):
+                if value:
+                    return None
+                accepted[key] = True
+            elif key in ('server_max_window_bits', 'client_max_window_bits'):
+                if not value and key == 'client_max_window_bits':
+                    accepted[key] = 15
+                    continue
+                if not value.isdigit() or not 8 <= int(value) <= 15:
+                    return None
+                accepted[key] = int(value)
+            else:
+                return None
+
+        if accepted.get('server_max_window_bits') == 8:
+            # zlib can not produce a raw deflate stream with a 256 byte window
+            return None
+        return accepted
+
     def handshake(self, handler, ws_key, **kw):
         handshake_key = ('%s%s' % (ws_key, MAGIC_STRING)).encode()
         accept_key = base64.encodebytes(sha1(handshake_key).digest())[:-1]
@@ -44,4 +97,13 @@ class WebSocketHandler:
         handler.send_header('Upgrade', 'websocket')
         handler.send_header('Connection', 'Upgrade')
         handler.send_header('Sec-WebSocket-Accept', accept_key.decode('ascii'))
+        deflate = kw.get('deflate')
+        if deflate is not None:
+            extension = ['permessage-deflate']
+            for key in ('server_no_context_takeover', 'client_no_context_takeover'):
+                if deflate.get(key):
+                    extension.append(key)
+            if 'server_max_window_bits' in deflate:
+                extension.append('server_max_window_bits=%i' % deflate['server_max_window_bits'])
+            handler.send_header('Sec-WebSocket-Extensions', '; '.join(extension))
         handler.end_headers()
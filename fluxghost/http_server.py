@@ -1,8 +1,6 @@
 import logging
-import ssl
 import threading
 
-from fluxghost.http_handler import HttpHandler
 from fluxghost.http_server_base import HttpServerBase
 
 logger = logging.getLogger('HTTPServer')
@@ -14,13 +12,10 @@ class HttpServer(HttpServerBase):
     def on_accept(self, sock):
         try:
             request, client = sock.accept()
-        except ssl.SSLError as e:
-            logger.error('SSL Accept error: %s' % e)
-            return
         except Exception as e:
             logger.error('Accept error: %s' % e)
             return
 
-        w = threading.Thread(target=HttpHandler, args=(request, client, self))
+        w = threading.Thread(target=self.serve_connection, args=(request, client, sock is self.ssl_sock))
         w.setDaemon(True)
         w.start()
@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import socket
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from fluxghost.http_handler import HttpHandler
+from fluxghost.http_server_base import HttpServerBase
+
+logger = logging.getLogger('HTTPServer')
+
+"""
+About the ASYNC runmode:
+  All websocket connections share one asyncio event loop. The loop owns the
+  listening sockets, the websocket handshake and the frame codec
+  (`WebSocketHandler.do_recv`); discovery has its own thread, as in the
+  THREAD runmode. Decoded messages are dispatched
+  either directly on the loop (handlers with `RUN_IN_LOOP = True`) or, in
+  order, on a shared thread pool, so a connection that is computing a
+  toolpath or a calibration never blocks the others and an idle connection
+  costs no thread at all.
+
+  Plain HTTP requests (assets, /api proxy) and TLS connections still get a
+  thread like the THREAD runmode does, which also runs the TLS handshake; a
+  TLS websocket is served by that thread too, as in the THREAD runmode,
+  because a client holding back half a TLS record would block the loop in
+  `SSLSocket.recv`.
+"""
+
+HEADER_LIMIT = 65536
+HEADER_TIMEOUT = 10.0
+
+
+class HttpServer(HttpServerBase):
+    runmode = 'ASYNC'
+    executor_workers = 64
+
+    loop = None
+    loop_thread = None
+    executor = None
+
+    def serve_forever(self):
+        self.running = True
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix='ghost-worker')
+        self.connections = set()
+        self.loop_thread = threading.current_thread()
+
+        self.sock.setblocking(False)
+        self.loop.add_reader(self.sock.fileno(), self.on_accept, self.sock)
+        if self.ssl_sock:
+            self.loop.add_reader(self.ssl_sock.fileno(), self.on_accept, self.ssl_sock)
+        self.start_discovery()
+
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.running = False
+            self.discovery.running = False
+            for conn in list(self.connections):
+                conn.teardown()
+            self.executor.shutdown(wait=False)
+            self.loop.close()
+
+    def on_accept(self, sock):
+        try:
+            request, client = sock.accept()
+        except BlockingIOError:
+            return
+        except Exception as e:
+            logger.error('Accept error: %s' % e)
+            return
+
+        if sock is self.ssl_sock:
+            # The handshake, the request and a websocket are left to a thread
+            self.spawn_http_handler(request, client, tls=True)
+        else:
+            request.setblocking(False)
+            RequestProbe(self, request, client).start()
+
+    def spawn_http_handler(self, request, client, tls=False):
+        request.setblocking(True)
+        w = threading.Thread(target=self.serve_connection, args=(request, client, tls))
+        w.daemon = True
+        w.start()
+
+    def attach_websocket(self, ws):
+        """Hand a websocket which finished its handshake over to the event loop."""
+        conn = AsyncConnection(self, ws)
+        if threading.current_thread() is self.loop_thread:
+            conn.start()
+        else:
+            self.loop.call_soon_threadsafe(conn.start)
+
+
+class RequestProbe:
+    """Wait on the loop until a request's header is complete, without consuming it.
+
+    Websocket upgrades are then parsed by `HttpHandler` right here on the loop
+    (every byte it reads is already in the kernel buffer); everything else is
+    passed to a thread exactly as the THREAD runmode would do.
+    """
+
+    def __init__(self, server, request, client):
+        self.server = server
+        self.loop = server.loop
+        self.request = request
+        self.client = client
+        self.deadline = time() + HEADER_TIMEOUT
+
+    def start(self):
+        self.loop.add_reader(self.request.fileno(), self.on_read)
+
+    def on_read(self):
+        self.loop.remove_reader(self.request.fileno())
+        try:
+            head = self.request.recv(HEADER_LIMIT, socket.MSG_PEEK)
+        except BlockingIOError:
+            self.start()
+            return
+        except OSError:
+            self.request.close()
+            return
+
+        if not head:
+            self.request.close()
+        elif b'\r\n\r\n' in head:
+            self.dispatch(head)
+        elif len(head) >= HEADER_LIMIT or time() > self.deadline:
+            # Let BaseHTTPRequestHandler produce the proper error reply
+            self.server.spawn_http_handler(self.request, self.client)
+        else:
+            # The reader is level-triggered and peeked bytes stay readable,
+            # poll again shortly for the rest of the header.
+            self.loop.call_later(0.02, self.start)
+
+    def dispatch(self, head):
+        if not head.startswith(b'GET /ws/'):
+            self.server.spawn_http_handler(self.request, self.client)
+            return
+
+        self.request.setblocking(True)
+        HttpHandler(self.request, self.client, self.server)
+
+
+class AsyncConnection:
+    """Drive one websocket (and the extra io objects in its `rlist`) from the loop."""
+
+    def __init__(self, server, ws):
+        self.server = server
+        self.loop = server.loop
+        self.ws = ws
+        self.readers = {}
+        self.timer = None
+        self.pending = deque()
+        self.busy = False
+        self.closed = False
+        self.in_loop = getattr(ws, 'RUN_IN_LOOP', False)
+
+        if not self.in_loop:
+            # Decoded messages are queued instead of handled inside do_recv()
+            self._handle_message = ws._handle_message
+            ws._handle_message = self.queue_message
+            self._get_binary_sink = ws.get_binary_sink
+            ws.get_binary_sink = self.get_binary_sink
+
+    def start(self):
+        self.server.connections.add(self)
+        self.sync_readers()
+        self.schedule_tick()
+
+    def queue_message(self, opcode, message):
+        self.submit(self._handle_message, opcode, self.ws.detach_message(message))
+
+    def get_binary_sink(self, length):
+        # The handler's upload state is only current while no earlier message
+        # is still waiting for (or running on) the worker pool.
+        if self.busy or self.pending:
+            return None
+        return self._get_binary_sink(length)
+
+    def submit(self, fn, *args, done=None):
+        self.pending.append((fn, args, done))
+        if not self.busy:
+            self.run_next()
+
+    def run_next(self):
+        if not self.pending:
+            self.busy = False
+            return
+        self.busy = True
+        fn, args, done = self.pending.popleft()
+        future = self.server.executor.submit(self.call, fn, *args)
+
+        def on_done(_):
+            self.loop.call_soon_threadsafe(self.after_job, done)
+
+        future.add_done_callback(on_done)
+
+    def after_job(self, done):
+        if done:
+            done()
+        self.after_callback()
+        self.run_next()
+
+    def call(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception:
+            # Same outcome as an exception escaping WebSocketBase.serve_forever
+            logger.exception('Unhandle exception')
+            self.ws.running = False
+
+    def sync_readers(self):
+        current = {}
+        for io in list(self.ws.rlist):
+            try:
+                current[io.fileno()] = io
+            except (OSError, ValueError):
+                continue
+
+        for fd in list(self.readers):
+            if fd not in current:
+                self.loop.remove_reader(fd)
+                del self.readers[fd]
+        for fd, io in current.items():
+            if fd not in self.readers:
+                self.readers[fd] = io
+                self.loop.add_reader(fd, self.on_readable, fd)
+
+    def on_readable(self, fd):
+        io = self.readers.get(fd)
+        if io is None:
+            return
+
+        if io is self.ws or self.in_loop:
+            self.call(io.on_read)
+            self.after_callback()
+        else:
+            # Device sockets (camera frames, raw pipes) are consumed by the
+            # handler itself; stop watching until the worker drained it.
+            self.loop.remove_reader(fd)
+            del self.readers[fd]
+            self.submit(io.on_read)
+
+    def schedule_tick(self):
+        if self.closed:
+            return
+        self.timer = self.loop.call_later(self.ws.POOL_TIME, self.on_tick)
+
+    def on_tick(self):
+        if self.in_loop:
+            self.call(self.loop_hooks)
+            self.after_callback()
+            self.schedule_tick()
+        else:
+            self.submit(self.loop_hooks, done=self.schedule_tick)
+
+    def loop_hooks(self):
+        self.ws._on_loop()
+        self.ws.on_loop()
+
+    def after_callback(self):
+        if self.closed:
+            return
+        if self.ws.running:
+            self.sync_readers()
+        else:
+            self.teardown()
+
+    def teardown(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.server.connections.discard(self)
+        if self.timer:
+            self.timer.cancel()
+        for fd in self.readers:
+            self.loop.remove_reader(fd)
+        self.readers.clear()
+        # Drop queued work but let a running job finish before on_closed()
+        self.pending.clear()
+        self.submit(self.finalize)
+
+    def finalize(self):
+        try:
+            self.ws.on_closed()
+        except Exception:
+            logger.exception('Unhandle exception')
+        finally:
+            self.ws.request.close()
+            self.ws.stats.connections.dec()
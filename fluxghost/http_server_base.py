@@ -1,60 +1,104 @@
 import logging
 import platform
+import selectors
 import socket
 import ssl
 from os import getenv, path
-from select import select
 from sys import stdout
-from threading import Lock
 
 from fluxghost.cert import CERT_DIR
+from fluxghost.device_registry import DeviceRegistry
+from fluxghost.discovery import DiscoveryThread
+from fluxghost.http_handler import HttpHandler
 from fluxghost.http_handlers.file_handler import FileHandler
+from fluxghost.http_handlers.proxy_handler import ProxyHandler
 from fluxghost.http_handlers.websocket_handler import WebSocketHandler
+from fluxghost.utils import startup_profile
 
 logger = logging.getLogger('HTTPServer')
 
 certfile = path.join(CERT_DIR, 'fullchain.pem')
 keyfile = path.join(CERT_DIR, 'privkey.pem')
 
+# Seconds a client has to complete its TLS handshake
+TLS_HANDSHAKE_TIMEOUT = 10.0
+# Soft limit of open files asked for when the hard limit is unlimited
+NOFILE_TARGET = 65536
+
+
+def raise_nofile_limit():
+    # Every connection holds a socket, and macOS starts processes with 256
+    # files; go up to the hard limit.
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = NOFILE_TARGET if hard == resource.RLIM_INFINITY else hard
+    if soft != resource.RLIM_INFINITY and soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError) as e:
+            logger.debug('Can not raise the open files limit to %i: %s', target, e)
+
 
 class HttpServerBase:
     runmode = None
     discover_mutex = None
     discover = None
+    ssl_context = None
+    # The leader's links to its workers, see fluxghost/prefork.py
+    workers = None
 
     def __init__(
-        self, assets_path, address, allow_foreign=False, enable_discover=False, backlog=10, debug=False, ssl_port=8443
+        self,
+        assets_path,
+        address,
+        allow_foreign=False,
+        enable_discover=False,
+        backlog=10,
+        debug=False,
+        ssl_port=8443,
+        ws_deflate='auto',
+        reuse_port=False,
     ):
-        self.discover_mutex = Lock()
-        self.assets_handler = FileHandler(assets_path)
-        self.ws_handler = WebSocketHandler()
+        # SO_REUSEPORT, for `--workers` (fluxghost/prefork.py)
+        self.reuse_port = reuse_port
+        self.backlog = backlog
+        self.device_registry = DeviceRegistry()
+        self.discover_mutex = self.device_registry.mutex
+        self.discover_devices = self.device_registry.devices
+        with startup_profile.span('handlers'):
+            self.assets_handler = FileHandler(assets_path)
+            self.proxy_handler = ProxyHandler()
+            self.ws_handler = WebSocketHandler(deflate=ws_deflate)
         self.enable_discover = enable_discover
-        self.discover_devices = {}
         self.debug = debug
         self.allow_foreign = allow_foreign
         self.push_studio_ws = None
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind(address)
-        self.sock.listen(backlog)
+        with startup_profile.span('bind'):
+            raise_nofile_limit()
+            self.sock = self.listen(address)
 
-        self.ssl_sock = None
-        if path.isfile(certfile) and path.isfile(keyfile):
-            try:
-                ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-                ctx.load_cert_chain(certfile, keyfile)
-                raw_ssl_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                raw_ssl_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                raw_ssl_sock.bind((address[0], ssl_port))
-                raw_ssl_sock.listen(backlog)
-                self.ssl_sock = ctx.wrap_socket(raw_ssl_sock, server_side=True)
-                logger.info('Listen HTTPS on %s:%s' % (address[0], ssl_port))
-            except Exception:
-                logger.exception('Failed to start SSL socket')
-                self.ssl_sock = None
-        else:
-            logger.info('SSL cert not found, skipping HTTPS')
+        with startup_profile.span('ssl'):
+            self.ssl_sock = None
+            if path.isfile(certfile) and path.isfile(keyfile):
+                try:
+                    # One context for the life of the server: it holds the
+                    # session ticket keys, so a client reconnecting resumes
+                    # its session instead of a full handshake.
+                    self.ssl_context = ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+                    ctx.load_cert_chain(certfile, keyfile)
+                    # A plain listening socket: accept() returns at once and
+                    # the handshake runs in the connection's thread
+                    self.ssl_sock = self.listen((address[0], ssl_port))
+                    logger.info('Listen HTTPS on %s:%s' % (address[0], ssl_port))
+                except Exception:
+                    logger.exception('Failed to start SSL socket')
+                    self.ssl_sock = None
+            else:
+                logger.info('SSL cert not found, skipping HTTPS')
 
         if address[1] == 0:
             address = self.sock.getsockname()
@@ -83,6 +127,7 @@ class HttpServerBase:
 
         stdout.write('{"type": "ready", "port": %i}\n' % address[1])
         stdout.flush()
+        startup_profile.mark('ready')
 
         from fluxclient import __version__ as client_version
         from fluxghost import __version__ as ghost_version
@@ -91,18 +136,41 @@ class HttpServerBase:
 
         logger.info('Listen HTTP on %s:%s' % address)
 
-        self.discover_devices = {}
-
-        if debug:
-            from fluxghost.simulate import SimulateDevice
+        with startup_profile.span('simulate'):
+            if debug:
+                from fluxghost.simulate import SimulateDevice
 
-            self.simulate_device = s = SimulateDevice()
-            self.discover_devices[s.uuid] = s
+                self.simulate_device = s = SimulateDevice()
+                self.device_registry.add(s.uuid, s)
 
+        with startup_profile.span('discover'):
+            try:
+                self.launch_discover()
+            except OSError:
+                logger.exception('Can not start discover service')
+
+    def listen(self, address):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(address)
+        sock.listen(self.backlog)
+        return sock
+
+    def reload_certs(self):
+        # Handshakes after this use the new certificates. Without an HTTPS
+        # socket (no certificates at startup) it takes a restart.
+        if self.ssl_sock is None:
+            logger.info('New SSL certificates are used after a restart')
+            return
         try:
-            self.launch_discover()
-        except OSError:
-            logger.exception('Can not start discover service')
+            self.ssl_context.load_cert_chain(certfile, keyfile)
+            logger.info('Reloaded SSL certificates')
+            if self.workers:
+                self.workers.broadcast(('reload_certs',))
+        except Exception:
+            logger.exception('Failed to reload SSL certificates')
 
     def launch_discover(self):
         from fluxclient.device.discover import DeviceDiscover
@@ -110,60 +178,47 @@ class HttpServerBase:
         self.discover = DeviceDiscover()
         self.discover_socks = self.discover.socks
 
-    def _build_select_sockets(self):
-        sockets = (self.sock,)
-        if self.ssl_sock:
-            sockets += (self.ssl_sock,)
-        if self.discover:
-            sockets += self.discover_socks
-        return sockets
+    def start_discovery(self):
+        self.discovery = DiscoveryThread(self)
+        self.discovery.start()
 
     def serve_forever(self):
         self.running = True
-        disc = self.discover
-        sockets = self._build_select_sockets()
-        args = (sockets, (), (), 5.0)
-
-        while self.running:
-            try:
-                if disc is None:
-                    try:
-                        self.launch_discover()
-                        disc = self.discover
-                        sockets = self._build_select_sockets()
-                        args = (sockets, (), (), 30.0)
-                        logger.info('Discover started')
-                    except OSError:
-                        pass
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ, self.on_accept)
+        if self.ssl_sock:
+            self.selector.register(self.ssl_sock, selectors.EVENT_READ, self.on_accept)
+        self.start_discovery()
 
+        try:
+            while self.running:
                 try:
-                    for device in disc.tcp_devices:
-                        self.on_discover_device(disc, device.uuid, device)
-                except Exception as e:
-                    logger.error('Get tcp devices error {}'.format(e))
-
-                for sock in select(*args)[0]:
-                    if sock == self.sock:
-                        self.on_accept(self.sock)
-                    elif sock == self.ssl_sock:
-                        self.on_accept(self.ssl_sock)
-                    elif sock in disc.socks:
-                        try:
-                            disc.try_receive(disc.socks, callback=self.on_discover_device, timeout=0.01)
-                        except Exception as e:
-                            # a malformed datagram must never kill the server
-                            logger.debug('Discover error, recreate: %r', e)
-
-            except InterruptedError:
-                pass
-
-            except KeyboardInterrupt:
-                self.running = False
+                    for key, _ in self.selector.select(5.0):
+                        key.data(key.fileobj)
+
+                except InterruptedError:
+                    pass
+
+                except KeyboardInterrupt:
+                    self.running = False
+        finally:
+            self.discovery.running = False
+            self.selector.close()
+
+    def serve_connection(self, request, client, tls=False):
+        # Runs in the connection's own thread
+        if tls:
+            request.settimeout(TLS_HANDSHAKE_TIMEOUT)
+            try:
+                request = self.ssl_context.wrap_socket(request, server_side=True)
+            except (OSError, ValueError) as e:
+                logger.info('TLS handshake with %s failed: %s', client[0], e)
+                request.close()
+                return
+        HttpHandler(request, client, self)
 
     def on_discover_device(self, discover_instance, uuid, device, **kw):
-        with self.discover_mutex:
-            if uuid not in self.discover_devices:
-                self.discover_devices[uuid] = device
+        self.device_registry.add(uuid, device)
 
     def set_push_studio_ws(self, ws):
         self.push_studio_ws = ws
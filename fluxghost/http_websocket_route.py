@@ -1,5 +1,9 @@
 import importlib
+import logging
 import re
+import threading
+
+logger = logging.getLogger(__name__)
 
 ROUTES = [
     (re.compile('discover'), 'fluxghost.websocket.discover.WebsocketDiscover'),
@@ -28,15 +32,72 @@ ROUTES = [
     (re.compile('inter-process'), 'fluxghost.websocket.inter_process.WebsocketInterProcess'),
     (re.compile('opencv'), 'fluxghost.websocket.opencv.WebsocketOpenCV'),
     (re.compile('utils'), 'fluxghost.websocket.utils.WebsocketUtils'),
+    (re.compile('diagnostics'), 'fluxghost.websocket.diagnostics.WebsocketDiagnostics'),
 ]
 
+# Imported by their handlers on first use instead of at module scope, the
+# warm-up loads them too
+LAZY_IMPORTS = ('scipy.ndimage',)
+
+
+def _compile(routes):
+    # One alternation anchored at the start, each branch ending at the end of
+    # the path, a trailing slash or the query string. The route index is the
+    # name of the outer group, route parameters are prefixed with it.
+    branches = []
+    for idx, (exp, _) in enumerate(routes):
+        pattern = re.sub(r'\(\?P<(\w+)>', r'(?P<r%i_\1>' % idx, exp.pattern)
+        branches.append(r'(?P<r%i>%s)/?(?:\?|$)' % (idx, pattern))
+    return re.compile('|'.join(branches))
+
+
+_TABLE = _compile(ROUTES)
+# Metric label of each route: its path up to the first parameter
+ROUTE_NAMES = [exp.pattern.split('/(', 1)[0] for exp, _ in ROUTES]
+_classes = {}
+
+
+def load_route_class(module_path):
+    klass = _classes.get(module_path)
+    if klass is None:
+        module_name, klass_name = module_path.rsplit('.', 1)
+        klass = getattr(importlib.import_module(module_name), klass_name)
+        _classes[module_path] = klass
+    return klass
+
+
+def match_ws_route(path):
+    """Return (route name, handler class, route parameters), or (None, None, None)."""
+    match = _TABLE.match(path)
+    if match is None:
+        return None, None, None
+    idx = int(match.lastgroup[1:])
+    prefix = match.lastgroup + '_'
+    kwargs = {k[len(prefix) :]: v for k, v in match.groupdict().items() if k.startswith(prefix)}
+    return ROUTE_NAMES[idx], load_route_class(ROUTES[idx][1]), kwargs
+
 
 def get_match_ws_service(path):
-    for exp, module_path in ROUTES:
-        match = exp.match(path)
-        if match:
-            module_name, klass_name = module_path.rsplit('.', 1)
-            module_instance = importlib.import_module(module_name)
-            klass = module_instance.__getattribute__(klass_name)
-            return klass, match.groupdict()
-    return None, None
+    _, klass, kwargs = match_ws_route(path)
+    return klass, kwargs
+
+
+def warm_routes():
+    """Import every handler module in a daemon thread, so the first connection
+    to a route does not pay for its imports."""
+
+    def _warm():
+        for _, module_path in ROUTES:
+            try:
+                load_route_class(module_path)
+            except Exception as e:
+                logger.warning('Warm up %s failed: %s', module_path, e)
+        for module_name in LAZY_IMPORTS:
+            try:
+                importlib.import_module(module_name)
+            except Exception as e:
+                logger.warning('Warm up %s failed: %s', module_name, e)
+
+    t = threading.Thread(target=_warm, name='warm-routes', daemon=True)
+    t.start()
+    return t
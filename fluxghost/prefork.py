@@ -0,0 +1,246 @@
+"""`ghost.py --workers N`: N server processes sharing one port.
+
+ghost.py builds the server as usual, then `fork_workers` forks N - 1 copies
+of it before any thread is started. Each copy closes the listening sockets
+it inherited and binds its own to the same address with SO_REUSEPORT, so
+the kernel spreads new connections over all N processes, and then runs the
+normal `serve_forever` of its runmode. CPU-bound commands of different
+connections no longer share one GIL.
+
+The first process, which printed the ready line, is the discovery leader:
+only it owns fluxclient's `DeviceDiscover` sockets. A device whose
+discover message changed (and every device again each LISTENER_REFRESH
+seconds, see fluxghost/device_registry.py) is pickled to the workers over
+a socketpair, where it replaces the worker's copy (`DeviceRegistry.update`),
+so the discover websocket and the device connections of a worker see the
+same devices. A worker's `server.discover` is a `DiscoverProxy` sending
+`poke`, `poketcp`, `testtcp` and forgotten devices back to the leader.
+
+A worker exits when its link to the leader closes. When a worker dies, the
+leader stops itself with SIGTERM, and so the other workers as well: it can
+not fork a new worker once it runs threads, and a server quietly running
+on fewer workers is worse than one a supervisor restarts whole.
+
+Per process, not shared: `/metrics` and `/ws/diagnostics` figures, the
+upload RAM budget, and the push-studio connection, so an inter-process
+upload reaches Beam Studio only if both connections landed on the same
+process.
+"""
+
+import logging
+import os
+import pickle
+import selectors
+import signal
+import socket
+import struct
+import threading
+
+from fluxghost.utils import metrics
+
+__all__ = ['fork_workers']
+
+logger = logging.getLogger('PREFORK')
+
+HEADER = struct.Struct('>I')
+# Discover commands a worker may run on the leader's DeviceDiscover
+DISCOVER_COMMANDS = ('poke', 'add_poketcp_ipaddr', 'test_poketcp_ipaddr')
+
+
+def _send(sock, lock, data):
+    with lock:
+        sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv(sock):
+    """The next message on sock, or None once it is closed."""
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, HEADER.unpack(header)[0])
+    return None if data is None else pickle.loads(data)
+
+
+class Leader(threading.Thread):
+    """The leader's ends of the links, and the thread serving the workers' requests."""
+
+    def __init__(self, server):
+        super().__init__(name='prefork-leader', daemon=True)
+        self.server = server
+        # pid -> (socket, send lock)
+        self.links = {}
+        self.unpicklable = set()
+
+    def add(self, pid, sock):
+        self.links[pid] = (sock, threading.Lock())
+
+    def broadcast(self, message):
+        data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        for pid, (sock, lock) in list(self.links.items()):
+            try:
+                _send(sock, lock, data)
+            except OSError as e:
+                logger.warning('Worker %i unreachable: %s', pid, e)
+
+    def on_device(self, uuid, device):
+        try:
+            self.broadcast(('device', uuid, device))
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            if uuid not in self.unpicklable:
+                self.unpicklable.add(uuid)
+                logger.error('Device %s can not be sent to the workers: %s', uuid, e)
+
+    def run(self):
+        selector = selectors.DefaultSelector()
+        for pid, (sock, _) in self.links.items():
+            selector.register(sock, selectors.EVENT_READ, pid)
+        while self.links:
+            for key, _ in selector.select():
+                pid = key.data
+                try:
+                    message = _recv(key.fileobj)
+                except (OSError, pickle.UnpicklingError, EOFError):
+                    message = None
+                if message is None:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    del self.links[pid]
+                    _, status = os.waitpid(pid, 0)
+                    logger.critical('Worker %i exited with status %i, stopping the server', pid, status)
+                    os.kill(os.getpid(), signal.SIGTERM)
+                    return
+                else:
+                    self.handle(message)
+
+    def handle(self, message):
+        command, args = message[0], message[1:]
+        disc = self.server.discover
+        try:
+            if command == 'forget':
+                self.server.discover_devices.pop(args[0], None)
+                if disc is not None:
+                    disc.devices.pop(args[0], None)
+            elif command in DISCOVER_COMMANDS and disc is not None:
+                getattr(disc, command)(*args)
+        except Exception as e:
+            logger.error('Worker request %s error: %r', command, e)
+
+
+class _ForwardedDevices:
+    """`DiscoverProxy.devices`, for control_base dropping a device."""
+
+    def __init__(self, link):
+        self.link = link
+
+    def pop(self, uuid, default=None):
+        self.link.request('forget', uuid)
+        return default
+
+
+class DiscoverProxy:
+    """A worker's `server.discover`: discover commands run on the leader."""
+
+    socks = ()
+    tcp_devices = ()
+
+    def __init__(self, link):
+        self.link = link
+        self.devices = _ForwardedDevices(link)
+
+    def poke(self, ipaddr):
+        self.link.request('poke', ipaddr)
+
+    def add_poketcp_ipaddr(self, ipaddr):
+        self.link.request('add_poketcp_ipaddr', ipaddr)
+
+    def test_poketcp_ipaddr(self, ipaddr, timeout):
+        self.link.request('test_poketcp_ipaddr', ipaddr, timeout)
+
+
+class LeaderLink(threading.Thread):
+    """A worker's end of its link: applies what the leader sends."""
+
+    def __init__(self, server, sock):
+        super().__init__(name='prefork-worker', daemon=True)
+        self.server = server
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def request(self, *message):
+        try:
+            _send(self.sock, self.lock, pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
+        except OSError as e:
+            logger.error('Leader unreachable: %s', e)
+
+    def run(self):
+        while True:
+            try:
+                message = _recv(self.sock)
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                logger.error('Link to the leader broken: %r', e)
+                message = None
+            if message is None:
+                # The leader is gone, so is the ready line's process
+                os._exit(0)
+            if message[0] == 'device':
+                self.server.device_registry.update(message[1], message[2])
+            elif message[0] == 'reload_certs':
+                self.server.reload_certs()
+
+
+def _become_worker(server, sock):
+    # Sockets of our own in the SO_REUSEPORT group, instead of the leader's
+    server.sock.close()
+    server.sock = server.listen(server.sock_address)
+    if server.ssl_sock:
+        server.ssl_sock.close()
+        server.ssl_sock = server.listen(server.ssl_sock_address)
+
+    for discover_sock in getattr(server, 'discover_socks', ()):
+        discover_sock.close()
+    link = LeaderLink(server, sock)
+    server.discover = DiscoverProxy(link)
+    server.discover_socks = ()
+    link.start()
+
+
+def fork_workers(server, count):
+    """Fork count - 1 workers of server, which must listen with reuse_port.
+
+    Return 0 in the leader, and the worker's number, 1 to count - 1, in a
+    worker. Call before starting any thread.
+    """
+    if not hasattr(os, 'fork') or not hasattr(socket, 'SO_REUSEPORT'):
+        raise RuntimeError('--workers needs fork() and SO_REUSEPORT')
+
+    server.sock_address = server.sock.getsockname()
+    server.ssl_sock_address = server.ssl_sock.getsockname() if server.ssl_sock else None
+    leader = Leader(server)
+    for index in range(1, count):
+        ours, theirs = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            ours.close()
+            for sock, _ in leader.links.values():
+                sock.close()
+            _become_worker(server, theirs)
+            metrics.WORKER.set(index)
+            logger.info('Worker %i started', index)
+            return index
+        theirs.close()
+        leader.add(pid, ours)
+
+    server.workers = leader
+    server.device_registry.listeners.append(leader.on_device)
+    leader.start()
+    return 0
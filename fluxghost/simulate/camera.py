@@ -19,8 +19,8 @@ class SimulateCamera:
             self._buf = IMAGE_BUF
 
         # A socketpair (not os.pipe) so the read end is selectable on Windows;
-        # ApiBase._serve_forever selects on it and select() rejects non-socket
-        # fds on Windows (WinError 10038).
+        # ApiBase._serve_forever waits on it, with select() on Windows, which
+        # rejects non-socket fds (WinError 10038).
         self._sock_r, self._sock_w = socket.socketpair()
         self._thread = Thread(target=self.__trigger)
         self._thread.daemon = True
@@ -0,0 +1,193 @@
+"""Latency of websocket commands, per route and command.
+
+`timed(handler, command, params)` wraps the dispatch of one text command
+(`OnTextMessageMixin`, `ControlApi.invoke_command`). `completion(handler)`
+wraps the callback which runs once the upload that command started has
+arrived; it is recorded as `<command> upload`.
+
+Each duration goes to the Prometheus histogram of fluxghost/utils/metrics.py
+and to an in-process `LatencyHistogram`, which keeps exact percentiles
+(within 1/64) for the `command_stats` command of the diagnostics route. A
+command slower than the slow threshold is logged with its parameters.
+
+Commands of a connection opened with `?profile=1` also run under cProfile,
+see fluxghost/debug/command_profile.py, and each command is a span when
+tracing is on, see fluxghost/utils/tracing.py.
+"""
+
+import contextlib
+import logging
+import threading
+from time import perf_counter
+
+from fluxghost.debug import command_profile
+from fluxghost.utils import tracing
+
+__all__ = ['LatencyHistogram', 'completion', 'configure', 'reset', 'snapshot', 'timed']
+
+logger = logging.getLogger('COMMAND')
+
+SLOW_THRESHOLD = 1.0
+# Parameters are cut to this many characters in the slow command log
+PARAMS_LIMIT = 200
+
+_histograms = {}
+_lock = threading.Lock()
+
+
+def configure(slow_ms=None):
+    global SLOW_THRESHOLD
+    if slow_ms is not None:
+        SLOW_THRESHOLD = slow_ms / 1000.0
+
+
+class LatencyHistogram:
+    """Log-linear histogram of durations in microseconds, like HdrHistogram.
+
+    Values below 128 us are counted exactly; above, each power of two is cut
+    into 64 buckets, so a reported value is at most 1/64 below the recorded
+    one whatever the magnitude. Buckets are kept in a dict, an idle command
+    costs a few entries.
+    """
+
+    SUB_BITS = 7
+    SUB_COUNT = 1 << SUB_BITS
+    HALF_COUNT = SUB_COUNT >> 1
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def index(cls, value):
+        if value < cls.SUB_COUNT:
+            return value
+        shift = value.bit_length() - cls.SUB_BITS
+        return cls.SUB_COUNT + (shift - 1) * cls.HALF_COUNT + (value >> shift) - cls.HALF_COUNT
+
+    @classmethod
+    def lowest(cls, index):
+        # Smallest value counted in bucket index
+        if index < cls.SUB_COUNT:
+            return index
+        shift, sub = divmod(index - cls.SUB_COUNT, cls.HALF_COUNT)
+        return (sub + cls.HALF_COUNT) << (shift + 1)
+
+    def record(self, seconds):
+        value = int(seconds * 1e6)
+        idx = self.index(value)
+        with self.lock:
+            self.counts[idx] = self.counts.get(idx, 0) + 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def percentiles(self, *quantiles):
+        """Values in microseconds at the given quantiles (0..1), in order."""
+        with self.lock:
+            items = sorted(self.counts.items())
+            count = self.count
+            largest = self.max
+        targets = iter(sorted((max(1, round(q * count)), i) for i, q in enumerate(quantiles)))
+        target = next(targets, None)
+        values = [0] * len(quantiles)
+        acc = 0
+        for idx, n in items:
+            acc += n
+            while target is not None and acc >= target[0]:
+                values[target[1]] = min(self.lowest(idx), largest)
+                target = next(targets, None)
+        return values
+
+    def summary(self):
+        p50, p90, p99, p999 = self.percentiles(0.5, 0.9, 0.99, 0.999)
+        return {
+            'count': self.count,
+            'total_ms': self.total / 1000,
+            'mean_ms': self.total / self.count / 1000 if self.count else 0,
+            'min_ms': (self.min or 0) / 1000,
+            'p50_ms': p50 / 1000,
+            'p90_ms': p90 / 1000,
+            'p99_ms': p99 / 1000,
+            'p999_ms': p999 / 1000,
+            'max_ms': self.max / 1000,
+        }
+
+
+def _histogram(route, command):
+    key = (route, command)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(key, LatencyHistogram())
+    return histogram
+
+
+def _truncate(params):
+    if not isinstance(params, str):
+        params = ' '.join(str(p) for p in params)
+    if len(params) > PARAMS_LIMIT:
+        return '%s... (%i chars)' % (params[:PARAMS_LIMIT], len(params))
+    return params
+
+
+def _record(stats, command, params, elapsed):
+    stats.command(command).observe(elapsed)
+    _histogram(stats.route, command).record(elapsed)
+    if elapsed >= SLOW_THRESHOLD:
+        logger.warning('Slow command %s %r took %.0f ms: %s', stats.route, command, elapsed * 1000, _truncate(params))
+
+
+@contextlib.contextmanager
+def timed(handler, command, params=''):
+    """Time one command dispatched by handler, and remember it as the handler's last command."""
+    handler.last_command = (command, params)
+    started = perf_counter()
+    try:
+        with tracing.command_span(handler, command, params), command_profile.profiled(handler, command):
+            yield
+    finally:
+        _record(handler.stats, command, params, perf_counter() - started)
+
+
+def completion(handler):
+    """Return a context manager factory timing the upload callback of the handler's last command."""
+    command, params = handler.last_command or ('(none)', '')
+    stats = handler.stats
+    command += ' upload'
+    callback_span = tracing.callback_span(handler, command)
+
+    @contextlib.contextmanager
+    def _timed():
+        started = perf_counter()
+        try:
+            with callback_span(), command_profile.profiled(handler, command):
+                yield
+        finally:
+            _record(stats, command, params, perf_counter() - started)
+
+    return _timed
+
+
+def snapshot(route=None):
+    """Summaries of every (route, command) seen, slowest in total first."""
+    with _lock:
+        items = list(_histograms.items())
+    rows = []
+    for (r, command), histogram in items:
+        if route is None or r == route:
+            rows.append(dict(route=r, command=command, **histogram.summary()))
+    rows.sort(key=lambda row: row['total_ms'], reverse=True)
+    return rows
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
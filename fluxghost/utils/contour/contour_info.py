@@ -89,5 +89,5 @@ def get_contour_info(contour_data: ContourData, base_contour_kd_tree, base_area=
     bbox = cv2.boundingRect(contour)
     res = {'center': center, 'angle': angle, 'bbox': bbox}
     if include_contour:
-        res['contour'] = contour.reshape(-1, 2).tolist()
+        res['contour'] = contour.reshape(-1, 2)
     return res
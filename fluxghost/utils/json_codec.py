@@ -0,0 +1,75 @@
+"""JSON encoding of outgoing text frames.
+
+`dumps()` takes numpy arrays and numpy scalars anywhere in the payload, so
+handlers can send calibration matrices and contours without building nested
+lists with `.tolist()` first. It uses orjson, which serializes numpy arrays
+in C, when it is installed and the stdlib encoder otherwise; `use_backend()`
+picks one explicitly.
+
+Unlike the stdlib encoder, orjson writes NaN and Infinity as `null` (both are
+invalid JSON for the frontend's `JSON.parse` anyway) and omits the spaces
+after separators.
+"""
+
+import json
+import logging
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger('JSON')
+
+__all__ = ['BACKENDS', 'backend', 'dumps', 'use_backend']
+
+
+def _default(obj):
+    # numpy is imported by the handlers that use it, not here: until one of
+    # them did, obj can not be a numpy object.
+    np = sys.modules.get('numpy')
+    if np is None:
+        raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+
+_stdlib_encoder = json.JSONEncoder(default=_default, check_circular=False)
+
+
+def _stdlib_dumps(obj):
+    return _stdlib_encoder.encode(obj)
+
+
+def _orjson_dumps(obj):
+    # Arrays orjson can not take natively (not C-contiguous, object dtype)
+    # still go through _default.
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+
+
+BACKENDS = {'stdlib': _stdlib_dumps}
+if orjson is not None:
+    BACKENDS['orjson'] = _orjson_dumps
+
+backend = 'orjson' if orjson is not None else 'stdlib'
+_dumps = BACKENDS[backend]
+
+
+def use_backend(name):
+    """Select the encoder: 'orjson', 'stdlib' or 'auto' (orjson when installed)."""
+    global backend, _dumps
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'stdlib'
+    if name not in BACKENDS:
+        raise ValueError('JSON backend %r is not available' % name)
+    backend = name
+    _dumps = BACKENDS[name]
+    logger.debug('JSON backend: %s', name)
+
+
+def dumps(obj):
+    return _dumps(obj)
@@ -0,0 +1,157 @@
+"""Bytes pinned by websocket connections, under one budget for the process.
+
+Each connection has a `MemoryAccount` (`BinaryHelperMixin.memory`, fluxghost/
+api/misc.py) recording what it holds, per subsystem: the upload in progress
+(its declared length, until every byte arrived and the callback takes over),
+the decoded images of opencv and of the fisheye calibration, the SVGs of the
+laser parser and the task code it built.
+
+A heavy command first calls `account.admit(subsystem, nbytes)`. When the
+bytes held by all connections plus nbytes do not fit `--memory-budget`,
+caches untouched for IDLE_AFTER seconds (`account.cache`, e.g. the images
+opencv keeps for `sharpen`) are dropped, least recently used first; if that
+is still not enough the command is refused with MemoryBudgetExceeded, which
+`OnTextMessageMixin` replies as
+
+    {"status": "error", "error": "MEMORY_BUDGET_EXCEEDED", "info": "..."}
+
+The figures are estimates (the size of an SVG once parsed is not known, its
+upload size is counted), and go to `/metrics` and the `memory` command of
+/ws/diagnostics.
+"""
+
+import logging
+import threading
+import weakref
+from time import monotonic
+
+from fluxghost.utils import metrics
+
+__all__ = ['MemoryAccount', 'MemoryBudgetExceeded', 'configure', 'snapshot']
+
+logger = logging.getLogger('MEMORY')
+
+BUDGET = 2**31
+IDLE_AFTER = 60.0
+
+_lock = threading.Lock()
+_accounts = weakref.WeakSet()
+_used = 0
+# subsystem -> bytes held by all connections
+_subsystems = {}
+
+metrics.MEMORY_BUDGET.set(BUDGET)
+
+
+def configure(budget=None):
+    global BUDGET
+    if budget is not None:
+        BUDGET = budget
+    metrics.MEMORY_BUDGET.set(BUDGET)
+
+
+class MemoryBudgetExceeded(Exception):
+    def __init__(self, subsystem, nbytes):
+        super().__init__(
+            '%s needs %i bytes, %i of the %i bytes budget are held' % (subsystem, nbytes, _used, BUDGET)
+        )
+        self.subsystem = subsystem
+        self.nbytes = nbytes
+
+
+def _set(account, subsystem, nbytes):
+    # With _lock held
+    global _used
+    delta = nbytes - account.held.get(subsystem, 0)
+    _used += delta
+    _subsystems[subsystem] = _subsystems.get(subsystem, 0) + delta
+    metrics.MEMORY_HELD.labels(subsystem).set(_subsystems[subsystem])
+    if nbytes:
+        account.held[subsystem] = nbytes
+    else:
+        account.held.pop(subsystem, None)
+    account.touched[subsystem] = monotonic()
+
+
+def _idle_caches():
+    # With _lock held: (touched, account, subsystem) of idle caches, least recently used first
+    now = monotonic()
+    found = []
+    for account in _accounts:
+        for subsystem in account.caches:
+            touched = account.touched.get(subsystem, now)
+            if account.held.get(subsystem) and now - touched > IDLE_AFTER:
+                found.append((touched, id(account), account, subsystem))
+    found.sort(key=lambda item: item[:2])
+    return [(account, subsystem) for _, _, account, subsystem in found]
+
+
+class MemoryAccount:
+    """The bytes one connection holds, per subsystem."""
+
+    def __init__(self, route):
+        self.route = route
+        self.held = {}
+        self.touched = {}
+        # subsystem -> callable dropping it
+        self.caches = {}
+        with _lock:
+            _accounts.add(self)
+
+    def set(self, subsystem, nbytes):
+        """Record that the connection holds nbytes for subsystem now."""
+        with _lock:
+            _set(self, subsystem, nbytes)
+
+    def touch(self, subsystem):
+        self.touched[subsystem] = monotonic()
+
+    def cache(self, subsystem, evict):
+        """Let admission call evict() to drop subsystem once idle; evict must set it to 0."""
+        self.caches[subsystem] = evict
+
+    def admit(self, subsystem, nbytes):
+        """Set subsystem to nbytes if that fits the budget, else raise MemoryBudgetExceeded."""
+        with _lock:
+            if _used - self.held.get(subsystem, 0) + nbytes <= BUDGET:
+                _set(self, subsystem, nbytes)
+                return
+            idle = _idle_caches()
+
+        for account, cache in idle:
+            held = account.held.get(cache, 0)
+            try:
+                account.caches[cache]()
+            except Exception:
+                logger.exception('Evict %s of %s', cache, account.route)
+                continue
+            logger.info('Evicted %i idle bytes of %s %s', held, account.route, cache)
+            metrics.MEMORY_EVICTED.labels(cache).inc(held)
+            with _lock:
+                if _used - self.held.get(subsystem, 0) + nbytes <= BUDGET:
+                    _set(self, subsystem, nbytes)
+                    return
+
+        metrics.MEMORY_REJECTED.labels(subsystem).inc()
+        raise MemoryBudgetExceeded(subsystem, nbytes)
+
+    def close(self):
+        with _lock:
+            for subsystem in list(self.held):
+                _set(self, subsystem, 0)
+            self.caches.clear()
+            _accounts.discard(self)
+
+
+def snapshot():
+    """Budget, bytes held per subsystem, and per connection, the largest first."""
+    with _lock:
+        connections = [
+            {'route': account.route, 'bytes': sum(account.held.values()), 'subsystems': dict(account.held)}
+            for account in _accounts
+            if account.held
+        ]
+        subsystems = {subsystem: nbytes for subsystem, nbytes in _subsystems.items() if nbytes}
+        used = _used
+    connections.sort(key=lambda c: c['bytes'], reverse=True)
+    return {'budget': BUDGET, 'used': used, 'subsystems': subsystems, 'connections': connections}
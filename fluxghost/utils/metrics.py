@@ -0,0 +1,292 @@
+"""In-process metrics, exported in the Prometheus text format on `GET /metrics`.
+
+A metric is a Counter (named with its `_total` suffix), Gauge or Histogram
+with a fixed set of label names; `labels(*values)` returns the series for one
+set of values, created on first use and cached, so hot paths look a series
+up once and keep it. Updating a series takes one lock and a few additions.
+
+The metrics fluxghost exports are defined at the bottom of this module.
+"""
+
+import bisect
+import contextlib
+import threading
+from time import perf_counter
+
+from fluxghost import __version__
+
+__all__ = [
+    'REGISTRY',
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'Registry',
+    'render',
+    'toolpath_stage',
+    'websocket_stats',
+]
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+SIZE_BUCKETS = tuple(2 ** (10 + 2 * i) for i in range(11))  # 1 KB ... 1 GB
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return '%i' % value
+    return repr(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_text = ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+                    lines.append('%s{%s} %s' % (name, label_text, _format_value(value)))
+                else:
+                    lines.append('%s %s' % (name, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def render():
+    return REGISTRY.render()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.series[()] = self._new_series()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        series = self.series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError('%s takes labels %s' % (self.name, self.labelnames))
+            with self.lock:
+                series = self.series.setdefault(values, self._new_series())
+        return series
+
+    def __getattr__(self, attr):
+        # A metric without labels acts as its only series
+        if attr in ('inc', 'dec', 'set', 'set_function', 'observe', 'time', 'get'):
+            return getattr(self.series[()], attr)
+        raise AttributeError(attr)
+
+    def samples(self):
+        with self.lock:
+            items = list(self.series.items())
+        for values, series in items:
+            labels = list(zip(self.labelnames, values))
+            for suffix, extra, value in series.samples():
+                yield self.name + suffix, labels + extra, value
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def get(self):
+        return self.value
+
+    def samples(self):
+        return (('', [], self.value),)
+
+
+class _CounterValue(_Value):
+    pass
+
+
+class _GaugeValue(_Value):
+    function = None
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = float(value)
+
+    def set_function(self, fn):
+        """Report fn() at render time instead of a stored value."""
+        self.function = fn
+
+    def get(self):
+        return self.function() if self.function else self.value
+
+    def samples(self):
+        return (('', [], self.get()),)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_series(self):
+        return _CounterValue()
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_series(self):
+        return _GaugeValue()
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[idx] += 1
+            self.sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started)
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        acc = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            acc += count
+            yield '_bucket', [('le', _format_value(float(bound)))], acc
+        yield '_sum', [], total
+        yield '_count', [], acc
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_series(self):
+        return _HistogramValue(self.buckets)
+
+
+INFO = Gauge('fluxghost_info', 'fluxghost version', ('version',))
+INFO.labels(__version__).set(1)
+
+THREADS = Gauge('fluxghost_threads', 'Threads of the fluxghost process')
+THREADS.set_function(threading.active_count)
+WORKER = Gauge('fluxghost_worker', 'Number of this process among --workers, 0 for the leader')
+
+WS_CONNECTIONS = Gauge('fluxghost_websocket_connections', 'Open websocket connections', ('route',))
+WS_OPENED = Counter('fluxghost_websocket_accepted_total', 'Websocket connections accepted', ('route',))
+WS_MESSAGES = Counter('fluxghost_websocket_messages_total', 'Websocket data messages', ('route', 'direction'))
+WS_BYTES = Counter('fluxghost_websocket_bytes_total', 'Websocket data message payload bytes', ('route', 'direction'))
+
+COMMAND_SECONDS = Histogram(
+    'fluxghost_command_duration_seconds', 'Time to handle a text command', ('route', 'command')
+)
+TOOLPATH_STAGE_SECONDS = Histogram(
+    'fluxghost_toolpath_stage_duration_seconds', 'Duration of svgeditor-laser-parser stages', ('stage',)
+)
+CAMERA_FRAMES = Counter('fluxghost_camera_frames_total', 'Camera frames received from devices', ('state',))
+UPLOAD_BYTES = Histogram(
+    'fluxghost_upload_bytes', 'Declared size of binary uploads', ('storage',), buckets=SIZE_BUCKETS
+)
+DISCOVER_DATAGRAMS = Counter('fluxghost_discover_datagrams_total', 'Discovery datagrams read', ('result',))
+DISCOVER_FULL_ROUNDS = Counter(
+    'fluxghost_discover_full_rounds_total', 'Rounds of discovery reads which stopped at their limit'
+)
+DISCOVER_SOCKET_DROPS = Gauge(
+    'fluxghost_discover_socket_drops', 'Datagrams dropped by the kernel on full discovery sockets (Linux)'
+)
+OFFLOAD_JOBS = Counter('fluxghost_offload_jobs_total', 'Jobs run in the offload process pool', ('result',))
+MEMORY_BUDGET = Gauge('fluxghost_memory_budget_bytes', 'Bytes websocket connections may hold together')
+MEMORY_HELD = Gauge('fluxghost_memory_held_bytes', 'Bytes held by websocket connections', ('subsystem',))
+MEMORY_EVICTED = Counter(
+    'fluxghost_memory_evicted_bytes_total', 'Bytes of idle caches dropped to admit a command', ('subsystem',)
+)
+MEMORY_REJECTED = Counter(
+    'fluxghost_memory_rejected_total', 'Commands refused because the memory budget was exceeded', ('subsystem',)
+)
+
+
+def toolpath_stage(stage):
+    """Context manager timing one toolpath stage."""
+    return TOOLPATH_STAGE_SECONDS.labels(stage).time()
+
+
+class WebsocketStats:
+    """The series of one websocket route, looked up once per connection."""
+
+    def __init__(self, route, registered=True):
+        self.route = route
+        if registered:
+            self.connections = WS_CONNECTIONS.labels(route)
+            self.opened = WS_OPENED.labels(route)
+            self.messages_in = WS_MESSAGES.labels(route, 'in')
+            self.messages_out = WS_MESSAGES.labels(route, 'out')
+            self.bytes_in = WS_BYTES.labels(route, 'in')
+            self.bytes_out = WS_BYTES.labels(route, 'out')
+        else:
+            # Not exported: connections which never went through routing
+            self.connections = _GaugeValue()
+            self.opened = self.messages_in = self.messages_out = _CounterValue()
+            self.bytes_in = self.bytes_out = _CounterValue()
+
+    def command(self, command):
+        return COMMAND_SECONDS.labels(self.route, command)
+
+
+_websocket_stats = {}
+UNROUTED = WebsocketStats('unrouted', registered=False)
+
+
+def websocket_stats(route):
+    stats = _websocket_stats.get(route)
+    if stats is None:
+        stats = _websocket_stats.setdefault(route, WebsocketStats(route))
+    return stats
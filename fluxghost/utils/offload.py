@@ -0,0 +1,264 @@
+"""CPU-bound work of websocket commands, in a pool of processes.
+
+`ghost.py --offload-processes N` starts up to N worker processes, on the
+first job; the default, 0, runs every job inline, as before. `submit(fn,
+*args)` returns a `concurrent.futures.Future`: the commands of the opencv,
+utils, camera-calibration and image-tracer routes reply from its done
+callback (`OffloadMixin` of fluxghost/api/misc.py), so the connection thread
+is free again at once, and the pure-Python parts of the work no longer hold
+the GIL of the server process.
+
+Numpy arrays among the positional arguments, the decoded images, are copied
+once into `multiprocessing.shared_memory` and mapped by the worker instead
+of being pickled; the rest of the arguments and the result are pickled, so
+fn must be a module-level function.
+
+`cancel(future)` drops a queued job, and kills the process running a
+started one: the future ends with CancelledError and the next job gets a
+new process.
+"""
+
+import collections
+import logging
+import signal
+import sys
+import threading
+from concurrent.futures import CancelledError, Future
+
+from fluxghost.utils import metrics
+
+__all__ = ['OffloadPool', 'cancel', 'configure', 'submit']
+
+logger = logging.getLogger('OFFLOAD')
+
+SharedRef = collections.namedtuple('SharedRef', 'name shape dtype')
+
+OK = metrics.OFFLOAD_JOBS.labels('ok')
+FAILED = metrics.OFFLOAD_JOBS.labels('error')
+CANCELLED = metrics.OFFLOAD_JOBS.labels('cancelled')
+
+_pool = None
+_SETTLED = object()
+
+
+def configure(processes=None):
+    global _pool
+    if processes:
+        _pool = OffloadPool(processes)
+
+
+def submit(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) in the pool, or inline without one; return its Future."""
+    if _pool is not None:
+        return _pool.submit(fn, *args, **kwargs)
+
+    future = Future()
+    future.set_running_or_notify_cancel()
+    try:
+        future.set_result(fn(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def cancel(future):
+    """Cancel the job of future, unless it is done already. Return whether it was cancelled."""
+    if _pool is not None:
+        return _pool.cancel(future)
+    return future.cancel()
+
+
+class SharedArray:
+    """A copy of a numpy array in shared memory, for the length of one job."""
+
+    def __init__(self, array):
+        from multiprocessing import shared_memory
+
+        import numpy as np
+
+        array = np.ascontiguousarray(array)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=self.shm.buf)[...] = array
+        self.ref = SharedRef(self.shm.name, array.shape, array.dtype.str)
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _serve(conn):
+    """Main of a worker process: run jobs from conn until the server closes it."""
+    from multiprocessing import shared_memory
+
+    import numpy as np
+
+    # Ctrl-C in a terminal is for the server, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            fn, args, kwargs = conn.recv()
+        except (EOFError, OSError):
+            return
+
+        mapped = []
+        try:
+            for i, arg in enumerate(args):
+                if isinstance(arg, SharedRef):
+                    shm = shared_memory.SharedMemory(arg.name)
+                    mapped.append(shm)
+                    args[i] = np.ndarray(arg.shape, np.dtype(arg.dtype), buffer=shm.buf)
+            reply = (True, fn(*args, **kwargs))
+        except Exception as e:
+            reply = (False, e)
+        del args
+        for shm in mapped:
+            try:
+                shm.close()
+            except BufferError:
+                # The result holds a view of it, unmapped with the result
+                pass
+
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # An unpicklable result or exception
+            conn.send((False, RuntimeError('%s: %r' % (fn.__name__, e))))
+
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, theirs = context.Pipe()
+        self.process = context.Process(target=_serve, args=(theirs,), name='fluxghost-offload', daemon=True)
+        self.process.start()
+        theirs.close()
+
+    def close(self):
+        self.conn.close()
+        self.process.join()
+
+
+class OffloadPool:
+    def __init__(self, processes):
+        # Imported with the first pool, not with the server
+        import multiprocessing
+
+        import numpy as np
+
+        self.ndarray = np.ndarray
+        self.processes = processes
+        if getattr(sys, 'frozen', False) or 'forkserver' not in multiprocessing.get_all_start_methods():
+            # PyInstaller builds support spawn only (see multiprocessing.freeze_support in ghost.py)
+            self.context = multiprocessing.get_context('spawn')
+        else:
+            # Not fork: the server has threads by now
+            self.context = multiprocessing.get_context('forkserver')
+        self.lock = threading.Lock()
+        self.idle = []
+        self.started = 0
+        self.pending = collections.deque()
+        # future -> _Worker running it, None while the process starts
+        self.running = {}
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        shared = []
+        try:
+            args = [self._share(arg, shared) for arg in args]
+        except Exception:
+            self._release(shared)
+            raise
+        future.add_done_callback(lambda _: self._release(shared))
+        with self.lock:
+            self.pending.append((future, fn, args, kwargs))
+        self._dispatch()
+        return future
+
+    def cancel(self, future):
+        if future.cancel():
+            return True
+        with self.lock:
+            # Whoever takes the future out of running settles it
+            worker = self.running.pop(future, _SETTLED)
+        if worker is _SETTLED:
+            return False
+        CANCELLED.inc()
+        future.set_exception(CancelledError())
+        if worker is not None:
+            # Its thread sees the pipe close and drops it
+            worker.process.kill()
+        return True
+
+    def _share(self, arg, shared):
+        if isinstance(arg, self.ndarray):
+            shared.append(SharedArray(arg))
+            return shared[-1].ref
+        return arg
+
+    def _release(self, shared):
+        for array in shared:
+            try:
+                array.release()
+            except OSError as e:
+                logger.warning('Release shared memory %s: %r', array.ref.name, e)
+
+    def _dispatch(self):
+        with self.lock:
+            while self.pending and (self.idle or self.started < self.processes):
+                future, fn, args, kwargs = self.pending.popleft()
+                if not future.set_running_or_notify_cancel():
+                    CANCELLED.inc()
+                    continue
+                if self.idle:
+                    worker = self.idle.pop()
+                else:
+                    worker = None
+                    self.started += 1
+                self.running[future] = worker
+                thread = threading.Thread(target=self._run, args=(worker, future, fn, args, kwargs), daemon=True)
+                thread.start()
+
+    def _run(self, worker, future, fn, args, kwargs):
+        try:
+            if worker is None:
+                worker = _Worker(self.context)
+                with self.lock:
+                    cancelled = future not in self.running
+                    if not cancelled:
+                        self.running[future] = worker
+                if cancelled:
+                    raise EOFError('cancelled while starting')
+            worker.conn.send((fn, args, kwargs))
+            outcome = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            if worker is not None:
+                worker.close()
+            with self.lock:
+                self.started -= 1
+                owned = self.running.pop(future, _SETTLED) is not _SETTLED
+            if owned:
+                logger.error('Offload process of %s died: %r', fn.__name__, e)
+                outcome = (False, RuntimeError('OFFLOAD_PROCESS_DIED'))
+        except Exception as e:
+            # fn or its arguments can not be pickled, or no process could be started
+            with self.lock:
+                if worker is None:
+                    self.started -= 1
+                else:
+                    self.idle.append(worker)
+                owned = self.running.pop(future, _SETTLED) is not _SETTLED
+            outcome = (False, e)
+        else:
+            with self.lock:
+                self.idle.append(worker)
+                owned = self.running.pop(future, _SETTLED) is not _SETTLED
+
+        # Done callbacks run here, and may submit the next job
+        if owned:
+            ok, value = outcome
+            if ok:
+                OK.inc()
+                future.set_result(value)
+            else:
+                FAILED.inc()
+                future.set_exception(value)
+        self._dispatch()
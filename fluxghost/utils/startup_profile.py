@@ -0,0 +1,172 @@
+"""Startup profiling for `ghost.py --profile-startup <path>`.
+
+Records wall-clock spans of the startup phases in `ghost.main` and
+`HttpServerBase.__init__`, and the time spent importing each module in the
+`-X importtime` manner (self and cumulative, nested imports included in the
+importer's cumulative time). `finish()` writes both as one JSON report.
+
+While the profile is not started `span()` and `mark()` do nothing, so the
+phases stay instrumented in normal runs.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+from time import perf_counter
+
+from fluxghost import __version__
+
+__all__ = ['enabled', 'finish', 'mark', 'span', 'start']
+
+enabled = False
+_origin = 0.0
+_spans = []
+_marks = []
+_depth = 0
+_timer = None
+
+
+class _TimedLoader:
+    # Wraps a module loader while it creates and executes its module, then
+    # puts the original back on the module and its spec.
+    def __init__(self, loader, timer, name):
+        self.loader = loader
+        self.timer = timer
+        self.name = name
+        self.started = None
+
+    def __getattr__(self, attr):
+        return getattr(self.loader, attr)
+
+    def create_module(self, spec):
+        self.timer.enter()
+        self.started = perf_counter()
+        try:
+            return self.loader.create_module(spec)
+        except BaseException:
+            self.timer.leave(self.name, perf_counter() - self.started)
+            raise
+
+    def exec_module(self, module):
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.timer.leave(self.name, perf_counter() - self.started)
+            module.__loader__ = self.loader
+            if getattr(module, '__spec__', None) is not None and module.__spec__.loader is self:
+                module.__spec__.loader = self.loader
+
+
+class ImportTimer:
+    """A `sys.meta_path` finder that times the loading of every module it finds."""
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        with contextlib.suppress(ValueError):
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            loader = spec.loader
+            if hasattr(loader, 'exec_module') and hasattr(loader, 'create_module'):
+                spec.loader = _TimedLoader(loader, self, fullname)
+            return spec
+        return None
+
+    def enter(self):
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+
+    def leave(self, name, elapsed):
+        stack = self.local.stack
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        with self.lock:
+            self.records.append(
+                {
+                    'module': name,
+                    'depth': len(stack),
+                    'self_ms': (elapsed - children) * 1000,
+                    'cumulative_ms': elapsed * 1000,
+                }
+            )
+
+
+def start(origin=None):
+    """Start recording. origin is the perf_counter() value spans are relative to."""
+    global enabled, _origin, _timer
+    if enabled:
+        return
+    enabled = True
+    _origin = perf_counter() if origin is None else origin
+    _timer = ImportTimer()
+    _timer.install()
+
+
+@contextlib.contextmanager
+def _span(name):
+    global _depth
+    started = perf_counter()
+    _depth += 1
+    try:
+        yield
+    finally:
+        _depth -= 1
+        _spans.append(
+            {
+                'name': name,
+                'depth': _depth,
+                'start_ms': (started - _origin) * 1000,
+                'duration_ms': (perf_counter() - started) * 1000,
+            }
+        )
+
+
+def span(name):
+    """Context manager timing one startup phase. Phases may nest."""
+    if not enabled:
+        return contextlib.nullcontext()
+    return _span(name)
+
+
+def mark(name):
+    """Record a point in time, e.g. the ready line."""
+    if enabled:
+        _marks.append({'name': name, 'at_ms': (perf_counter() - _origin) * 1000})
+
+
+def finish(path):
+    """Stop recording and write the report to path."""
+    global enabled
+    if not enabled:
+        return
+    enabled = False
+    total = perf_counter() - _origin
+    _timer.uninstall()
+    report = {
+        'fluxghost': __version__,
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'pid': os.getpid(),
+        'total_ms': total * 1000,
+        'spans': sorted(_spans, key=lambda s: s['start_ms']),
+        'marks': _marks,
+        'imports': _timer.records,
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
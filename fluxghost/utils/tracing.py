@@ -0,0 +1,258 @@
+"""Span tracing of websocket commands and their stages.
+
+Enabled by `ghost.py --trace <file>` (JSON lines, one finished span per line)
+and/or `--trace-otlp <url>` (OTLP/HTTP JSON, e.g.
+http://127.0.0.1:4318/v1/traces of a local collector). Without either,
+`span()` and `stage()` only cost a check.
+
+Every command dispatched through fluxghost/utils/command_timing.py is a root
+span, and the callback of an upload it started is another root span in the
+same trace. Each command starts a new trace, except on handlers listing the
+commands which do in `NEW_TRACE_COMMANDS`: svgeditor-laser-parser starts one
+at `svgeditor_upload` and keeps it for the `go` and `g2f` which follow.
+`stage()` spans nest under the span open in the same thread, and also feed
+the stage histogram of fluxghost/utils/metrics.py.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from fluxghost import __version__
+from fluxghost.utils import metrics
+
+__all__ = ['annotate', 'callback_span', 'command_span', 'configure', 'current', 'span', 'stage']
+
+logger = logging.getLogger('TRACE')
+
+# Parameters of a command are cut to this many characters
+PARAMS_LIMIT = 200
+
+_exporters = []
+_local = threading.local()
+
+
+def new_trace_id():
+    return os.urandom(16).hex()
+
+
+class Span:
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error = None
+        self.start = time.time_ns()
+        self.end = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start / 1e9,
+            'end': self.end / 1e9,
+            'duration_ms': (self.end - self.start) / 1e6,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class JsonLinesExporter:
+    def __init__(self, path):
+        self.file = open(path, 'a', buffering=1)
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self.lock:
+            self.file.write(line + '\n')
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OtlpExporter:
+    """Send spans in the OTLP/HTTP JSON encoding, batched by a background thread."""
+
+    BATCH_SIZE = 256
+    INTERVAL = 2.0
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.queue = queue.Queue(maxsize=10000)
+        self.failed = False
+        threading.Thread(target=self._run, name='otlp-export', daemon=True).start()
+
+    def export(self, span):
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.INTERVAL
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._post(batch)
+
+    def _encode(self, spans):
+        return {
+            'resourceSpans': [
+                {
+                    'resource': {
+                        'attributes': [
+                            {'key': 'service.name', 'value': {'stringValue': 'fluxghost'}},
+                            {'key': 'service.version', 'value': {'stringValue': __version__}},
+                        ]
+                    },
+                    'scopeSpans': [
+                        {
+                            'scope': {'name': 'fluxghost'},
+                            'spans': [
+                                {
+                                    'traceId': s.trace_id,
+                                    'spanId': s.span_id,
+                                    'parentSpanId': s.parent_id or '',
+                                    'name': s.name,
+                                    'kind': 1,
+                                    'startTimeUnixNano': str(s.start),
+                                    'endTimeUnixNano': str(s.end),
+                                    'attributes': [
+                                        {'key': k, 'value': _otlp_value(v)} for k, v in s.attributes.items()
+                                    ],
+                                    'status': {'code': 2, 'message': s.error} if s.error else {'code': 1},
+                                }
+                                for s in spans
+                            ],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def _post(self, spans):
+        from urllib.request import Request, urlopen
+
+        body = json.dumps(self._encode(spans)).encode()
+        request = Request(self.endpoint, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urlopen(request, timeout=10) as resp:
+                resp.read()
+            self.failed = False
+        except OSError as e:
+            # Log once per outage, not once per batch
+            if not self.failed:
+                logger.warning('OTLP export to %s failed: %s', self.endpoint, e)
+            self.failed = True
+
+
+def configure(path=None, otlp_endpoint=None):
+    if path:
+        _exporters.append(JsonLinesExporter(path))
+    if otlp_endpoint:
+        _exporters.append(OtlpExporter(otlp_endpoint))
+
+
+def current():
+    """The span open in this thread, or None."""
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def annotate(**attributes):
+    """Add attributes to the span open in this thread, if any."""
+    s = current()
+    if s is not None:
+        s.set(**attributes)
+
+
+@contextlib.contextmanager
+def _span(name, trace_id, attributes):
+    stack = _local.__dict__.setdefault('stack', [])
+    parent = stack[-1] if stack else None
+    if trace_id is None:
+        trace_id = parent.trace_id if parent else new_trace_id()
+    s = Span(name, trace_id, parent.span_id if parent and parent.trace_id == trace_id else None, attributes)
+    stack.append(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = '%s: %s' % (type(e).__name__, e)
+        raise
+    finally:
+        s.end = time.time_ns()
+        stack.pop()
+        for exporter in _exporters:
+            exporter.export(s)
+
+
+def span(name, trace_id=None, **attributes):
+    """Context manager yielding a span; a child of this thread's open span unless trace_id says otherwise."""
+    if not _exporters:
+        return contextlib.nullcontext(NOOP_SPAN)
+    return _span(name, trace_id, attributes)
+
+
+@contextlib.contextmanager
+def stage(name, **attributes):
+    """A span which is also timed into the toolpath stage histogram."""
+    with metrics.toolpath_stage(name), span(name, **attributes) as s:
+        yield s
+
+
+def _params(params):
+    if not isinstance(params, str):
+        params = ' '.join(str(p) for p in params)
+    return params[:PARAMS_LIMIT]
+
+
+def command_span(handler, command, params=''):
+    """Root span of a command of handler, see the module docstring."""
+    if not _exporters:
+        return contextlib.nullcontext(NOOP_SPAN)
+    new_trace = getattr(handler, 'NEW_TRACE_COMMANDS', None)
+    if new_trace is None or command in new_trace or not getattr(handler, 'trace_id', None):
+        handler.trace_id = new_trace_id()
+    return _span(command, handler.trace_id, {'route': handler.stats.route, 'params': _params(params)})
+
+
+def callback_span(handler, command):
+    """Return a factory of root spans for the upload callback of a command, in the command's trace."""
+    if not _exporters:
+        return lambda: contextlib.nullcontext(NOOP_SPAN)
+    trace_id = getattr(handler, 'trace_id', None)
+    attributes = {'route': handler.stats.route}
+    return lambda: _span(command, trace_id, dict(attributes))
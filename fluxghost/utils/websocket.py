@@ -1,12 +1,18 @@
 import socket
+import ssl
 import struct
+import threading
+import zlib
+from collections import deque
 
 from fluxclient.utils._utils import Utils
+from fluxghost.utils import metrics
 
 # Following is define in RFC 6455
 # WebSocket Frame Flag
 FLAG_FIN = 0x8000
 FLAG_RSVs = 0x7000
+FLAG_RSV1 = 0x4000
 FLAG_OPCODE = 0x0F00
 FLAG_MASK = 0x0080
 FLAG_PAYLOAD = 0x007F
@@ -42,6 +48,24 @@ HAS_FRAGMENT_FLAG = 0x80
 
 MAX_FRAME_SIZE = 2**20
 BUFFER_SIZE = 4096 * 2
+# Frames larger than BUFFER_SIZE are received into a per-connection arena and
+# unmasked in place. The arena is reused and follows the largest of the last
+# ARENA_HISTORY large frames; it is given up above ARENA_RETAIN_LIMIT.
+ARENA_HISTORY = 8
+ARENA_RETAIN_LIMIT = 2**23
+# permessage-deflate (RFC 7692)
+DEFLATE_TAIL = b'\x00\x00\xff\xff'
+DEFLATE_LEVEL = 6
+MAX_INFLATE_SIZE = 2**28
+# Outbound queue: a sender blocks only while more than SEND_HIGH_WATER bytes
+# are waiting; the writer gathers up to SEND_BATCH_FRAMES frames (or
+# SEND_SLICE_SIZE bytes) per sendmsg() call and quits after SEND_WRITER_IDLE
+# seconds without anything to send.
+SEND_HIGH_WATER = 2**24
+SEND_SLICE_SIZE = 2**20
+SEND_COPY_LIMIT = 2**16
+SEND_BATCH_FRAMES = 64
+SEND_WRITER_IDLE = 5.0
 MAGIC_STRING = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
 
 """
@@ -72,6 +96,18 @@ About WebSocketHandler:
 
 
 class WebSocketHandler:
+    send_high_water = SEND_HIGH_WATER
+    # permessage-deflate policy: whether a route accepts it at all, the
+    # smallest message worth compressing and whether binary messages are
+    # compressed (not for routes sending JPEG/PNG).
+    COMPRESSION = True
+    COMPRESS_THRESHOLD = 1024
+    COMPRESS_BINARY = True
+    # Metric series of the route, set once the connection is routed
+    stats = metrics.UNROUTED
+    # (command, params) last dispatched, see fluxghost/utils/command_timing.py
+    last_command = None
+
     def __init__(self, request, client, server, **options):
         self.request = request
         self.client_address = client
@@ -83,6 +119,18 @@ class WebSocketHandler:
         self.recv_offset = 0
         self.buf_view = memoryview(self.buffer)
         self.fragments = None
+        self.arena = None
+        self.arena_sizes = deque(maxlen=ARENA_HISTORY)
+        self.sink_mask = None
+        self.deflate = None
+
+        self.send_high_water = options.get('send_high_water', self.send_high_water)
+        self._send_cond = threading.Condition()
+        self._send_queue = deque()
+        self._send_queued = 0
+        self._send_error = None
+        self._writing = False
+        self._writer = None
 
     def fileno(self):
         return self.request.fileno()
@@ -103,6 +151,8 @@ class WebSocketHandler:
             except WebsocketError:
                 self._closed()
                 raise
+            # Drop the export now, a binary sink is handed back to its owner below
+            buf.release()
 
             if self.recv_flag & WAIT_LARGE_DATA == 0:
                 self.recv_offset += length
@@ -157,23 +207,67 @@ class WebSocketHandler:
                     return self.recv_offset > 0
             else:
                 self.recv_flag |= WAIT_LARGE_DATA
-                self.ext_buffer = bytearray(fullsize)
+                header_size = fullsize - payload_len
+                if self._open_sink(flags, header_size, payload_len):
+                    return self.ext_recv_offset == payload_len
+                self.ext_buffer = self._take_arena(fullsize)
                 self.ext_buffer[: self.recv_offset] = self.buffer[: self.recv_offset]
                 self.ext_recv_offset = self.recv_offset
-                self.ext_buf_view = memoryview(self.ext_buffer)
+                # Never receive past this frame, the arena may be larger
+                self.ext_buf_view = memoryview(self.ext_buffer)[:fullsize]
+                return self.ext_recv_offset == fullsize
         else:
             # Handle message larger then BUFFER_SIZE
-            if self.ext_recv_offset == len(self.ext_buffer):
-                self._handle_message_frame(self.ext_buf_view)
-                self.ext_buffer = None
-                self.ext_recv_offset = None
-                self.ext_buf_view = None
-
-                self.recv_flag ^= WAIT_LARGE_DATA
-                self.recv_offset = 0
+            if self.ext_recv_offset == len(self.ext_buf_view):
+                try:
+                    if self.sink_mask is None:
+                        self.arena_sizes.append(len(self.ext_buf_view))
+                        self._handle_message_frame(self.ext_buf_view)
+                    else:
+                        sink, mask = self.ext_buf_view, self.sink_mask
+                        self.sink_mask = self.ext_buf_view = None
+                        self._unmask_view(mask, sink)
+                        self._handle_message(FRAME_BINARY, sink)
+                finally:
+                    if self.arena is not None and len(self.arena) > ARENA_RETAIN_LIMIT:
+                        self.arena = None
+                    self.ext_buffer = None
+                    self.ext_recv_offset = None
+                    self.ext_buf_view = None
+
+                    self.recv_flag ^= WAIT_LARGE_DATA
+                    self.recv_offset = 0
 
         return False
 
+    def _open_sink(self, flags, header_size, payload_len):
+        # A complete, unfragmented binary frame may be received straight into
+        # the consumer's buffer instead of the arena.
+        if (flags & FLAG_OPCODE) >> 8 != FRAME_BINARY or not flags & FLAG_FIN:
+            return False
+        if self.recv_flag & HAS_FRAGMENT_FLAG or flags & (FLAG_RSVs | FLAG_MASK) != FLAG_MASK:
+            return False
+        if self.recv_offset < header_size:
+            return False
+        sink = self.get_binary_sink(payload_len)
+        if sink is None:
+            return False
+
+        self.sink_mask = bytes(self.buffer[header_size - 4 : header_size])
+        received = self.recv_offset - header_size
+        sink[:received] = self.buf_view[header_size : self.recv_offset]
+        self.ext_buf_view = sink
+        self.ext_recv_offset = received
+        return True
+
+    def get_binary_sink(self, length):
+        """Return a writable memoryview of `length` bytes to receive the next
+        binary message into, or None to get it the usual way.
+
+        The same memoryview object is then passed to on_binary_message().
+        """
+        return None
+
     def _handle_message_frame(self, memview):
         (flags,) = struct.unpack('>H', memview[:2])
 
@@ -183,8 +277,17 @@ class WebSocketHandler:
         flag_mask = flags & FLAG_MASK
         flag_payload = flags & FLAG_PAYLOAD
 
+        has_fragement = self.recv_flag & HAS_FRAGMENT_FLAG
+        # RSV1 marks the first frame of a compressed data message
+        compressed = (
+            flag_rsv == FLAG_RSV1
+            and self.deflate is not None
+            and not has_fragement
+            and flag_opcode >> 8 in (FRAME_TEXT, FRAME_BINARY)
+        )
+
         try:
-            assert flag_rsv == 0, 'flag_rsv must be 0 but get %i' % flag_rsv
+            assert flag_rsv == 0 or compressed, 'flag_rsv must be 0 but get %i' % flag_rsv
             assert flag_mask == FLAG_MASK, 'flag_mask must be %i but get %i' % (FLAG_MASK, flag_mask)
         except AssertionError as e:
             raise WebsocketError(e.args[0])
@@ -196,41 +299,59 @@ class WebSocketHandler:
             body_offset = 10
 
         mask = memview[body_offset : body_offset + 4]
-        data = bytearray(memview[body_offset + 4 :])
-
-        self._unmask_data(mask, data)
-
-        has_fragement = self.recv_flag & HAS_FRAGMENT_FLAG
+        if memview.obj is self.buffer:
+            # Small frames are copied out: the receive buffer is shifted
+            # right after this call
+            data = bytearray(memview[body_offset + 4 :])
+            self._unmask_data(mask, data)
+        else:
+            # Large frames are unmasked in place and passed as a memoryview
+            # into the arena, see detach_message()
+            data = memview[body_offset + 4 :]
+            self._unmask_view(mask, data)
 
         if flag_fin and (not has_fragement):
-            try:
-                self._handle_message((flag_opcode >> 8), data)
-            finally:
-                pass
+            if compressed:
+                data = self._inflate(data)
+            self._handle_message((flag_opcode >> 8), data)
         else:
             if not has_fragement:
-                self.fragments = [data]
+                self.fragments = bytearray(data)
                 self.fragments_opcode = flag_opcode >> 8
+                self.fragments_compressed = compressed
                 self.recv_flag |= HAS_FRAGMENT_FLAG
             else:
-                self.fragments.append(data)
+                self.fragments += data
 
                 if flag_fin:
                     try:
-                        self._handle_message(self.fragments_opcode, b''.join(self.fragments))
+                        message = memoryview(self.fragments)
+                        if self.fragments_compressed:
+                            message = self._inflate(message)
+                        self._handle_message(self.fragments_opcode, message)
                     finally:
                         self.fragments = None
                         self.recv_flag ^= HAS_FRAGMENT_FLAG
 
+    def _inflate(self, data):
+        try:
+            return self.deflate.decompress(data, MAX_INFLATE_SIZE)
+        except zlib.error as e:
+            raise WebsocketError('Bad compressed message: %s' % e)
+
     def _handle_message(self, opcode, message):
         # ref: opcode in RFC 6455 (Chp 5.5)
+        if opcode <= 0x2:
+            self.stats.messages_in.inc()
+            self.stats.bytes_in.inc(len(message))
         if opcode == 0x1:
             # TODO: this if statement is only for ping-pong
             # might be too fundamental, should we add another layer for this?
-            if message.decode('utf8') == 'ping':
+            text = str(message, 'utf8')
+            if text == 'ping':
                 self.send_text('{"status": "pong"}')
             else:
-                self.on_text_message(message.decode('utf8'))
+                self.on_text_message(text)
         elif opcode == 0x2:
             self.on_binary_message(message)
         elif opcode == 0x8:
@@ -243,37 +364,214 @@ class WebSocketHandler:
     def _unmask_data(self, mask, data):
         Utils.apply_mask(bytearray(mask), data)
 
-    def _send(self, opcode, message):
+    def _unmask_view(self, mask, view):
+        import numpy as np
+
+        data = np.frombuffer(view, dtype=np.uint8)
+        key = np.frombuffer(mask, dtype=np.uint8)
+        body = len(data) - len(data) % 4
+        words = data[:body].view(np.uint32)
+        words ^= key.view(np.uint32)[0]
+        data[body:] ^= key[: len(data) - body]
+
+    def _take_arena(self, size):
+        arena = self.arena
+        wanted = max(size, max(self.arena_sizes, default=0))
+        if arena is None or len(arena) < size or len(arena) > 2 * wanted:
+            arena = self.arena = bytearray(wanted)
+        return arena
+
+    def detach_message(self, message):
+        """Return `message` in a form that stays valid after the handler returned.
+
+        A large message is a memoryview into the receive arena which the next
+        frame overwrites. Handlers which keep it (queue it to another thread)
+        must call this first; the arena is handed over without a copy.
+        """
+        if isinstance(message, memoryview) and message.obj is self.arena:
+            self.arena = None
+        return message
+
+    def _send(self, opcode, message, after=None):
+        # Frames are queued and written by a single writer thread, so a frame
+        # from a worker thread never interleaves with another one.
         if self._is_closing and opcode != FRAME_CLOSE:
             raise WebsocketError('Connection already closed')
 
+        if not isinstance(message, bytes):
+            message = memoryview(message).cast('B')
+            if not message.readonly and len(message) <= SEND_COPY_LIMIT:
+                # Small writable buffers are often reused by the caller
+                message = message.tobytes()
+
+        if opcode <= FRAME_BINARY:
+            self.stats.messages_out.inc()
+            self.stats.bytes_out.inc(len(message))
+
+        if self.deflate is not None and self._should_compress(opcode, message):
+            # The client inflates in the order frames arrive: compress and
+            # queue under one lock.
+            with self.deflate.lock:
+                self._queue_frame(opcode, self.deflate.compress(message), after, FLAG_RSV1)
+        else:
+            self._queue_frame(opcode, message, after)
+
+    def _should_compress(self, opcode, message):
+        if opcode == FRAME_TEXT:
+            return len(message) >= self.COMPRESS_THRESHOLD
+        if opcode == FRAME_BINARY:
+            return self.COMPRESS_BINARY and len(message) >= self.COMPRESS_THRESHOLD
+        return False
+
+    def _queue_frame(self, opcode, message, after, rsv=0):
         length = len(message)
 
-        flag = 0
+        flag = rsv
         flag += opcode << 8
         flag += FLAG_FIN
 
-        try:
-            if length < 126:
-                self.request.send(struct.pack('>H', flag + length))
-            elif length < 2**16:
-                self.request.send(struct.pack('>HH', flag + 126, length))
-            elif length < 2**64:
-                self.request.send(struct.pack('>HQ', flag + 127, length))
+        if length < 126:
+            header = struct.pack('>H', flag + length)
+        elif length < 2**16:
+            header = struct.pack('>HH', flag + 126, length)
+        elif length < 2**64:
+            header = struct.pack('>HQ', flag + 127, length)
+        else:
+            raise Exception('Can not send message larger then %i' % (2**64))
+
+        with self._send_cond:
+            while self._send_queued > self.send_high_water and self._send_error is None:
+                self._send_cond.wait()
+            if self._send_error is not None:
+                raise WebsocketError('Connection closed') from self._send_error
+
+            if not self._send_queue and not self._writing and length <= SEND_COPY_LIMIT and not after:
+                # Nothing in flight: try to hand a small frame to the kernel
+                # right away and only queue what it did not take.
+                sent = self._try_send_now(header, message)
+                if sent == len(header) + length:
+                    return
+                remain = (header + bytes(message))[sent:]
+                header, message = b'', remain
+                length = len(remain)
+
+            self._send_queue.append((header, message, after))
+            self._send_queued += len(header) + length
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._writer_loop, name='ws-writer')
+                self._writer.daemon = True
+                self._writer.start()
             else:
-                raise Exception('Can not send message larger then %i' % (2**64))
+                self._send_cond.notify_all()
+
+    def _writer_loop(self):
+        while True:
+            with self._send_cond:
+                if not self._send_queue and self._send_error is None:
+                    self._send_cond.wait(SEND_WRITER_IDLE)
+                if not self._send_queue or self._send_error is not None:
+                    self._writer = None
+                    self._send_cond.notify_all()
+                    return
+                # Take every frame queued so far (up to a slice) in one go
+                frames = [self._send_queue.popleft()]
+                size = len(frames[0][0]) + len(frames[0][1])
+                while self._send_queue and size < SEND_SLICE_SIZE and len(frames) < SEND_BATCH_FRAMES:
+                    frames.append(self._send_queue.popleft())
+                    size += len(frames[-1][0]) + len(frames[-1][1])
+                self._writing = True
+
+            try:
+                self._write_frames(frames)
+            except OSError as e:
+                with self._send_cond:
+                    self._writing = False
+                    self._send_error = e
+                    self._send_queue.clear()
+                    self._send_queued = 0
+                    self._writer = None
+                    self._send_cond.notify_all()
+                self._closed()
+                return
+
+            with self._send_cond:
+                self._writing = False
+                if self._send_error is None:
+                    self._send_queued -= size
+                self._send_cond.notify_all()
+
+    def _try_send_now(self, header, message):
+        if isinstance(self.request, ssl.SSLSocket):
+            return 0
+        try:
+            return self.request.sendmsg([header, message], [], socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return 0
         except OSError as e:
             self._closed()
             raise WebsocketError('Connection closed') from e
 
-        sent = 0
-        buf = memoryview(message)
-        while sent < length:
-            sent += self.request.send(buf[sent : sent + 4096])
+    def _write_frames(self, frames):
+        buffers = []
+        for header, message, after in frames:
+            if header:
+                buffers.append(memoryview(header))
+            view = memoryview(message)
+            for offset in range(0, len(view), SEND_SLICE_SIZE):
+                buffers.append(view[offset : offset + SEND_SLICE_SIZE])
+            if after:
+                # Run it right after this frame is out, e.g. SHUT_WR after close
+                self._write_buffers(buffers)
+                buffers = []
+                after()
+        self._write_buffers(buffers)
+
+    def _write_buffers(self, buffers):
+        if isinstance(self.request, ssl.SSLSocket):
+            # SSLSocket has no sendmsg(); join small buffers into one record
+            pending = []
+            for buf in buffers:
+                if len(buf) > SEND_COPY_LIMIT:
+                    if pending:
+                        self.request.sendall(b''.join(pending))
+                        pending = []
+                    self.request.sendall(buf)
+                else:
+                    pending.append(buf)
+            if pending:
+                self.request.sendall(b''.join(pending))
+            return
+
+        # Headers and payloads leave together (one TCP segment for small
+        # frames), a partial send resumes inside the buffer it stopped in.
+        index = 0
+        while index < len(buffers):
+            sent = self.request.sendmsg(buffers[index : index + SEND_BATCH_FRAMES])
+            while sent and index < len(buffers):
+                used = min(sent, len(buffers[index]))
+                sent -= used
+                if used == len(buffers[index]):
+                    index += 1
+                else:
+                    buffers[index] = buffers[index][used:]
+            while index < len(buffers) and not buffers[index]:
+                index += 1
 
     def _closed(self):
         self.request.close()
         self.running = False
+        with self._send_cond:
+            if self._send_error is None:
+                self._send_error = WebsocketError('Connection closed')
+            self._send_queue.clear()
+            self._send_queued = 0
+            self._send_cond.notify_all()
+
+    def _shutdown_write(self):
+        try:
+            self.request.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
 
     def on_close(self, message):
         if self._is_closing:
@@ -282,9 +580,8 @@ class WebSocketHandler:
             # Remote send close message, response and close it.
             self._is_closing = True
             try:
-                self._send(FRAME_CLOSE, b'\x03\xe8')
-                self.request.shutdown(socket.SHUT_WR)
-            except OSError:
+                self._send(FRAME_CLOSE, b'\x03\xe8', after=self._shutdown_write)
+            except WebsocketError:
                 pass
 
     def on_text_message(self, message):
@@ -319,13 +616,59 @@ class WebSocketHandler:
         # a 2-byte unsigned integer
         buffer = struct.pack('>H', code) + message.encode()
 
-        self._send(FRAME_CLOSE, buffer)
-        self.request.shutdown(socket.SHUT_WR)
+        self._send(FRAME_CLOSE, buffer, after=self._shutdown_write)
         self._is_closing = True
 
     def close_directly(self):
         self._closed()
 
+    def enable_deflate(self, **params):
+        """Use permessage-deflate with the parameters agreed in the handshake."""
+        self.deflate = PerMessageDeflate(**params)
+
+    def flush(self, timeout=None):
+        """Wait until every queued frame is written. Return False on timeout."""
+        with self._send_cond:
+            return self._send_cond.wait_for(lambda: not self._send_queue and not self._writing, timeout)
+
+
+class PerMessageDeflate:
+    """Compressor and decompressor state of one permessage-deflate connection.
+
+    Both are created on first use, so an idle connection costs nothing.
+    """
+
+    def __init__(
+        self,
+        server_no_context_takeover=False,
+        client_no_context_takeover=False,
+        server_max_window_bits=15,
+        client_max_window_bits=15,
+    ):
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_no_context_takeover = client_no_context_takeover
+        self.server_max_window_bits = server_max_window_bits
+        self.client_max_window_bits = client_max_window_bits
+        self.lock = threading.Lock()
+        self._compressor = None
+        self._decompressor = None
+
+    def compress(self, data):
+        if self._compressor is None or self.server_no_context_takeover:
+            self._compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -self.server_max_window_bits)
+        buf = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        # RFC 7692 7.2.1: drop the 0x00 0x00 0xff 0xff of the sync flush
+        return buf[:-4] if buf.endswith(DEFLATE_TAIL) else buf
+
+    def decompress(self, data, max_length):
+        if self._decompressor is None or self.client_no_context_takeover:
+            self._decompressor = zlib.decompressobj(-15)
+        decompressor = self._decompressor
+        buf = decompressor.decompress(data, max_length)
+        if decompressor.unconsumed_tail:
+            raise WebsocketError('Message larger than %i after inflate' % max_length)
+        return buf + decompressor.decompress(DEFLATE_TAIL)
+
 
 class WebsocketError(Exception):
     pass
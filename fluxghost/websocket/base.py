@@ -2,6 +2,8 @@ import logging
 from time import time
 
 from fluxghost.api import ApiBase
+from fluxghost.api.misc import ProgressChannel
+from fluxghost.debug import command_profile
 from fluxghost.utils.websocket import ST_UNEXPECTED_CONDITION, WebsocketError, WebSocketHandler
 
 logger = logging.getLogger('WS.BASE')
@@ -11,14 +13,20 @@ __all__ = ['WebSocketBase']
 
 class WebSocketBase(WebSocketHandler, ApiBase):
     TIMEOUT = 600
+    # ASYNC runmode: handle messages on the event loop instead of the worker
+    # pool. Only for handlers which never block.
+    RUN_IN_LOOP = False
     timer = 0
 
     def __init__(self, request, client, server, path):
         WebSocketHandler.__init__(self, request, client, server)
         self.path = path
         self.query = self.parse_query()
+        # ?profile=1, with --allow-profile only
+        self.profile_commands = command_profile.wants_profile(self.query)
         self.rlist = [self]
         self.timer = time()
+        self.progress = ProgressChannel(lambda text: WebSocketHandler.send_text(self, text), self.PROGRESS_RATE)
 
     def parse_query(self):
         query = {}
@@ -42,6 +50,17 @@ class WebSocketBase(WebSocketHandler, ApiBase):
         finally:
             self.request.close()
 
+    def send_text(self, message):
+        # A progress report held back by the channel goes out before any
+        # later frame, never after it. flush() takes the channel's lock, so
+        # it also waits for a timer which is sending a report right now.
+        self.progress.flush()
+        WebSocketHandler.send_text(self, message)
+
+    def send_binary(self, buf):
+        self.progress.flush()
+        WebSocketHandler.send_binary(self, buf)
+
     def send_fatal(self, *args):
         ApiBase.send_fatal(self, *args)
         self.close(error=True, message='error %s' % args[0])
@@ -72,6 +91,7 @@ class WebSocketBase(WebSocketHandler, ApiBase):
             self.close(error=True, message='error TIMEOUT')
 
     def close(self, error=False, message=None):
+        self.progress.close()
         if error:
             logger.warning('Websocket close because: %s', message)
             WebSocketHandler.close(self, code=ST_UNEXPECTED_CONDITION, message=message)
@@ -18,4 +18,5 @@ ws.send("ls")
 
 
 class WebsocketCamera(camera_api_mixin(WebSocketBase)):
-    pass
+    # Binary replies are JPEG/PNG frames, deflate would not shrink them
+    COMPRESS_BINARY = False
@@ -17,4 +17,5 @@ ws.send("ls")
 
 
 class WebsocketCameraCalibration(camera_calibration_api_mixin(WebSocketBase)):
-    pass
+    # Binary replies are JPEG/PNG frames, deflate would not shrink them
+    COMPRESS_BINARY = False
@@ -79,6 +79,7 @@ class WebsocketConfig(WebsocketBinaryHelperMixin, WebSocketBase):
         self.send_continue()
 
     def end_recv_binary(self, buf, key):
-        self.db[key] = buf
+        # A spooled upload arrives as an mmap, dbm only stores bytes
+        self.db[key] = bytes(buf)
         self.send_ok()
         self.close()
@@ -0,0 +1,22 @@
+from fluxghost.api.diagnostics import diagnostics_api_mixin
+
+from .base import WebSocketBase
+
+"""
+Latency of the commands of all connections, see fluxghost/utils/command_timing.py,
+and the memory they hold, see fluxghost/utils/memory_budget.py
+
+Javascript Example:
+
+ws = new WebSocket("ws://127.0.0.1:8000/ws/diagnostics");
+ws.onmessage = function(v) { console.log(v.data);}
+
+ws.send("command_stats")
+ws.send("command_stats control")
+ws.send("reset_command_stats")
+ws.send("memory")
+"""
+
+
+class WebsocketDiagnostics(diagnostics_api_mixin(WebSocketBase)):
+    RUN_IN_LOOP = True
@@ -17,4 +17,4 @@ ws.send("ls")
 
 
 class WebsocketPushStudio(push_studio_api_mixin(WebSocketBase)):
-    pass
+    RUN_IN_LOOP = True
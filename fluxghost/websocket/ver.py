@@ -15,4 +15,4 @@ ws.onclose = function(v) { console.log("CONNECTION CLOSED, code=" + v.code +
 
 
 class WebsocketVer(ver_api_mixin(WebSocketBase)):
-    pass
+    RUN_IN_LOOP = True
@@ -4,9 +4,10 @@ import argparse
 import os
 import sys
 from signal import SIGTERM
-from time import sleep
+from time import perf_counter, sleep
 
 from fluxghost.launcher import setup_env, show_version
+from fluxghost.utils import startup_profile
 
 
 def trace_pid(pid):
@@ -62,11 +63,28 @@ def trace_pid(pid):
     t.start()
 
 
+def start_cert_refresh(server):
+    from threading import Thread
+
+    def _refresh():
+        from fluxghost.cert.fetch_certs import refresh_certs
+
+        refresh_certs(server.reload_certs)
+
+    t = Thread(target=_refresh, name='cert-refresh')
+    t.daemon = True
+    t.start()
+
+
 def main():
+    started = perf_counter()
     parser = argparse.ArgumentParser(description='FLUX Ghost')
     parser.add_argument('--assets', dest='assets', type=str, default=None, help='Assets folder')
     parser.add_argument('--ip', dest='ipaddr', type=str, default='127.0.0.1', help='Bind to IP Address')
     parser.add_argument('--port', dest='port', type=int, default=8000, help='Port')
+    parser.add_argument(
+        '--ssl-port', dest='ssl_port', type=int, default=8443, help='HTTPS port, used when SSL certificates exist'
+    )
     parser.add_argument('--trace-pid', dest='trace_pid', type=int, default=None)
     parser.add_argument('--log', dest='logfile', type=str, default=None, help='Output log to specific')
     parser.add_argument(
@@ -75,6 +93,21 @@ def main():
     parser.add_argument(
         '-s', '--simulate', dest='simulate', action='store_const', const=True, default=False, help='Simulate data'
     )
+    parser.add_argument(
+        '--runmode',
+        dest='runmode',
+        type=str,
+        choices=('thread', 'async'),
+        default='thread',
+        help='Server engine: a thread per connection, or one asyncio event loop',
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=1,
+        help='Server processes sharing the port with SO_REUSEPORT (Linux); the first one runs device discovery',
+    )
     parser.add_argument(
         '--allow-foreign',
         dest='allow_foreign',
@@ -83,6 +116,89 @@ def main():
         default=False,
         help='Allow websocket connection from foreign',
     )
+    parser.add_argument(
+        '--ws-deflate',
+        dest='ws_deflate',
+        type=str,
+        choices=('auto', 'on', 'off'),
+        default='auto',
+        help='Websocket permessage-deflate: for remote clients only (auto), always, or never',
+    )
+    parser.add_argument(
+        '--upload-spool-threshold',
+        dest='upload_spool_threshold',
+        type=int,
+        default=None,
+        help='Spool binary uploads larger than this many bytes to a temp file',
+    )
+    parser.add_argument(
+        '--upload-ram-limit',
+        dest='upload_ram_limit',
+        type=int,
+        default=None,
+        help='Bytes of in-RAM uploads allowed across all connections before spooling',
+    )
+    parser.add_argument(
+        '--offload-processes',
+        dest='offload_processes',
+        type=int,
+        default=0,
+        help='Processes running the CPU-bound work of image commands; 0 runs it in the connection thread',
+    )
+    parser.add_argument(
+        '--memory-budget',
+        dest='memory_budget',
+        type=int,
+        default=None,
+        help='Bytes of images, uploads and task code websocket connections may hold, per process; 2 GiB by default',
+    )
+    parser.add_argument(
+        '--slow-command-ms',
+        dest='slow_command_ms',
+        type=float,
+        default=None,
+        help='Log websocket commands which take longer than this, 1000 by default',
+    )
+    parser.add_argument(
+        '--allow-profile',
+        dest='allow_profile',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Profile the commands of websockets opened with ?profile=1, into $GHOST_PROFILE_DIR',
+    )
+    parser.add_argument(
+        '--trace',
+        dest='trace',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help='Append a JSON line per command and toolpath stage span to this file',
+    )
+    parser.add_argument(
+        '--trace-otlp',
+        dest='trace_otlp',
+        type=str,
+        default=None,
+        metavar='URL',
+        help='Send spans to an OTLP/HTTP collector, e.g. http://127.0.0.1:4318/v1/traces',
+    )
+    parser.add_argument(
+        '--warm-routes',
+        dest='warm_routes',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Import all websocket handler modules in the background once the server is ready',
+    )
+    parser.add_argument(
+        '--profile-startup',
+        dest='profile_startup',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help='Write startup phase and module import times as JSON to this file',
+    )
 
     parser.add_argument(
         '--slic3r', dest='slic3r', type=str, default=os.environ.get('GHOST_SLIC3R'), help='Set slic3r location'
@@ -103,10 +219,17 @@ def main():
         show_version(options.debug)
         sys.exit(0)
 
-    setup_env(options)
+    if options.profile_startup:
+        startup_profile.start(origin=started)
+
+    with startup_profile.span('setup_env'):
+        setup_env(options)
 
-    from fluxghost.cert.fetch_certs import fetch_certs
-    from fluxghost.http_server import HttpServer
+    with startup_profile.span('import_server'):
+        if options.runmode == 'async':
+            from fluxghost.http_server_async import HttpServer
+        else:
+            from fluxghost.http_server import HttpServer
 
     if options.test:
         from tests.main import main
@@ -123,21 +246,74 @@ def main():
     if not options.assets:
         options.assets = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fluxghost', 'assets')
 
-    fetch_certs()
+    with startup_profile.span('certs'):
+        from fluxghost.cert import local_certs_exist
 
-    server = HttpServer(
-        assets_path=options.assets,
-        enable_discover=True,
-        address=(options.ipaddr, options.port),
-        allow_foreign=options.allow_foreign,
-        debug=options.debug,
-    )
+        # With certificates on disk the server starts on them, and asking the
+        # cert server for new ones does not hold back the ready line.
+        refresh_certs_later = local_certs_exist()
+        if not refresh_certs_later:
+            from fluxghost.cert.fetch_certs import fetch_certs
+
+            fetch_certs()
+
+    with startup_profile.span('configure_uploads'):
+        from fluxghost.api.misc import configure_uploads
+
+        configure_uploads(spool_threshold=options.upload_spool_threshold, ram_limit=options.upload_ram_limit)
+
+    with startup_profile.span('server_init'):
+        server = HttpServer(
+            assets_path=options.assets,
+            enable_discover=True,
+            address=(options.ipaddr, options.port),
+            allow_foreign=options.allow_foreign,
+            debug=options.debug,
+            ssl_port=options.ssl_port,
+            ws_deflate=options.ws_deflate,
+            reuse_port=options.workers > 1,
+        )
+
+    worker = 0
+    if options.workers > 1:
+        from fluxghost.prefork import fork_workers
+
+        # Fork before any thread starts, including the tracing exporter's, configured below
+        worker = fork_workers(server, options.workers)
 
-    if options.trace_pid:
+    from fluxghost.debug import command_profile
+    from fluxghost.utils import command_timing, memory_budget, offload, tracing
+
+    command_timing.configure(slow_ms=options.slow_command_ms)
+    offload.configure(processes=options.offload_processes)
+    memory_budget.configure(budget=options.memory_budget)
+    command_profile.configure(allow=options.allow_profile)
+    tracing.configure(path=options.trace, otlp_endpoint=options.trace_otlp)
+
+    if options.profile_startup and worker == 0:
+        # Before the background threads start importing
+        startup_profile.finish(options.profile_startup)
+
+    if refresh_certs_later and worker == 0:
+        # Workers get new certificates from the leader
+        start_cert_refresh(server)
+
+    if options.warm_routes:
+        from fluxghost.http_websocket_route import warm_routes
+
+        warm_routes()
+
+    if options.trace_pid and worker == 0:
+        # Workers exit with the leader
         trace_pid(options.trace_pid)
 
     server.serve_forever()
 
 
 if __name__ == '__main__':
+    if getattr(sys, 'frozen', False):
+        # A PyInstaller build runs this for the offload processes too
+        import multiprocessing
+
+        multiprocessing.freeze_support()
     main()
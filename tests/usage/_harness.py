@@ -2,14 +2,18 @@
 
 Spawns a real `ghost.py -d --port 0` server per test module and provides a
 stdlib-only websocket client. Python 3.8 compatible; no external deps
-(pycryptodome is optional, only needed by tests that authenticate).
+(pycryptodome is optional, only needed by tests that authenticate; PIL only
+by the tests which make images).
 """
 
 import base64
 import contextlib
+import http.client
+import io
 import json
 import os
 import platform
+import re
 import socket
 import subprocess
 import sys
@@ -18,6 +22,9 @@ import time
 ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 SIM_UUID = '0' * 32
 
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
 
 class Server:
     """A fluxghost process on an auto-assigned port. Use as a module fixture."""
@@ -61,24 +68,34 @@ class Server:
 class WS:
     """Minimal RFC 6455 websocket client (client frames masked, server frames not)."""
 
-    def __init__(self, port, path, timeout=15):
+    def __init__(self, port, path, timeout=15, headers=None):
         self.sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
         key = base64.b64encode(os.urandom(16)).decode()
+        extra = ''.join('%s: %s\r\n' % item for item in (headers or {}).items())
         self.sock.sendall(
             (
                 'GET %s HTTP/1.1\r\nHost: 127.0.0.1:%d\r\n'
                 'Upgrade: websocket\r\nConnection: Upgrade\r\n'
                 'Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n'
-                'Origin: http://127.0.0.1\r\n\r\n' % (path, port, key)
+                'Origin: http://127.0.0.1\r\n%s\r\n' % (path, port, key, extra)
             ).encode()
         )
         buf = b''
         while b'\r\n\r\n' not in buf:
-            buf += self.sock.recv(4096)
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                self.sock.close()
+                raise ConnectionError('connection closed during handshake for %s' % path)
+            buf += chunk
         status = buf.split(b'\r\n', 1)[0]
         if b'101' not in status:
             raise ConnectionError('handshake failed for %s: %r' % (path, status))
-        self.buf = buf.split(b'\r\n\r\n', 1)[1]
+        head, self.buf = buf.split(b'\r\n\r\n', 1)
+        self.headers = {}
+        for line in head.decode('latin-1').split('\r\n')[1:]:
+            name, _, value = line.partition(':')
+            self.headers[name.strip().lower()] = value.strip()
+        self.rsv = 0
 
     def _fill(self, n):
         while len(self.buf) < n:
@@ -91,6 +108,7 @@ class WS:
         """Return (opcode, payload) of the next frame. opcode 1=text, 2=binary, 8=close."""
         self._fill(2)
         opcode = self.buf[0] & 0x0F
+        self.rsv = self.buf[0] & 0x70
         length = self.buf[1] & 0x7F
         off = 2
         if length == 126:
@@ -106,10 +124,10 @@ class WS:
         self.buf = self.buf[off + length :]
         return opcode, payload
 
-    def send(self, payload, opcode=1):
+    def send(self, payload, opcode=1, rsv=0):
         if isinstance(payload, str):
             payload = payload.encode()
-        header = bytes([0x80 | opcode])
+        header = bytes([0x80 | rsv | opcode])
         mask = os.urandom(4)
         n = len(payload)
         if n < 126:
@@ -160,3 +178,44 @@ def make_rsa_pem():
     except ImportError:
         return None
     return RSA.generate(1024).export_key().decode()
+
+
+def metrics(port, conn=None):
+    """GET /metrics on a new connection to port, or on conn (kept open); return (response, samples).
+
+    samples maps (name, frozenset of label items) to the value, see sample().
+    """
+    own = conn is None
+    if own:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        conn.request('GET', '/metrics')
+        resp = conn.getresponse()
+        body = resp.read().decode()
+    finally:
+        if own:
+            conn.close()
+    samples = {}
+    for line in body.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        name, labels, value = SAMPLE.match(line).groups()
+        samples[name, frozenset(LABEL.findall(labels or ''))] = float(value)
+    return resp, samples
+
+
+def sample(samples, name, **labels):
+    """The value of one series of metrics(), 0 if it is not exported."""
+    return samples.get((name, frozenset(labels.items())), 0.0)
+
+
+def make_png(size=(64, 64), bg=(255, 255, 255, 255), rect=None, fg=(200, 30, 30, 255)):
+    """A small RGBA PNG (Beam Studio uploads RGBA blobs), optionally with a filled rectangle."""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGBA', size, bg)
+    if rect is not None:
+        ImageDraw.Draw(image).rectangle(rect, fill=fg)
+    out = io.BytesIO()
+    image.save(out, format='PNG')
+    return out.getvalue()
@@ -0,0 +1,175 @@
+"""Usage tests Q1-Q6 (see docs/test-plan.md).
+
+Points `PROXY_API_HOST` at a stand-in upstream running in this process and
+drives `/api/*` through fluxghost the way the web build talks to the cloud
+API: plain and error GETs, large POST bodies, and chunked bodies both ways;
+a request with a malformed Content-Length or chunk size gets a 400.
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import socket
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tests.usage._harness import Server
+
+server = None
+upstream = None
+
+
+class Upstream(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    peers = set()
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, payload, chunked=False):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(body), 7):
+                piece = body[i : i + 7]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(piece), piece))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def read_body(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            data = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    return data
+                data += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_GET(self):
+        Upstream.peers.add(self.client_address)
+        if self.path.startswith('/api/missing'):
+            self.reply(500, {'error': 'boom'})
+        else:
+            chunked = self.path.startswith('/api/chunked')
+            self.reply(200, {'path': self.path, 'host': self.headers['Host'], 'chunked': chunked}, chunked=chunked)
+
+    def do_POST(self):
+        body = self.read_body()
+        self.reply(200, {'size': len(body), 'md5': hashlib.md5(body).hexdigest()})
+
+
+def setUpModule():
+    global server, upstream
+    upstream = ThreadingHTTPServer(('127.0.0.1', 0), Upstream)
+    upstream.daemon_threads = True
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    host = '127.0.0.1:%i' % upstream.server_address[1]
+
+    old = os.environ.get('PROXY_API_HOST')
+    os.environ['PROXY_API_HOST'] = host
+    try:
+        server = Server()
+    finally:
+        if old is None:
+            del os.environ['PROXY_API_HOST']
+        else:
+            os.environ['PROXY_API_HOST'] = old
+
+
+def tearDownModule():
+    if server is not None:
+        server.stop()
+    if upstream is not None:
+        upstream.shutdown()
+        upstream.server_close()
+
+
+class ApiProxyTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=30)
+        self.addCleanup(self.conn.close)
+
+    def request(self, method, path, body=None, headers=None, encode_chunked=False):
+        self.conn.request(method, path, body=body, headers=headers or {}, encode_chunked=encode_chunked)
+        resp = self.conn.getresponse()
+        return resp, resp.read()
+
+    def test_q1_get_reuses_upstream_connection(self):
+        # Q1: replies are relayed as they are and the upstream connection is kept alive
+        Upstream.peers.clear()
+        for i in range(5):
+            resp, body = self.request('GET', '/api/devices?page=%i' % i)
+            self.assertEqual(resp.status, 200)
+            msg = json.loads(body)
+            self.assertEqual(msg['path'], '/api/devices?page=%i' % i)
+            self.assertEqual(msg['host'], '127.0.0.1:%i' % upstream.server_address[1])
+        self.assertEqual(len(Upstream.peers), 1)
+
+    def test_q2_large_post_body_is_streamed(self):
+        # Q2: an 8 MB upload reaches the upstream intact, with the CORS header added
+        data = os.urandom(8 * 2**20)
+        resp, body = self.request('POST', '/api/upload', body=data, headers={'Content-Type': 'application/octet-stream'})
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.getheader('Access-Control-Allow-Origin'), '*')
+        self.assertEqual(json.loads(body), {'size': len(data), 'md5': hashlib.md5(data).hexdigest()})
+
+    def test_q3_chunked_bodies(self):
+        # Q3: a chunked request body is forwarded, a chunked reply is relayed chunked
+        pieces = [os.urandom(1000 + i) for i in range(20)]
+        resp, body = self.request('POST', '/api/upload', body=iter(pieces), encode_chunked=True)
+        data = b''.join(pieces)
+        self.assertEqual(json.loads(body), {'size': len(data), 'md5': hashlib.md5(data).hexdigest()})
+
+        resp, body = self.request('GET', '/api/chunked')
+        self.assertEqual(resp.getheader('Transfer-Encoding'), 'chunked')
+        self.assertTrue(json.loads(body)['chunked'])
+
+    def test_q4_upstream_error_status(self):
+        # Q4: an upstream error is passed through, and the connection stays usable
+        resp, body = self.request('GET', '/api/missing')
+        self.assertEqual(resp.status, 500)
+        self.assertEqual(json.loads(body), {'error': 'boom'})
+        resp, body = self.request('GET', '/api/devices')
+        self.assertEqual(resp.status, 200)
+
+    def test_q5_bad_content_length(self):
+        # Q5: a non-numeric Content-Length is answered with 400 and the connection closed
+        with socket.create_connection(('127.0.0.1', server.port), timeout=5) as sock:
+            sock.sendall(b'POST /api/upload HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: abc\r\n\r\nxyz')
+            reply = b''
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                reply += chunk
+        self.assertTrue(reply.startswith(b'HTTP/1.1 400 '), reply[:100])
+
+    def test_q6_bad_chunk_size(self):
+        # Q6: a chunked body with a non-hex chunk size is answered with 400 and the connection closed
+        with socket.create_connection(('127.0.0.1', server.port), timeout=5) as sock:
+            sock.sendall(
+                b'POST /api/upload HTTP/1.1\r\nHost: 127.0.0.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                b'zz\r\nxyz\r\n0\r\n\r\n'
+            )
+            reply = b''
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                reply += chunk
+        self.assertTrue(reply.startswith(b'HTTP/1.1 400 '), reply[:100])
+
+
+if __name__ == '__main__':
+    unittest.main()
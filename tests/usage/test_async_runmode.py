@@ -0,0 +1,118 @@
+"""Usage tests A1-A5 (see docs/test-plan.md).
+
+Runs a server with `--runmode async` and drives it the way Beam Studio does,
+covering the three ways the ASYNC engine hands a connection to its handler:
+a handler that runs on the event loop (`ver`, `push-studio`), one that is
+dispatched to the worker pool (`utils`), and two connections that talk to
+each other through the server (`inter-process` -> `push-studio`).
+"""
+
+import io
+import json
+import os
+import unittest
+
+from PIL import Image, ImageDraw
+
+from tests.usage._harness import WS, Server
+
+server = None
+
+
+def setUpModule():
+    global server
+    server = Server(['--runmode', 'async'])
+
+
+def tearDownModule():
+    if server is not None:
+        server.stop()
+
+
+class AsyncRunmodeTest(unittest.TestCase):
+    def test_a1_ver_pushes_versions_then_closes(self):
+        # A1: same contract as L2, the handshake is parsed on the event loop.
+        ws = WS(server.port, '/ws/ver')
+        try:
+            op, payload = ws.frame()
+            self.assertEqual(op, 1)
+            self.assertIn('fluxghost', json.loads(payload))
+            self.assertTrue(ws.expect_closed())
+        finally:
+            ws.close()
+
+    def test_a2_keepalive_ping_on_many_connections(self):
+        # A2: Beam Studio keeps one socket per endpoint per tab open; each
+        # must keep answering its keep-alive while the others sit idle.
+        sockets = [WS(server.port, '/ws/push-studio') for _ in range(20)]
+        try:
+            for ws in sockets:
+                ws.send('ping')
+            for ws in sockets:
+                self.assertEqual(json.loads(ws.frame()[1]), {'status': 'pong'})
+        finally:
+            for ws in sockets:
+                ws.close()
+
+    def test_a3_worker_dispatched_upload_keeps_order(self):
+        # A3: utils runs on the worker pool; the command, the chunked upload
+        # and the reply must still be handled in order.
+        image = Image.new('RGBA', (64, 64), (255, 255, 255, 255))
+        ImageDraw.Draw(image).rectangle((10, 20, 40, 50), fill=(0, 0, 0, 255))
+        out = io.BytesIO()
+        image.save(out, format='PNG')
+        data = out.getvalue()
+
+        ws = WS(server.port, '/ws/utils')
+        try:
+            ws.send('get_convex_hull %d' % len(data))
+            self.assertEqual(json.loads(ws.frame()[1]), {'status': 'continue'})
+            half = len(data) // 2
+            ws.send(data[:half], opcode=2)
+            ws.send(data[half:], opcode=2)
+            msg = ws.json_until(lambda m: m.get('status') in ('ok', 'error'))
+            self.assertEqual(msg['status'], 'ok')
+            self.assertEqual(len(msg['data']), 4)
+        finally:
+            ws.close()
+
+    def test_a4_inter_process_relays_to_push_studio(self):
+        # A4: same flow as X2 across a loop-dispatched and a worker-dispatched socket.
+        svg = b'<svg xmlns="http://www.w3.org/2000/svg"/>'
+        studio = WS(server.port, '/ws/push-studio')
+        plugin = WS(server.port, '/ws/inter-process')
+        try:
+            studio.send('set_handler')
+            self.assertEqual(json.loads(studio.frame()[1])['status'], 'ok')
+            plugin.send('adobe_illustrator %d {}' % len(svg))
+            self.assertEqual(json.loads(plugin.frame()[1]), {'status': 'continue'})
+            plugin.send(svg, opcode=2)
+            msg = json.loads(studio.frame()[1])
+            self.assertEqual(msg['svg'], svg.decode())
+        finally:
+            plugin.close()
+            studio.close()
+
+    def test_a5_large_frame_is_kept_for_the_worker(self):
+        # A5: a frame larger than the 8 KB receive buffer is unmasked in place
+        # in the connection's arena; handing it to the worker pool must not
+        # let the next frame overwrite it.
+        image = Image.frombytes('L', (512, 512), os.urandom(512 * 512)).convert('RGBA')
+        out = io.BytesIO()
+        image.save(out, format='PNG')
+        data = out.getvalue()
+        self.assertGreater(len(data), 2**18)
+
+        ws = WS(server.port, '/ws/utils', timeout=60)
+        try:
+            for _ in range(2):
+                ws.send('get_convex_hull %d' % len(data))
+                self.assertEqual(json.loads(ws.frame()[1]), {'status': 'continue'})
+                ws.send(data, opcode=2)
+                msg = ws.json_until(lambda m: m.get('status') in ('ok', 'error'))
+                self.assertEqual(msg['status'], 'ok')
+        finally:
+            ws.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Usage tests F1-F2 (see docs/test-plan.md).
+
+Covers `?profile=1` (fluxghost/debug/command_profile.py): with
+`--allow-profile`, each command of such a connection writes a pstats dump and
+collapsed stacks to $GHOST_PROFILE_DIR and is followed by a `profile` frame;
+without the flag, or without the query, nothing changes.
+"""
+
+import json
+import os
+import pstats
+import re
+import shutil
+import tempfile
+import unittest
+
+from tests.usage._harness import WS, Server
+
+servers = {}
+tmpdir = None
+
+
+def setUpModule():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+    old = os.environ.get('GHOST_PROFILE_DIR')
+    os.environ['GHOST_PROFILE_DIR'] = tmpdir
+    try:
+        servers['allow'] = Server(['--allow-profile'])
+        servers['default'] = Server()
+    finally:
+        if old is None:
+            del os.environ['GHOST_PROFILE_DIR']
+        else:
+            os.environ['GHOST_PROFILE_DIR'] = old
+
+
+def tearDownModule():
+    for server in servers.values():
+        server.stop()
+    if tmpdir is not None:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+class CommandProfileTest(unittest.TestCase):
+    def test_f1_profiled_command(self):
+        # F1: the reply is followed by a profile frame naming a loadable .prof and a collapsed stack file
+        ws = WS(servers['allow'].port, '/ws/push-studio?profile=1')
+        try:
+            ws.send('set_handler')
+            self.assertEqual(json.loads(ws.frame()[1])['status'], 'ok')
+            msg = json.loads(ws.frame()[1])
+        finally:
+            ws.close()
+
+        self.assertEqual(msg['status'], 'profile')
+        self.assertEqual(msg['cmd'], 'set_handler')
+        self.assertEqual(os.path.dirname(msg['prof']), os.path.realpath(tmpdir))
+        self.assertGreater(pstats.Stats(msg['prof']).total_calls, 0)
+        self.assertGreater(msg['calls'], 0)
+        self.assertTrue(any('cmd_set_handler' in row['function'] for row in msg['top']))
+        with open(msg['collapsed']) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertRegex(line, re.compile(r'^\S.* \d+$'))
+        self.assertTrue(any('cmd_set_handler' in line for line in lines))
+
+    def test_f2_not_profiled(self):
+        # F2: no profile frame without the query, or without --allow-profile
+        for name, path in (('allow', '/ws/push-studio'), ('default', '/ws/push-studio?profile=1')):
+            with self.subTest(server=name, path=path):
+                ws = WS(servers[name].port, path)
+                try:
+                    for _ in range(2):
+                        ws.send('set_handler')
+                        self.assertEqual(json.loads(ws.frame()[1])['status'], 'ok')
+                finally:
+                    ws.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
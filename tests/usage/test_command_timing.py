@@ -0,0 +1,97 @@
+"""Usage tests G1-G2 (see docs/test-plan.md).
+
+Covers the command latency hooks (fluxghost/utils/command_timing.py): text
+commands and upload callbacks are timed per route and command and read back
+with `command_stats` on `/ws/diagnostics`; with `--slow-command-ms 0` every
+command is logged as slow, its parameters cut short.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tests.usage._harness import WS, Server
+
+server = None
+tmpdir = None
+
+
+def setUpModule():
+    global server, tmpdir
+    tmpdir = tempfile.mkdtemp()
+    server = Server(['--slow-command-ms', '0', '--log', os.path.join(tmpdir, 'ghost.log')])
+
+
+def tearDownModule():
+    if server is not None:
+        server.stop()
+    if tmpdir is not None:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def command_stats(route):
+    ws = WS(server.port, '/ws/diagnostics')
+    try:
+        ws.send('command_stats %s' % route)
+        msg = json.loads(ws.frame()[1])
+    finally:
+        ws.close()
+    return {row['command']: row for row in msg['commands']}
+
+
+class CommandTimingTest(unittest.TestCase):
+    def test_g1_command_stats(self):
+        # G1: three set_handler commands and one upload callback are counted, percentiles in order
+        studio = WS(server.port, '/ws/push-studio')
+        plugin = WS(server.port, '/ws/inter-process')
+        try:
+            for _ in range(3):
+                studio.send('set_handler')
+                self.assertEqual(json.loads(studio.frame()[1])['status'], 'ok')
+            svg = b'<svg xmlns="http://www.w3.org/2000/svg"/>'
+            plugin.send('adobe_illustrator %d {}' % len(svg))
+            self.assertEqual(json.loads(plugin.frame()[1]), {'status': 'continue'})
+            plugin.send(svg, opcode=2)
+            studio.frame()
+        finally:
+            plugin.close()
+            studio.close()
+
+        # The reply goes out before the command's timer stops
+        time.sleep(0.2)
+        row = command_stats('push-studio')['set_handler']
+        self.assertEqual(row['route'], 'push-studio')
+        self.assertEqual(row['count'], 3)
+        self.assertLessEqual(row['min_ms'], row['p50_ms'])
+        self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+        self.assertLessEqual(row['p99_ms'], row['max_ms'])
+
+        rows = command_stats('inter-process')
+        self.assertEqual(rows['adobe_illustrator']['count'], 1)
+        self.assertEqual(rows['adobe_illustrator upload']['count'], 1)
+
+    def test_g2_slow_command_log(self):
+        # G2: with a 0 ms threshold the command is logged, long parameters truncated
+        studio = WS(server.port, '/ws/push-studio')
+        try:
+            studio.send('set_handler ' + 'x' * 1000)
+            self.assertEqual(json.loads(studio.frame()[1])['status'], 'ok')
+        finally:
+            studio.close()
+
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            with open(os.path.join(tmpdir, 'ghost.log')) as f:
+                lines = [line for line in f if 'Slow command push-studio' in line and '(1000 chars)' in line]
+            if lines:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(lines), 1)
+        self.assertLess(len(lines[0]), 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""Usage test V1 (see docs/test-plan.md).
+
+Covers the device registry (fluxghost/device_registry.py) behind
+`/ws/discover`: a new connection gets the known devices right away, then only
+the registry's keep-alive (every 5 s, inside the 15 s after which Beam Studio
+forgets a device), the same encoded message each time.
+"""
+
+import socket
+import time
+import unittest
+
+from tests.usage._harness import SIM_UUID, WS, Server
+
+server = None
+
+
+def setUpModule():
+    global server
+    server = Server()
+
+
+def tearDownModule():
+    if server is not None:
+        server.stop()
+
+
+class DiscoverPushTest(unittest.TestCase):
+    def test_v1_snapshot_then_keepalive(self):
+        # V1: simulated device on connect, then once per sweep, byte for byte the same
+        connected = time.time()
+        ws = WS(server.port, '/ws/discover')
+        frames = []
+        try:
+            op, first = ws.frame()
+            self.assertLess(time.time() - connected, 0.5)
+            ws.sock.settimeout(0.5)
+            deadline = time.time() + 11
+            while time.time() < deadline:
+                try:
+                    frames.append(ws.frame()[1])
+                except socket.timeout:
+                    pass
+        finally:
+            ws.close()
+
+        self.assertIn(SIM_UUID.encode(), first)
+        # Old per-connection review: about five pushes in 11 s
+        self.assertGreaterEqual(len(frames), 1)
+        self.assertLessEqual(len(frames), 3)
+        for frame in frames:
+            self.assertEqual(frame, first)
+
+
+if __name__ == '__main__':
+    unittest.main()
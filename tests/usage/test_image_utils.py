@@ -1,4 +1,4 @@
-"""Usage tests for the image utility endpoints (cases U1-U3, O1 in docs/test-plan.md).
+"""Usage tests for the image utility endpoints (cases U1-U4, O1 in docs/test-plan.md).
 
 Covers /ws/utils commands the Beam Studio frontend actually calls
 (`packages/core/src/web/helpers/api/utils-ws.ts`):
@@ -6,6 +6,7 @@ Covers /ws/utils commands the Beam Studio frontend actually calls
 - U1 rgb_to_cmyk  (transformRgbImageToCmyk, resultType 'binary' — the frontend default)
 - U2 split_color  (splitColor with colorType 'rgb' and 'cmy' — helpers/layer/full-color/splitColor.ts)
 - U3 get_convex_hull (getConvexHull — helpers/device/framing.ts)
+- U4 upload_to       (progress frames are coalesced, the last one still arrives)
 
 and the /ws/opencv upload+sharpen flow (`open-cv.ts`, Sharpen dialog):
 
@@ -17,11 +18,13 @@ Protocol reference: docs/api/utils.md and docs/api/opencv.md.
 import base64
 import io
 import json
+import os
+import tempfile
 import unittest
 
 from PIL import Image, ImageDraw
 
-from tests.usage._harness import WS, Server
+from tests.usage._harness import WS, Server, make_png
 
 SERVER = None
 
@@ -39,16 +42,6 @@ def tearDownModule():
         SERVER.stop()
 
 
-def make_png(size=(64, 64), bg=(255, 255, 255, 255), rect=None, fg=(200, 30, 30, 255)):
-    """A small RGBA PNG (Beam Studio uploads RGBA blobs), optionally with a filled rectangle."""
-    image = Image.new('RGBA', size, bg)
-    if rect is not None:
-        ImageDraw.Draw(image).rectangle(rect, fill=fg)
-    out = io.BytesIO()
-    image.save(out, format='PNG')
-    return out.getvalue()
-
-
 def read_binary(ws, length):
     """Collect binary frames until `length` bytes have arrived; return the bytes."""
     got = b''
@@ -163,6 +156,30 @@ class UtilsTest(unittest.TestCase):
         ok = self.ws.json_until(lambda m: m.get('status') == 'ok')
         self.assertEqual(ok['data'], [])
 
+    def test_u4_upload_to_coalesces_progress(self):
+        """upload_to in 300 small chunks → a handful of increasing progress frames, the last one before ok."""
+        chunk, count = 512, 300
+        data = os.urandom(chunk * count)
+        with tempfile.TemporaryDirectory() as tmp:
+            target = os.path.join(tmp, 'sub', 'upload.bin')
+            self.ws.send('upload_to %d %s' % (len(data), target))
+            self.ws.json_until(lambda m: m.get('status') == 'continue')
+            for i in range(count):
+                self.ws.send(data[i * chunk : (i + 1) * chunk], opcode=2)
+
+            progress = []
+            while True:
+                msg = self.ws.json_until(lambda m: m.get('status') in ('progress', 'ok'), max_frames=count)
+                if msg['status'] == 'ok':
+                    break
+                progress.append(msg['progress'])
+
+            with open(target, 'rb') as f:
+                self.assertEqual(f.read(), data)
+        self.assertLess(len(progress), count // 4)
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], (count - 1) / count)
+
 
 class OpenCVTest(unittest.TestCase):
     """O1: /ws/opencv upload + sharpen as driven by open-cv.ts."""
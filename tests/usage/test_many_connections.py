@@ -0,0 +1,52 @@
+"""Usage test N1 (see docs/test-plan.md).
+
+Opens more websockets than select() can watch (FD_SETSIZE, 1024) on one
+server, in both runmodes: the server raises its open files limit, and the
+per-connection loops (ApiBase._serve_forever) wait with poll(), so the
+connections holding fds above 1024 still answer.
+"""
+
+import contextlib
+import json
+import unittest
+
+from tests.usage._harness import WS, Server
+
+CONNECTIONS = 1100
+
+
+def setUpModule():
+    try:
+        import resource
+    except ImportError:
+        raise unittest.SkipTest('no resource module')
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = CONNECTIONS + 256
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        if hard != resource.RLIM_INFINITY and hard < needed:
+            raise unittest.SkipTest('open files hard limit %i is below %i' % (hard, needed))
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+
+class ManyConnectionsTest(unittest.TestCase):
+    def test_n1_past_fd_setsize(self):
+        # N1: 1100 idle push-studio connections; the first and last ones answer ping
+        for runmode in ('thread', 'async'):
+            with self.subTest(runmode=runmode):
+                server = Server(['--runmode', runmode])
+                conns = []
+                try:
+                    for _ in range(CONNECTIONS):
+                        conns.append(WS(server.port, '/ws/push-studio'))
+                    for ws in conns[:3] + conns[-3:]:
+                        ws.send('ping')
+                        self.assertEqual(json.loads(ws.frame()[1]), {'status': 'pong'})
+                finally:
+                    for ws in conns:
+                        with contextlib.suppress(Exception):
+                            ws.close()
+                    server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
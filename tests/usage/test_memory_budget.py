@@ -0,0 +1,119 @@
+"""Usage tests I1-I2 (see docs/test-plan.md).
+
+Runs fluxghost with `--memory-budget 1000000`: an upload declared larger
+than the budget, and an opencv image which does not fit next to the ones
+already held, are refused with `MEMORY_BUDGET_EXCEEDED`
+(fluxghost/utils/memory_budget.py); the upload of an image no longer
+counts once it is decoded. What is held shows in the `memory` command of
+/ws/diagnostics and is given back when the connection closes.
+"""
+
+import io
+import json
+import time
+import unittest
+
+from PIL import Image
+
+from tests.usage._harness import WS, Server, make_png, metrics, sample
+
+BUDGET = 1000000
+
+server = None
+
+
+def setUpModule():
+    global server
+    server = Server(['--memory-budget', str(BUDGET)])
+
+
+def tearDownModule():
+    if server is not None:
+        server.stop()
+
+
+def make_bmp(size):
+    # Uncompressed: the upload weighs as much as the decoded image
+    image = Image.new('RGBA', size, (255, 255, 255, 255))
+    out = io.BytesIO()
+    image.save(out, format='BMP')
+    return out.getvalue()
+
+
+def memory():
+    ws = WS(server.port, '/ws/diagnostics')
+    try:
+        ws.send('memory')
+        return json.loads(ws.frame()[1])
+    finally:
+        ws.close()
+
+
+def rejected(subsystem):
+    return sample(metrics(server.port)[1], 'fluxghost_memory_rejected_total', subsystem=subsystem)
+
+
+def upload_image(ws, url, png):
+    ws.send('upload %s %d' % (url, len(png)))
+    reply = ws.json_until(lambda m: True)
+    if reply.get('status') != 'continue':
+        return reply
+    ws.send(png, opcode=2)
+    return ws.json_until(lambda m: True)
+
+
+class MemoryBudgetTest(unittest.TestCase):
+    def test_i1_upload_over_budget(self):
+        # I1: an upload declared larger than the budget is refused before continue, the connection stays usable
+        before = rejected('upload')
+        ws = WS(server.port, '/ws/utils')
+        try:
+            ws.send('get_convex_hull %d' % (BUDGET + 1))
+            reply = ws.json_until(lambda m: True)
+            self.assertEqual(reply['status'], 'error')
+            self.assertEqual(reply['error'], 'MEMORY_BUDGET_EXCEEDED')
+            self.assertIn('upload needs %i bytes' % (BUDGET + 1), reply['info'])
+
+            ws.send('ping')
+            self.assertIn(b'pong', ws.frame()[1])
+        finally:
+            ws.close()
+        self.assertEqual(rejected('upload') - before, 1)
+
+    def test_i2_opencv_images(self):
+        # I2: opencv images are held at 4 bytes a pixel, an upload no longer counts once decoded, an image which
+        # does not fit is refused; closing gives all back
+        bmp = make_bmp((300, 300))
+        ws = WS(server.port, '/ws/opencv')
+        try:
+            self.assertEqual(upload_image(ws, 'a', bmp), {'status': 'ok'})
+            self.assertEqual(upload_image(ws, 'b', bmp), {'status': 'ok'})
+            # Uploading a again, 100x100, replaces it
+            self.assertEqual(upload_image(ws, 'a', make_bmp((100, 100))), {'status': 'ok'})
+
+            held = memory()
+            self.assertEqual(held['budget'], BUDGET)
+            self.assertEqual(held['subsystems'], {'opencv_images': 400000})
+            self.assertEqual(
+                held['connections'], [{'route': 'opencv', 'bytes': 400000, 'subsystems': {'opencv_images': 400000}}]
+            )
+
+            # A small PNG whose 400x400 pixels do not fit once decoded
+            reply = upload_image(ws, 'c', make_png((400, 400)))
+            self.assertEqual(reply['status'], 'error')
+            self.assertEqual(reply['error'], 'MEMORY_BUDGET_EXCEEDED')
+            self.assertEqual(memory()['used'], 400000)
+        finally:
+            ws.close()
+
+        deadline = time.time() + 5
+        while memory()['used'] and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(
+            memory(),
+            {'cmd': 'memory', 'budget': BUDGET, 'used': 0, 'subsystems': {}, 'connections': [], 'status': 'ok'},
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
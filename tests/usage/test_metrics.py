@@ -0,0 +1,123 @@
+"""Usage tests E1-E3 (see docs/test-plan.md).
+
+Reads `GET /metrics` (fluxghost/utils/metrics.py) before and after driving
+websocket routes, and checks the connection gauge, the message and byte
+counters, the command histogram and the upload size histogram move by what
+the client did, in both runmodes, and that the discovery thread's counters
+are exported.
+"""
+
+import json
+import time
+import unittest
+
+from tests.usage._harness import WS, Server, metrics, sample
+
+servers = {}
+
+
+def setUpModule():
+    servers['thread'] = Server()
+    servers['async'] = Server(['--runmode', 'async'])
+
+
+def tearDownModule():
+    for server in servers.values():
+        server.stop()
+
+
+class MetricsTest(unittest.TestCase):
+    def wait_for(self, port, name, expected, **labels):
+        deadline = time.time() + 5
+        while True:
+            _, samples = metrics(port)
+            if sample(samples, name, **labels) == expected or time.time() > deadline:
+                return samples
+
+    def check_route_counters(self, runmode):
+        port = servers[runmode].port
+        resp, before = metrics(port)
+        self.assertEqual(resp.status, 200)
+        self.assertTrue(resp.getheader('Content-Type').startswith('text/plain; version=0.0.4'))
+        self.assertGreaterEqual(sample(before, 'fluxghost_threads'), 1)
+
+        studio = WS(port, '/ws/push-studio')
+        try:
+            studio.send('ping')
+            self.assertEqual(json.loads(studio.frame()[1]), {'status': 'pong'})
+            studio.send('set_handler')
+            self.assertEqual(json.loads(studio.frame()[1])['status'], 'ok')
+            _, during = metrics(port)
+        finally:
+            studio.close()
+
+        route = {'route': 'push-studio'}
+
+        def delta(name, **labels):
+            return sample(during, name, **labels) - sample(before, name, **labels)
+
+        self.assertEqual(delta('fluxghost_websocket_connections', **route), 1)
+        self.assertEqual(delta('fluxghost_websocket_accepted_total', **route), 1)
+        self.assertEqual(delta('fluxghost_websocket_messages_total', direction='in', **route), 2)
+        self.assertEqual(delta('fluxghost_websocket_messages_total', direction='out', **route), 2)
+        self.assertEqual(
+            delta('fluxghost_websocket_bytes_total', direction='in', **route), len('ping') + len('set_handler')
+        )
+        # The reply goes out before the command's timer stops
+        name = 'fluxghost_command_duration_seconds_count'
+        expected = sample(before, name, command='set_handler', **route) + 1
+        during = self.wait_for(port, name, expected, command='set_handler', **route)
+        self.assertEqual(sample(during, name, command='set_handler', **route), expected)
+
+        after = self.wait_for(
+            port, 'fluxghost_websocket_connections', sample(before, 'fluxghost_websocket_connections', **route), **route
+        )
+        self.assertEqual(
+            sample(after, 'fluxghost_websocket_connections', **route),
+            sample(before, 'fluxghost_websocket_connections', **route),
+        )
+
+    def test_e1_websocket_and_command_metrics(self):
+        # E1: one connection, two messages each way and one timed command, in both runmodes
+        for runmode in ('thread', 'async'):
+            with self.subTest(runmode=runmode):
+                self.check_route_counters(runmode)
+
+    def test_e2_upload_size_histogram(self):
+        # E2: a binary upload is observed once, in the in-memory series
+        port = servers['thread'].port
+        _, before = metrics(port)
+        studio = WS(port, '/ws/push-studio')
+        plugin = WS(port, '/ws/inter-process')
+        try:
+            studio.send('set_handler')
+            studio.frame()
+            svg = b'<svg xmlns="http://www.w3.org/2000/svg"><rect width="1" height="1"/></svg>'
+            plugin.send('adobe_illustrator %d {}' % len(svg))
+            self.assertEqual(json.loads(plugin.frame()[1]), {'status': 'continue'})
+            plugin.send(svg, opcode=2)
+            studio.frame()
+        finally:
+            plugin.close()
+            studio.close()
+        _, after = metrics(port)
+        name = 'fluxghost_upload_bytes_count'
+        self.assertEqual(sample(after, name, storage='memory') - sample(before, name, storage='memory'), 1)
+        name = 'fluxghost_upload_bytes_sum'
+        self.assertEqual(sample(after, name, storage='memory') - sample(before, name, storage='memory'), len(svg))
+
+
+    def test_e3_discovery_series(self):
+        # E3: the discovery counters exist from the start, in both runmodes
+        for runmode, server in servers.items():
+            with self.subTest(runmode=runmode):
+                _, samples = metrics(server.port)
+                for result in ('processed', 'malformed'):
+                    key = ('fluxghost_discover_datagrams_total', frozenset({('result', result)}))
+                    self.assertGreaterEqual(samples[key], 0)
+                self.assertGreaterEqual(samples['fluxghost_discover_full_rounds_total', frozenset()], 0)
+                self.assertGreaterEqual(samples['fluxghost_discover_socket_drops', frozenset()], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""Usage tests Z1-Z2 (see docs/test-plan.md).
+
+Runs fluxghost with `--offload-processes 2`, so the image commands of
+/ws/utils, /ws/opencv and /ws/image-tracer run in the offload pool
+(fluxghost/utils/offload.py): their results are the ones computed inline,
+and `interrupt` stops a running trace at once, kills its process and leaves
+no shared memory behind.
+"""
+
+import json
+import os
+import socket
+import time
+import unittest
+
+from tests.usage._harness import WS, Server, make_png, metrics, sample
+
+server = None
+
+
+def setUpModule():
+    global server
+    server = Server(['--offload-processes', '2'])
+
+
+def tearDownModule():
+    if server is not None:
+        server.stop()
+
+
+BLACK = (0, 0, 0, 255)
+
+
+def upload(ws, command, data):
+    ws.send(command)
+    ws.json_until(lambda m: m.get('status') == 'continue')
+    ws.send(data, opcode=2)
+
+
+def offload_jobs():
+    samples = metrics(server.port)[1]
+    return {result: sample(samples, 'fluxghost_offload_jobs_total', result=result) for result in ('ok', 'cancelled')}
+
+
+def shared_memory_files():
+    if not os.path.isdir('/dev/shm'):
+        return set()
+    return {name for name in os.listdir('/dev/shm') if name.startswith('psm_')}
+
+
+class OffloadTest(unittest.TestCase):
+    def test_z1_results_from_pool(self):
+        # Z1: get_convex_hull and image_contour answer as inline, from the pool
+        before = offload_jobs()
+        png = make_png((200, 150), rect=(40, 30, 160, 120), fg=BLACK)
+
+        ws = WS(server.port, '/ws/utils')
+        try:
+            upload(ws, 'get_convex_hull %d' % len(png), png)
+            ok = ws.json_until(lambda m: m.get('status') in ('ok', 'error'))
+        finally:
+            ws.close()
+        self.assertEqual(ok, {'status': 'ok', 'data': [[40, 30], [160, 30], [160, 120], [40, 120]]})
+
+        ws = WS(server.port, '/ws/opencv')
+        try:
+            upload(ws, 'image_contour %d %s' % (len(png), json.dumps({'epsilon': 1})), png)
+            ok = ws.json_until(lambda m: m.get('status') in ('ok', 'error'))
+        finally:
+            ws.close()
+        self.assertEqual(ok['status'], 'ok')
+        self.assertEqual(len(ok['contours']), 1)
+        xs = [p[0] for p in ok['contours'][0]]
+        ys = [p[1] for p in ok['contours'][0]]
+        self.assertEqual((min(xs), max(xs), min(ys), max(ys)), (40, 160, 30, 120))
+
+        self.assertEqual(offload_jobs()['ok'] - before['ok'], 2)
+
+    def test_z2_interrupt_kills_trace(self):
+        # Z2: interrupt a trace taking seconds: ok at once, no svg, no shared memory left, next trace works
+        shm_before = shared_memory_files()
+        before = offload_jobs()
+        big = make_png((1500, 1500), rect=(100, 100, 1400, 1300), fg=BLACK)
+        ws = WS(server.port, '/ws/image-tracer')
+        try:
+            upload(ws, 'image_trace %d 128' % len(big), big)
+            time.sleep(0.5)
+            t = time.time()
+            ws.send('interrupt')
+            self.assertEqual(ws.json_until(lambda m: True), {'status': 'ok'})
+            self.assertLess(time.time() - t, 1)
+
+            ws.sock.settimeout(2)
+            with self.assertRaises(socket.timeout):
+                ws.frame()
+            ws.sock.settimeout(15)
+
+            small = make_png((100, 100), rect=(10, 10, 80, 80), fg=BLACK)
+            upload(ws, 'image_trace %d 128' % len(small), small)
+            ok = ws.json_until(lambda m: m.get('status') in ('ok', 'error'))
+        finally:
+            ws.close()
+
+        self.assertIn('<svg width="100" height="100"', ok['svg'])
+        self.assertEqual(offload_jobs()['cancelled'] - before['cancelled'], 1)
+        self.assertEqual(shared_memory_files() - shm_before, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""Usage tests R1-R2 (see docs/test-plan.md).
+
+Covers the websocket route table (fluxghost/http_websocket_route.py): routes
+match the whole path, optionally followed by a slash or a query string, and
+a server started with `--warm-routes` serves the same routes.
+"""
+
+import json
+import unittest
+
+from tests.usage._harness import WS, Server
+
+server = None
+
+
+def setUpModule():
+    global server
+    server = Server(['--warm-routes'])
+
+
+def tearDownModule():
+    if server is not None:
+        server.stop()
+
+
+class RoutingTest(unittest.TestCase):
+    def assert_ver(self, path):
+        ws = WS(server.port, path)
+        try:
+            op, payload = ws.frame()
+            self.assertEqual(op, 1)
+            self.assertIn('fluxghost', json.loads(payload))
+        finally:
+            ws.close()
+
+    def test_r1_routes_match_whole_path(self):
+        # R1: a query string or trailing slash still matches, a longer name does not
+        for path in ('/ws/ver', '/ws/ver/', '/ws/ver?v=1'):
+            self.assert_ver(path)
+        for path in ('/ws/verbose', '/ws/utilsx', '/ws/camera', '/ws/control/usb/'):
+            with self.assertRaises(ConnectionError, msg=path) as cm:
+                WS(server.port, path)
+            self.assertIn('404', str(cm.exception))
+
+    def test_r2_warm_routes_serves_requests(self):
+        # R2: connections made while or after handler modules are warmed work as before
+        sockets = [WS(server.port, path) for path in ('/ws/push-studio', '/ws/inter-process', '/ws/utils')]
+        try:
+            for ws in sockets:
+                ws.send('ping')
+                self.assertEqual(json.loads(ws.frame()[1]), {'status': 'pong'})
+        finally:
+            for ws in sockets:
+                ws.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
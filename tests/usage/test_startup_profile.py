@@ -0,0 +1,55 @@
+"""Usage test B1 (see docs/test-plan.md).
+
+Starts a server with `--profile-startup` and checks the JSON report: the
+startup phases in order around the ready line, and per-module import times
+that add up the way `-X importtime` reports them.
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+from tests.usage._harness import WS, Server
+
+PHASES = ('setup_env', 'import_server', 'certs', 'configure_uploads', 'server_init', 'bind', 'ssl', 'discover')
+
+
+class StartupProfileTest(unittest.TestCase):
+    def test_b1_profile_startup_report(self):
+        # B1: the report is written once the server is up, which keeps serving
+        fd, report_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.unlink, report_path)
+        server = Server(['--profile-startup', report_path])
+        try:
+            ws = WS(server.port, '/ws/ver')
+            self.assertIn('fluxghost', json.loads(ws.frame()[1]))
+            ws.close()
+        finally:
+            server.stop()
+
+        with open(report_path) as f:
+            report = json.load(f)
+        spans = {span['name']: span for span in report['spans']}
+        for name in PHASES:
+            self.assertIn(name, spans)
+            self.assertGreaterEqual(spans[name]['duration_ms'], 0)
+        self.assertEqual(spans['bind']['depth'], 1)
+        ready = [mark['at_ms'] for mark in report['marks'] if mark['name'] == 'ready']
+        self.assertEqual(len(ready), 1)
+        self.assertLess(spans['bind']['start_ms'], ready[0])
+        self.assertLess(ready[0], spans['discover']['start_ms'])
+        self.assertLessEqual(ready[0], report['total_ms'])
+
+        imports = {record['module']: record for record in report['imports']}
+        self.assertIn('fluxghost.http_server', imports)
+        self.assertIn('fluxghost.http_server_base', imports)
+        server_import = imports['fluxghost.http_server']
+        self.assertGreaterEqual(server_import['cumulative_ms'], imports['fluxghost.http_server_base']['cumulative_ms'])
+        self.assertLessEqual(server_import['self_ms'], server_import['cumulative_ms'] + 0.001)
+        self.assertLessEqual(server_import['cumulative_ms'], spans['import_server']['duration_ms'] + 0.001)
+
+
+if __name__ == '__main__':
+    unittest.main()
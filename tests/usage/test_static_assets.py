@@ -0,0 +1,159 @@
+"""Usage tests H1-H6 (see docs/test-plan.md).
+
+Serves a temporary `--assets` folder and fetches it over one keep-alive
+connection, the way the Beam Studio web build loads its bundle from
+fluxghost: conditional requests, a large asset and a precompressed one, and
+the Range requests a video element or a resumed download sends.
+"""
+
+import email
+import gzip
+import http.client
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests.usage._harness import Server
+
+server = None
+assets = None
+
+SMALL = b'console.log("beam");\n' * 200
+LARGE = os.urandom(3 * 2**20 + 17)
+
+
+def setUpModule():
+    global server, assets
+    assets = tempfile.mkdtemp()
+    with open(os.path.join(assets, 'main.js'), 'wb') as f:
+        f.write(SMALL)
+    with open(os.path.join(assets, 'main.js.gz'), 'wb') as f:
+        f.write(gzip.compress(SMALL))
+    with open(os.path.join(assets, 'model.bin'), 'wb') as f:
+        f.write(LARGE)
+    server = Server(['--assets', assets])
+
+
+def tearDownModule():
+    if server is not None:
+        server.stop()
+    shutil.rmtree(assets, ignore_errors=True)
+
+
+class StaticAssetsTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=15)
+        self.addCleanup(self.conn.close)
+
+    def get(self, path, **headers):
+        self.conn.request('GET', path, headers=headers)
+        resp = self.conn.getresponse()
+        return resp, resp.read()
+
+    def test_h1_etag_and_if_modified_since_revalidate(self):
+        # H1: a reload revalidates instead of downloading the asset again
+        resp, body = self.get('/main.js')
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(body, SMALL)
+        self.assertEqual(resp.getheader('Cache-Control'), 'no-cache')
+        etag = resp.getheader('ETag')
+        last_modified = resp.getheader('Last-Modified')
+        self.assertTrue(etag and last_modified)
+
+        resp, body = self.get('/main.js', **{'If-None-Match': etag})
+        self.assertEqual((resp.status, body), (304, b''))
+        self.assertEqual(resp.getheader('ETag'), etag)
+
+        resp, body = self.get('/main.js', **{'If-Modified-Since': last_modified})
+        self.assertEqual((resp.status, body), (304, b''))
+
+        resp, body = self.get('/main.js', **{'If-None-Match': '"stale"', 'If-Modified-Since': last_modified})
+        self.assertEqual((resp.status, body), (200, SMALL))
+
+    def test_h2_large_asset_on_keepalive_connection(self):
+        # H2: an asset above the memory cache limit is streamed from the file,
+        # and the connection stays usable for the next request
+        for _ in range(2):
+            resp, body = self.get('/model.bin')
+            self.assertEqual(resp.status, 200)
+            self.assertEqual(int(resp.getheader('Content-Length')), len(LARGE))
+            self.assertEqual(body, LARGE)
+        resp, body = self.get('/main.js')
+        self.assertEqual(body, SMALL)
+
+    def test_h3_precompressed_sibling(self):
+        # H3: main.js.gz is served for main.js when gzip is accepted
+        resp, body = self.get('/main.js', **{'Accept-Encoding': 'gzip, deflate, br;q=0'})
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(resp.getheader('Content-Type'), 'application/x-javascript')
+        self.assertEqual(gzip.decompress(body), SMALL)
+        self.assertIn('Accept-Encoding', resp.getheader('Vary'))
+
+        resp, body = self.get('/main.js', **{'Accept-Encoding': 'identity'})
+        self.assertIsNone(resp.getheader('Content-Encoding'))
+        self.assertEqual(body, SMALL)
+
+    def test_h4_single_ranges(self):
+        # H4: explicit, open-ended and suffix spans of a sendfile'd asset
+        for header, start, until in (
+            ('bytes=100-199', 100, 200),
+            ('bytes=%i-' % (len(LARGE) - 1000), len(LARGE) - 1000, len(LARGE)),
+            ('bytes=-500', len(LARGE) - 500, len(LARGE)),
+            ('bytes=2000000-99999999', 2000000, len(LARGE)),
+        ):
+            resp, body = self.get('/model.bin', Range=header)
+            self.assertEqual(resp.status, 206, header)
+            self.assertEqual(resp.getheader('Content-Range'), 'bytes %i-%i/%i' % (start, until - 1, len(LARGE)))
+            self.assertEqual(body, LARGE[start:until], header)
+
+        resp, body = self.get('/main.js', Range='bytes=10-19')
+        self.assertEqual((resp.status, body), (206, SMALL[10:20]))
+
+        resp, body = self.get('/main.js', Range='bytes=%i-' % len(SMALL))
+        self.assertEqual(resp.status, 416)
+        self.assertEqual(resp.getheader('Content-Range'), 'bytes */%i' % len(SMALL))
+
+        resp, body = self.get('/main.js', Range='bytes=20-10')
+        self.assertEqual((resp.status, body), (200, SMALL))
+
+    def test_h5_multipart_byteranges(self):
+        # H5: several spans come back as multipart/byteranges; overlapping
+        # spans are merged
+        resp, body = self.get('/model.bin', Range='bytes=0-9, 1000-1999, 1500-2499, -10')
+        self.assertEqual(resp.status, 206)
+        content_type = resp.getheader('Content-Type')
+        self.assertTrue(content_type.startswith('multipart/byteranges; boundary='))
+        self.assertEqual(int(resp.getheader('Content-Length')), len(body))
+
+        message = email.message_from_bytes(b'Content-Type: %s\r\n\r\n' % content_type.encode() + body)
+        parts = [(part['Content-Range'], part.get_payload(decode=True)) for part in message.get_payload()]
+        size = len(LARGE)
+        self.assertEqual(
+            parts,
+            [
+                ('bytes 0-9/%i' % size, LARGE[:10]),
+                ('bytes 1000-2499/%i' % size, LARGE[1000:2500]),
+                ('bytes %i-%i/%i' % (size - 10, size - 1, size), LARGE[-10:]),
+            ],
+        )
+
+    def test_h6_if_range_resumes_only_unchanged_asset(self):
+        # H6: a resumed download gets the rest only while the asset is unchanged
+        resp, _ = self.get('/model.bin', Range='bytes=0-0')
+        etag = resp.getheader('ETag')
+        last_modified = resp.getheader('Last-Modified')
+
+        resp, body = self.get('/model.bin', Range='bytes=3000000-', **{'If-Range': etag})
+        self.assertEqual((resp.status, body), (206, LARGE[3000000:]))
+        resp, body = self.get('/model.bin', Range='bytes=3000000-', **{'If-Range': last_modified})
+        self.assertEqual((resp.status, body), (206, LARGE[3000000:]))
+
+        resp, body = self.get('/model.bin', Range='bytes=3000000-', **{'If-Range': '"changed"'})
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(body, LARGE)
+
+
+if __name__ == '__main__':
+    unittest.main()
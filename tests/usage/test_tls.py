@@ -0,0 +1,192 @@
+"""Usage tests W1-W2 (see docs/test-plan.md).
+
+Runs fluxghost with a self-signed certificate (made with the `openssl`
+command) in $FLUX_GHOST_CERT_DIR and `--ssl-port`, in both runmodes: clients
+which open the HTTPS port and never handshake hold up no other connection,
+nor does a TLS websocket which sent half a TLS record, and a client
+reconnecting with its TLS session resumes it.
+"""
+
+import base64
+import http.client
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import time
+import unittest
+
+from tests.usage._harness import WS, Server, metrics
+
+servers = {}
+tmpdir = None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def setUpModule():
+    global tmpdir
+    if not shutil.which('openssl'):
+        raise unittest.SkipTest('openssl command not found')
+    tmpdir = tempfile.mkdtemp()
+    args = ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost']
+    args += ['-keyout', os.path.join(tmpdir, 'privkey.pem'), '-out', os.path.join(tmpdir, 'fullchain.pem')]
+    subprocess.check_call(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    old = os.environ.get('FLUX_GHOST_CERT_DIR')
+    os.environ['FLUX_GHOST_CERT_DIR'] = tmpdir
+    try:
+        for runmode in ('thread', 'async'):
+            ssl_port = free_port()
+            servers[runmode] = (Server(['--runmode', runmode, '--ssl-port', str(ssl_port)]), ssl_port)
+    finally:
+        if old is None:
+            del os.environ['FLUX_GHOST_CERT_DIR']
+        else:
+            os.environ['FLUX_GHOST_CERT_DIR'] = old
+
+
+def tearDownModule():
+    for server, _ in servers.values():
+        server.stop()
+    if tmpdir is not None:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def client_context():
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+class RawTlsWebsocket:
+    """A websocket over TLS whose records are sent on the raw socket by the test, in pieces if it likes."""
+
+    def __init__(self, port, path):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+        self.incoming = ssl.MemoryBIO()
+        self.outgoing = ssl.MemoryBIO()
+        self.tls = client_context().wrap_bio(self.incoming, self.outgoing)
+        while True:
+            try:
+                self.tls.do_handshake()
+                break
+            except ssl.SSLWantReadError:
+                self.sock.sendall(self.outgoing.read())
+                self.incoming.write(self.sock.recv(65536))
+        self.sock.sendall(self.outgoing.read())
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall(
+            self.records(
+                (
+                    'GET %s HTTP/1.1\r\nHost: 127.0.0.1:%d\r\n'
+                    'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                    'Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n'
+                    'Origin: http://127.0.0.1\r\n\r\n' % (path, port, key)
+                ).encode()
+            )
+        )
+        self.buf = b''
+        while b'\r\n\r\n' not in self.buf:
+            self.buf += self.read()
+        head, self.buf = self.buf.split(b'\r\n\r\n', 1)
+        assert b' 101 ' in head.split(b'\r\n', 1)[0], head
+
+    def records(self, data):
+        """The TLS records carrying data, to be sent by the caller."""
+        self.tls.write(data)
+        return self.outgoing.read()
+
+    def text_frame(self, text):
+        payload = text.encode()
+        mask = os.urandom(4)
+        return bytes([0x81, 0x80 | len(payload)]) + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    def read(self):
+        while True:
+            try:
+                return self.tls.read(65536)
+            except ssl.SSLWantReadError:
+                chunk = self.sock.recv(65536)
+                if not chunk:
+                    raise EOFError('connection closed')
+                self.incoming.write(chunk)
+
+    def close(self):
+        self.sock.close()
+
+
+class TlsTest(unittest.TestCase):
+    def test_w1_stalled_handshakes(self):
+        # W1: three clients sit on the HTTPS port without a ClientHello; HTTP and HTTPS still answer at once
+        for runmode, (server, ssl_port) in servers.items():
+            with self.subTest(runmode=runmode):
+                stalled = [socket.create_connection(('127.0.0.1', ssl_port)) for _ in range(3)]
+                try:
+                    time.sleep(0.2)
+                    t = time.time()
+                    plain = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+                    secure = http.client.HTTPSConnection('127.0.0.1', ssl_port, timeout=5, context=client_context())
+                    try:
+                        self.assertEqual(metrics(server.port, conn=plain)[0].status, 200)
+                        self.assertEqual(metrics(ssl_port, conn=secure)[0].status, 200)
+                    finally:
+                        plain.close()
+                        secure.close()
+                    self.assertLess(time.time() - t, 2)
+                finally:
+                    for sock in stalled:
+                        sock.close()
+
+    def test_w3_partial_tls_record(self):
+        # W3: a TLS websocket holding half a TLS record stalls nobody; once the rest arrives it is answered
+        for runmode, (server, ssl_port) in servers.items():
+            with self.subTest(runmode=runmode):
+                secure = RawTlsWebsocket(ssl_port, '/ws/push-studio')
+                try:
+                    record = secure.records(secure.text_frame('ping'))
+                    secure.sock.sendall(record[: len(record) // 2])
+                    time.sleep(0.2)
+
+                    t = time.time()
+                    ws = WS(server.port, '/ws/push-studio', timeout=5)
+                    try:
+                        ws.send('ping')
+                        self.assertIn(b'pong', ws.frame()[1])
+                    finally:
+                        ws.close()
+                    self.assertLess(time.time() - t, 2)
+
+                    secure.sock.sendall(record[len(record) // 2 :])
+                    while b'pong' not in secure.buf:
+                        secure.buf += secure.read()
+                finally:
+                    secure.close()
+
+    def test_w2_session_resumption(self):
+        # W2: a second connection offering the first one's session resumes it
+        for runmode, (_, ssl_port) in servers.items():
+            with self.subTest(runmode=runmode):
+                ctx = client_context()
+                first = http.client.HTTPSConnection('127.0.0.1', ssl_port, timeout=5, context=ctx)
+                try:
+                    self.assertEqual(metrics(ssl_port, conn=first)[0].status, 200)
+                    session = first.sock.session
+                    self.assertFalse(first.sock.session_reused)
+                finally:
+                    first.close()
+
+                with socket.create_connection(('127.0.0.1', ssl_port), timeout=5) as raw:
+                    with ctx.wrap_socket(raw, session=session) as sock:
+                        self.assertTrue(sock.session_reused)
+
+
+if __name__ == '__main__':
+    unittest.main()
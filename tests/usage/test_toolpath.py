@@ -316,28 +316,25 @@ class ToolpathTest(unittest.TestCase):
         self.ws.json_until(lambda m: m.get('status') == 'computing')
         self.ws.send('interrupt')
 
-        # The interrupt ack and go's progress frames are written by two server
-        # threads without a send lock (fluxghost/utils/websocket.py:_send emits
-        # the 2-byte header and the payload as separate send() calls), so the
-        # frame stream can interleave and defeat a frame-level parser -- pins
-        # current quirk, see docs/todo.md. Beam Studio never notices because it
-        # discards the socket right after interrupting (resetWebsocket). Each
-        # payload < 4 KB is still written by a single send() call, so scan the
-        # raw byte stream for the payloads instead of parsing frames.
-        data = bytes(self.ws.buf)
-        self.ws.buf = b''
+        # The interrupt ack and go's progress frames come from two server
+        # threads; the per-connection send queue keeps the frames intact, so
+        # parse them until the interrupted go goes quiet.
+        texts, binaries = [], []
         self.ws.sock.settimeout(6)
         try:
             while True:
-                chunk = self.ws.sock.recv(65536)
-                if not chunk:
+                op, payload = self.ws.frame()
+                if op == 1:
+                    texts.append(json.loads(payload))
+                elif op == 2:
+                    binaries.append(payload)
+                elif op == 8:
                     break
-                data += chunk
         except socket.timeout:
             pass  # went quiet: the interrupted go stopped without replying
-        self.assertIn(b'{"status": "ok"}', data, 'interrupt was not acknowledged: %r' % data[-200:])
-        self.assertNotIn(b'"status": "complete"', data, 'go finished despite interrupt')
-        self.assertNotIn(b'FCx', data, 'FCode was streamed despite interrupt')
+        self.assertIn({'status': 'ok'}, texts, 'interrupt was not acknowledged: %r' % texts[-5:])
+        self.assertNotIn('complete', [m.get('status') for m in texts], 'go finished despite interrupt')
+        self.assertFalse(binaries, 'FCode was streamed despite interrupt')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,150 @@
+"""Usage tests J1-J2 (see docs/test-plan.md).
+
+Runs fluxghost with `--trace <file>` and `--trace-otlp` pointed at a stand-in
+collector in this process (fluxghost/utils/tracing.py): commands and upload
+callbacks are spans of one trace, the JSON lines and the OTLP export carry the
+same spans, and on svgeditor-laser-parser the `go` stages nest under `go` in
+the trace started by `svgeditor_upload`.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tests.usage import test_toolpath as toolpath
+from tests.usage._harness import WS, Server
+
+server = None
+collector = None
+tmpdir = None
+
+
+class Collector(BaseHTTPRequestHandler):
+    spans = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        for resource in body['resourceSpans']:
+            for scope in resource['scopeSpans']:
+                Collector.spans.extend(scope['spans'])
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+
+def setUpModule():
+    global server, collector, tmpdir
+    tmpdir = tempfile.mkdtemp()
+    collector = ThreadingHTTPServer(('127.0.0.1', 0), Collector)
+    threading.Thread(target=collector.serve_forever, daemon=True).start()
+    endpoint = 'http://127.0.0.1:%i/v1/traces' % collector.server_address[1]
+    server = Server(['--trace', os.path.join(tmpdir, 'trace.jsonl'), '--trace-otlp', endpoint])
+
+
+def tearDownModule():
+    if server is not None:
+        server.stop()
+    if collector is not None:
+        collector.shutdown()
+        collector.server_close()
+    if tmpdir is not None:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def read_spans(pred, count, timeout=10):
+    """Spans of the trace file matching pred, once there are count of them."""
+    deadline = time.time() + timeout
+    while True:
+        with open(os.path.join(tmpdir, 'trace.jsonl')) as f:
+            spans = [s for s in map(json.loads, f) if pred(s)]
+        if len(spans) >= count or time.time() > deadline:
+            return spans
+        time.sleep(0.1)
+
+
+class TracingTest(unittest.TestCase):
+    def test_j1_command_and_upload_spans(self):
+        # J1: a command and its upload callback are root spans of one trace, exported both ways
+        studio = WS(server.port, '/ws/push-studio')
+        plugin = WS(server.port, '/ws/inter-process')
+        try:
+            studio.send('set_handler')
+            studio.frame()
+            svg = b'<svg xmlns="http://www.w3.org/2000/svg"/>'
+            plugin.send('adobe_illustrator %d {}' % len(svg))
+            self.assertEqual(json.loads(plugin.frame()[1]), {'status': 'continue'})
+            plugin.send(svg, opcode=2)
+            studio.frame()
+        finally:
+            plugin.close()
+            studio.close()
+
+        spans = read_spans(lambda s: s['attributes'].get('route') == 'inter-process', 2)
+        by_name = {s['name']: s for s in spans}
+        command, callback = by_name['adobe_illustrator'], by_name['adobe_illustrator upload']
+        self.assertEqual(command['trace_id'], callback['trace_id'])
+        self.assertIsNone(command['parent_id'])
+        self.assertIsNone(callback['parent_id'])
+        self.assertEqual(command['attributes']['params'], '%d {}' % len(svg))
+        self.assertLessEqual(command['end'], callback['start'])
+        self.assertGreaterEqual(command['duration_ms'], 0)
+
+        deadline = time.time() + 10
+        while time.time() < deadline and callback['span_id'] not in [s['spanId'] for s in Collector.spans]:
+            time.sleep(0.1)
+        exported = {s['spanId']: s for s in Collector.spans}
+        self.assertIn(callback['span_id'], exported)
+        self.assertEqual(exported[callback['span_id']]['traceId'], callback['trace_id'])
+        self.assertEqual(exported[callback['span_id']]['name'], 'adobe_illustrator upload')
+
+    def test_j2_toolpath_stages(self):
+        # J2: go's stages are children of go, in the trace of svgeditor_upload
+        try:
+            ws = WS(server.port, toolpath.PATH, timeout=120)
+        except ConnectionError as e:
+            self.skipTest('svgeditor-laser-parser route unavailable (fluxsvg/beamify missing?): %s' % e)
+        try:
+            payload = toolpath.THUMBNAIL + toolpath.BEAM_SCENE_SVG
+            thumbnail_length = len(toolpath.THUMBNAIL)
+            ws.send('svgeditor_upload scene.svg %d %d %s' % (len(payload), thumbnail_length, toolpath.UPLOAD_FLAGS))
+            ws.json_until(lambda m: m.get('status') == 'continue')
+            ws.send(payload, opcode=2)
+            ws.json_until(lambda m: m.get('status') == 'ok', max_frames=500)
+            ws.send('go scene.svg %s' % toolpath.GO_FLAGS)
+            msg = ws.json_until(lambda m: m.get('status') == 'complete', max_frames=1000)
+            length = msg['length']
+            while length > 0:
+                op, data = ws.frame()
+                if op in (0, 2):
+                    length -= len(data)
+        finally:
+            ws.close()
+
+        spans = read_spans(lambda s: s['attributes'].get('route') == 'svgeditor-laser-parser' or s['parent_id'], 10)
+        by_name = {}
+        for s in spans:
+            by_name.setdefault(s['name'], s)
+        upload, go = by_name['svgeditor_upload'], by_name['go']
+        self.assertEqual(go['trace_id'], upload['trace_id'])
+        self.assertEqual(by_name['svgeditor_upload upload']['trace_id'], upload['trace_id'])
+        self.assertEqual(by_name['svg_image']['parent_id'], by_name['svgeditor_upload upload']['span_id'])
+        for stage in ('factory', 'thumbnail', 'taskcode', 'terminate', 'get_buffer', 'send'):
+            self.assertEqual(by_name[stage]['parent_id'], go['span_id'], stage)
+            self.assertGreaterEqual(by_name[stage]['start'], go['start'])
+            self.assertLessEqual(by_name[stage]['end'], go['end'])
+        self.assertEqual(by_name['send']['attributes']['bytes'], msg['length'])
+        self.assertEqual(by_name['get_buffer']['attributes']['bytes'], msg['length'])
+        self.assertIn('time_cost', go['attributes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
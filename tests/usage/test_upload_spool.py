@@ -0,0 +1,143 @@
+"""Usage tests S1-S4 (see docs/test-plan.md).
+
+Runs a server with a tiny `--upload-spool-threshold` so the uploads below are
+received into an mmap'd temp file instead of RAM, and checks that the
+endpoints reading them (an image decoded by `utils`, an SVG decoded as text
+by `inter-process`, a plain SVG divided by `svgeditor-laser-parser`) behave
+exactly as with an in-RAM upload; a negative upload length is refused.
+"""
+
+import io
+import json
+import os
+import unittest
+
+from PIL import Image, ImageDraw
+
+from tests.usage._harness import WS, Server
+
+SPOOL_THRESHOLD = 4096
+
+server = None
+
+
+def setUpModule():
+    global server
+    server = Server(['--upload-spool-threshold', str(SPOOL_THRESHOLD)])
+
+
+def tearDownModule():
+    if server is not None:
+        server.stop()
+
+
+class UploadSpoolTest(unittest.TestCase):
+    def convex_hull(self, ws, data, chunk_size):
+        ws.send('get_convex_hull %d' % len(data))
+        self.assertEqual(json.loads(ws.frame()[1]), {'status': 'continue'})
+        for i in range(0, len(data), chunk_size):
+            ws.send(data[i : i + chunk_size], opcode=2)
+        msg = ws.json_until(lambda m: m.get('status') in ('ok', 'error'))
+        self.assertEqual(msg['status'], 'ok')
+        return msg['data']
+
+    def test_s1_spooled_image_upload(self):
+        # S1: the same image in one frame (received in place) and in 128 KB
+        # chunks (copied in) gives the same hull; a small upload stays in RAM.
+        image = Image.frombytes('L', (512, 512), os.urandom(512 * 512)).convert('RGBA')
+        ImageDraw.Draw(image).rectangle((100, 120, 300, 360), fill=(0, 0, 0, 255))
+        out = io.BytesIO()
+        image.save(out, format='PNG')
+        data = out.getvalue()
+        self.assertGreater(len(data), 2**17)
+
+        small = Image.new('RGBA', (64, 64), (255, 255, 255, 255))
+        ImageDraw.Draw(small).rectangle((10, 20, 40, 50), fill=(0, 0, 0, 255))
+        out = io.BytesIO()
+        small.save(out, format='PNG')
+        self.assertLess(len(out.getvalue()), SPOOL_THRESHOLD)
+
+        ws = WS(server.port, '/ws/utils', timeout=60)
+        try:
+            whole = self.convex_hull(ws, data, len(data))
+            chunked = self.convex_hull(ws, data, 2**17)
+            self.assertEqual(whole, chunked)
+            self.assertEqual(len(self.convex_hull(ws, out.getvalue(), 2**17)), 4)
+        finally:
+            ws.close()
+
+    def test_s2_spooled_svg_relayed_as_text(self):
+        # S2: inter-process decodes the upload with str(); a spooled SVG must
+        # reach push-studio unchanged.
+        svg = (
+            '<svg xmlns="http://www.w3.org/2000/svg">%s</svg>'
+            % ''.join('<rect x="%d" y="%d" width="1" height="1"/>' % (i, i) for i in range(2000))
+        ).encode()
+        self.assertGreater(len(svg), SPOOL_THRESHOLD)
+
+        studio = WS(server.port, '/ws/push-studio')
+        plugin = WS(server.port, '/ws/inter-process')
+        try:
+            studio.send('set_handler')
+            self.assertEqual(json.loads(studio.frame()[1])['status'], 'ok')
+            plugin.send('adobe_illustrator %d {}' % len(svg))
+            self.assertEqual(json.loads(plugin.frame()[1]), {'status': 'continue'})
+            plugin.send(svg[:1000], opcode=2)
+            plugin.send(svg[1000:], opcode=2)
+            msg = json.loads(studio.frame()[1])
+            self.assertEqual(msg['svg'], svg.decode())
+        finally:
+            plugin.close()
+            studio.close()
+
+    def test_s3_spooled_plain_svg_divided(self):
+        # S3: upload_plain_svg keeps the upload and divide_svg rewrites it
+        # with bytes.replace(); a spooled one must divide as in RAM.
+        svg = (
+            '<svg xmlns="http://www.w3.org/2000/svg" width="100" height="100" viewBox="0 0 100 100">%s</svg>'
+            % ''.join(
+                '<rect x="%d" y="%d" width="1" height="1" fill="none" stroke="#000000"/>' % (i % 90, i % 90)
+                for i in range(200)
+            )
+        ).encode()
+        self.assertGreater(len(svg), SPOOL_THRESHOLD)
+
+        try:
+            ws = WS(server.port, '/ws/svgeditor-laser-parser', timeout=60)
+        except ConnectionError as e:
+            self.skipTest('svgeditor-laser-parser route unavailable (fluxsvg/beamify missing?): %s' % e)
+        try:
+            ws.send('upload_plain_svg plain-svg %d' % len(svg))
+            self.assertEqual(json.loads(ws.frame()[1]), {'status': 'continue'})
+            ws.send(svg, opcode=2)
+            self.assertEqual(ws.json_until(lambda m: True), {'status': 'ok'})
+
+            ws.send('divide_svg')
+            names = []
+            while True:
+                msg = ws.json_until(lambda m: True)
+                if msg.get('status') == 'ok':
+                    break
+                self.assertIn('name', msg, msg)
+                names.append(msg['name'])
+                self.assertEqual(len(ws.frame()[1]), msg['length'])
+            self.assertEqual(names, ['strokes', 'bitmap', 'colors'])
+        finally:
+            ws.close()
+
+
+    def test_s4_negative_upload_length(self):
+        # S4: a negative length is a bad parameter, refused before continue;
+        # the connection stays usable.
+        ws = WS(server.port, '/ws/utils')
+        try:
+            ws.send('get_convex_hull -5')
+            self.assertEqual(ws.json_until(lambda m: True), {'status': 'Error', 'message': 'BAD_PARAM_TYPE'})
+            ws.send('ping')
+            self.assertIn(b'pong', ws.frame()[1])
+        finally:
+            ws.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
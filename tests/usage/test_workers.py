@@ -0,0 +1,124 @@
+"""Usage tests Y1-Y3 (see docs/test-plan.md).
+
+Runs `ghost.py --workers 3` in both runmodes: the kernel spreads new
+connections over the three processes (told apart by the `fluxghost_worker`
+gauge of `/metrics`), each of them answers websockets and shows the
+simulated device on `/ws/discover`, and stopping the leader stops them all;
+a worker dying stops the leader, rather than leaving it with fewer workers.
+"""
+
+import os
+import signal
+import socket
+import sys
+import time
+import unittest
+
+from tests.usage._harness import SIM_UUID, WS, Server, metrics, sample
+
+WORKERS = 3
+
+
+def setUpModule():
+    if not sys.platform.startswith('linux') or not hasattr(socket, 'SO_REUSEPORT'):
+        raise unittest.SkipTest('--workers needs SO_REUSEPORT, tested on Linux')
+
+
+def worker_of(port):
+    return int(sample(metrics(port)[1], 'fluxghost_worker'))
+
+
+def children(pid, count, timeout=5):
+    """Wait until pid has count child processes and return their pids (the ready line comes before the fork)."""
+    deadline = time.time() + timeout
+    while True:
+        found = _children(pid)
+        if len(found) >= count or time.time() > deadline:
+            return found
+        time.sleep(0.05)
+
+
+def running(pids, timeout=5):
+    """Wait until none of pids runs any more; return those still running."""
+    deadline = time.time() + timeout
+    while True:
+        found = [pid for pid in pids if _state(pid) not in (None, 'Z')]
+        if not found or time.time() > deadline:
+            return found
+        time.sleep(0.1)
+
+
+def _state(pid):
+    # None once it is reaped; a zombie (Z) waits for init to reap it
+    try:
+        with open('/proc/%i/stat' % pid) as f:
+            return f.read().rsplit(')', 1)[1].split()[0]
+    except OSError:
+        return None
+
+
+def _children(pid):
+    found = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # pid (comm) state ppid ...; comm may hold spaces
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            found.append(int(entry))
+    return found
+
+
+class WorkersTest(unittest.TestCase):
+    def test_y1_connections_spread(self):
+        # Y1: 40 new connections reach all three processes; each one answers ping and lists the simulated device
+        for runmode in ('thread', 'async'):
+            with self.subTest(runmode=runmode):
+                server = Server(['--runmode', runmode, '--workers', str(WORKERS)])
+                try:
+                    self.assertEqual(len(children(server.proc.pid, WORKERS - 1)), WORKERS - 1)
+                    self.assertEqual({worker_of(server.port) for _ in range(40)}, set(range(WORKERS)))
+                    for _ in range(10):
+                        ws = WS(server.port, '/ws/push-studio')
+                        try:
+                            ws.send('ping')
+                            self.assertIn(b'pong', ws.frame()[1])
+                        finally:
+                            ws.close()
+                        ws = WS(server.port, '/ws/discover')
+                        try:
+                            self.assertIn(SIM_UUID.encode(), ws.frame()[1])
+                        finally:
+                            ws.close()
+                finally:
+                    server.stop()
+
+    def test_y2_workers_exit_with_leader(self):
+        # Y2: once the leader is stopped, no worker is left behind
+        server = Server(['--workers', str(WORKERS)])
+        try:
+            pids = children(server.proc.pid, WORKERS - 1)
+            self.assertEqual(len(pids), WORKERS - 1)
+        finally:
+            server.stop()
+        self.assertEqual(running(pids), [])
+
+    def test_y3_dead_worker_stops_leader(self):
+        # Y3: killing a worker makes the leader exit with SIGTERM, the other worker follows
+        server = Server(['--workers', str(WORKERS)])
+        try:
+            pids = children(server.proc.pid, WORKERS - 1)
+            self.assertEqual(len(pids), WORKERS - 1)
+            os.kill(pids[0], signal.SIGKILL)
+            self.assertEqual(server.proc.wait(timeout=5), -signal.SIGTERM)
+        finally:
+            server.stop()
+        self.assertEqual(running(pids), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
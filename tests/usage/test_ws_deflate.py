@@ -0,0 +1,130 @@
+"""Usage tests D1-D4: permessage-deflate (see docs/test-plan.md).
+
+Runs a server with `--ws-deflate on` (the default `auto` only negotiates
+with remote clients, so a loopback test must force it) and one with the
+default to check loopback clients are left alone. Compressed frames are
+raw deflate streams without the trailing 0x00 0x00 0xff 0xff (RFC 7692).
+"""
+
+import json
+import unittest
+import zlib
+
+from tests.usage._harness import WS, Server
+
+OFFER = {'Sec-WebSocket-Extensions': 'permessage-deflate; client_max_window_bits'}
+SVG = (
+    b'<svg xmlns="http://www.w3.org/2000/svg">'
+    + b''.join(b'<rect x="%d" y="%d" width="10" height="10"/>' % (i, i) for i in range(200))
+    + b'</svg>'
+)
+
+server = None
+default_server = None
+
+
+def setUpModule():
+    global server, default_server
+    server = Server(['--ws-deflate', 'on'])
+    default_server = Server()
+
+
+def tearDownModule():
+    for s in (server, default_server):
+        if s is not None:
+            s.stop()
+
+
+def deflate(payload):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return (compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+
+
+class DeflateTest(unittest.TestCase):
+    def test_d1_negotiation(self):
+        # D1: accepted when offered, declined for a window zlib can not do,
+        # absent without an offer and on a loopback `auto` server.
+        ws = WS(server.port, '/ws/push-studio', headers=OFFER)
+        self.assertEqual(ws.headers.get('sec-websocket-extensions'), 'permessage-deflate')
+        ws.close()
+
+        ws = WS(server.port, '/ws/push-studio', headers={'Sec-WebSocket-Extensions': 'permessage-deflate; x=1'})
+        self.assertNotIn('sec-websocket-extensions', ws.headers)
+        ws.close()
+
+        ws = WS(
+            server.port,
+            '/ws/push-studio',
+            headers={
+                'Sec-WebSocket-Extensions': 'permessage-deflate; server_max_window_bits=8, '
+                'permessage-deflate; server_no_context_takeover'
+            },
+        )
+        self.assertEqual(ws.headers.get('sec-websocket-extensions'), 'permessage-deflate; server_no_context_takeover')
+        ws.close()
+
+        ws = WS(server.port, '/ws/push-studio')
+        self.assertNotIn('sec-websocket-extensions', ws.headers)
+        ws.close()
+
+        ws = WS(default_server.port, '/ws/push-studio', headers=OFFER)
+        self.assertNotIn('sec-websocket-extensions', ws.headers)
+        ws.close()
+
+    def test_d2_small_replies_stay_plain(self):
+        # D2: below the 1 KB threshold nothing is compressed, a compressed
+        # request is still understood.
+        ws = WS(server.port, '/ws/push-studio', headers=OFFER)
+        try:
+            ws.send(deflate(b'ping'), rsv=0x40)
+            self.assertEqual(json.loads(ws.frame()[1]), {'status': 'pong'})
+            self.assertEqual(ws.rsv, 0)
+        finally:
+            ws.close()
+
+    def test_d3_relay_compressed_both_ways(self):
+        # D3: a compressed upload on inter-process reaches push-studio as a
+        # compressed text message.
+        studio = WS(server.port, '/ws/push-studio', headers=OFFER)
+        plugin = WS(server.port, '/ws/inter-process', headers=OFFER)
+        try:
+            studio.send('set_handler')
+            self.assertEqual(json.loads(studio.frame()[1])['status'], 'ok')
+            plugin.send('adobe_illustrator %d {}' % len(SVG))
+            self.assertEqual(json.loads(plugin.frame()[1]), {'status': 'continue'})
+            plugin.send(deflate(SVG), opcode=2, rsv=0x40)
+
+            opcode, payload = studio.frame()
+            self.assertEqual(opcode, 1)
+            self.assertEqual(studio.rsv, 0x40)
+            self.assertLess(len(payload), len(SVG) // 4)
+            inflated = zlib.decompressobj(-15).decompress(payload + b'\x00\x00\xff\xff')
+            self.assertEqual(json.loads(inflated)['svg'], SVG.decode())
+        finally:
+            plugin.close()
+            studio.close()
+
+    def test_d4_context_takeover_across_messages(self):
+        # D4: the server keeps its compression context, so the client must
+        # inflate consecutive messages with one decompressor.
+        studio = WS(server.port, '/ws/push-studio', headers=OFFER)
+        plugin = WS(server.port, '/ws/inter-process', headers=OFFER)
+        inflater = zlib.decompressobj(-15)
+        try:
+            studio.send('set_handler')
+            studio.frame()
+            for _ in range(3):
+                plugin.send('adobe_illustrator %d {}' % len(SVG))
+                plugin.frame()
+                plugin.send(SVG, opcode=2)
+                payload = studio.frame()[1]
+                self.assertEqual(studio.rsv, 0x40)
+                inflated = inflater.decompress(payload + b'\x00\x00\xff\xff')
+                self.assertEqual(json.loads(inflated)['svg'], SVG.decode())
+        finally:
+            plugin.close()
+            studio.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
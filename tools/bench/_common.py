@@ -0,0 +1,78 @@
+"""Shared helpers for the benchmark scripts in tools/bench/.
+
+The benchmarks reuse the server fixture and the stdlib websocket client of
+the usage tests (tests/usage/_harness.py), so they run under the same
+conditions: a real `ghost.py -d --port 0` process, no hardware.
+"""
+
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from tests.usage._harness import WS, Server  # noqa: E402
+
+__all__ = ['ROOT', 'WS', 'Server', 'latency_summary', 'percentile', 'process_stats', 'report', 'timed']
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return float('nan')
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def process_stats(pid):
+    """Return (rss_bytes, thread_count) of a process. Uses psutil (dev group) when available."""
+    try:
+        import psutil
+
+        proc = psutil.Process(pid)
+        return proc.memory_info().rss, proc.num_threads()
+    except ImportError:
+        pass
+
+    rss = threads = 0
+    with open('/proc/%i/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+            elif line.startswith('Threads:'):
+                threads = int(line.split()[1])
+    return rss, threads
+
+
+def timed(fn, *args, **kw):
+    """Run fn and return (elapsed_seconds, result)."""
+    t = time.perf_counter()
+    ret = fn(*args, **kw)
+    return time.perf_counter() - t, ret
+
+
+def report(title, rows, columns):
+    """Print rows (list of dicts) as a fixed-width table."""
+    print('\n== %s ==' % title)
+    widths = [max(len(c), *(len(_fmt(r.get(c))) for r in rows)) for c in columns]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in rows:
+        print('  '.join(_fmt(r.get(c)).ljust(w) for c, w in zip(columns, widths)))
+
+
+def latency_summary(samples):
+    """Milliseconds p50/p99/mean of a list of second-based samples."""
+    return {
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'mean_ms': statistics.mean(samples) * 1000 if samples else float('nan'),
+    }
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        return '%.3f' % value
+    return str(value)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Connection setup and round trip latency with many open websockets.
+
+Usage:
+    uv run python tools/bench/accept_load.py [--connections 1500] [--messages 200]
+
+For each runmode a fresh `ghost.py -d --port 0 --runmode <mode>` is spawned
+and N idle `/ws/push-studio` connections are opened one after another,
+timing connect -> 101 of each. The table shows the first and the last 10% of
+them, so a server loop whose cost grows with open connections shows up as a
+gap between the two, then the `ping` -> `pong` round trip on the first and
+the last connection while all N stay open (past 1024 connections the last
+one holds an fd select() can not watch).
+
+The open files limit of this process is raised to fit; the server raises its
+own.
+"""
+
+import argparse
+import contextlib
+import resource
+import time
+
+from _common import WS, Server, latency_summary, report
+
+ROUTE = '/ws/push-studio'
+
+
+def round_trips(ws, messages):
+    samples = []
+    for _ in range(messages):
+        t = time.perf_counter()
+        ws.send('ping')
+        ws.frame()
+        samples.append(time.perf_counter() - t)
+    return samples
+
+
+def run(runmode, connections, messages):
+    server = Server(['--runmode', runmode])
+    conns = []
+    setup = []
+    try:
+        for _ in range(connections):
+            t = time.perf_counter()
+            conns.append(WS(server.port, ROUTE))
+            setup.append(time.perf_counter() - t)
+
+        tenth = max(connections // 10, 1)
+        row = {'runmode': runmode, 'conns': connections}
+        for name, samples in (('first', setup[:tenth]), ('last', setup[-tenth:])):
+            stats = latency_summary(samples)
+            row['%s_p50_ms' % name] = stats['p50_ms']
+            row['%s_p99_ms' % name] = stats['p99_ms']
+        row['ping_first_p50_ms'] = latency_summary(round_trips(conns[0], messages))['p50_ms']
+        try:
+            row['ping_last_p50_ms'] = latency_summary(round_trips(conns[-1], messages))['p50_ms']
+        except (EOFError, OSError):
+            row['ping_last_p50_ms'] = 'closed'
+        return row
+    finally:
+        for ws in conns:
+            with contextlib.suppress(Exception):
+                ws.close()
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--connections', type=int, default=1500, help='Idle websocket connections')
+    parser.add_argument('--messages', type=int, default=200, help='Round trips per ping sample')
+    options = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = options.connections + 256
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+    rows = [run(mode, options.connections, options.messages) for mode in ('thread', 'async')]
+    columns = ['runmode', 'conns', 'first_p50_ms', 'first_p99_ms', 'last_p50_ms', 'last_p99_ms']
+    report('websocket setup under load', rows, columns + ['ping_first_p50_ms', 'ping_last_p50_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Latency and throughput of the /api reverse proxy (fluxghost/http_handlers/proxy_handler.py).
+
+Usage:
+    uv run python tools/bench/api_proxy.py [--requests 1000] [--post-mb 64]
+
+Starts a stand-in upstream (a keep-alive `http.server` in a child process),
+then `ghost.py -d --port 0` with PROXY_API_HOST pointing at it. One client
+on one keep-alive connection measures:
+
+    get        round trip of a small JSON GET through the proxy
+    post       throughput of a --post-mb POST body (upstream reads and counts it)
+    download   throughput of a --post-mb GET reply
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from _common import Server, latency_summary, report
+
+BLOCK = os.urandom(2**20)
+
+
+class Upstream(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith('/api/download/'):
+            size = int(self.path.rsplit('/', 1)[1])
+            self.send_response(200)
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            while size > 0:
+                self.wfile.write(BLOCK[: min(size, len(BLOCK))])
+                size -= len(BLOCK)
+        else:
+            body = b'{"status": "ok"}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def do_POST(self):
+        left = int(self.headers['Content-Length'])
+        while left > 0:
+            left -= len(self.rfile.read(min(left, 2**20)))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+
+def serve_upstream(queue):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Upstream)
+    queue.put(httpd.server_address[1])
+    httpd.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--post-mb', type=int, default=64)
+    options = parser.parse_args()
+
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    upstream = ctx.Process(target=serve_upstream, args=(queue,), daemon=True)
+    upstream.start()
+    os.environ['PROXY_API_HOST'] = '127.0.0.1:%i' % queue.get()
+
+    server = Server()
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=60)
+        samples = []
+        for _ in range(options.requests):
+            t = time.perf_counter()
+            conn.request('GET', '/api/ping')
+            conn.getresponse().read()
+            samples.append(time.perf_counter() - t)
+        rows = [dict(case='get', requests=options.requests, **latency_summary(samples))]
+
+        size = options.post_mb * 2**20
+        body = os.urandom(size)
+        t = time.perf_counter()
+        conn.request('POST', '/api/upload', body=body)
+        conn.getresponse().read()
+        rows.append({'case': 'post', 'requests': 1, 'MB_per_s': size / 2**20 / (time.perf_counter() - t)})
+
+        t = time.perf_counter()
+        conn.request('GET', '/api/download/%i' % size)
+        received = len(conn.getresponse().read())
+        rows.append({'case': 'download', 'requests': 1, 'MB_per_s': received / 2**20 / (time.perf_counter() - t)})
+        conn.close()
+    finally:
+        server.stop()
+        upstream.terminate()
+
+    report('api proxy', rows, ['case', 'requests', 'p50_ms', 'p99_ms', 'MB_per_s'])
+
+
+if __name__ == '__main__':
+    main()
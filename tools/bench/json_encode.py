@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the JSON encoding behind ApiBase.send_json (fluxghost/utils/json_codec.py).
+
+Usage:
+    uv run python tools/bench/json_encode.py [--points 50000] [--repeat 20]
+
+Encodes a `get_all_similar_contours`-like reply carrying a single contour of
+--points int32 points, the way it was sent before (`.tolist()` then
+`json.dumps`) and through each json_codec backend with the array passed
+as is. The orjson row only appears when orjson is installed.
+"""
+
+import argparse
+import json
+import math
+
+import numpy as np
+from _common import report, timed
+
+from fluxghost.utils import json_codec
+
+
+def contour_payload(points, as_list):
+    t = np.linspace(0, 2 * math.pi, points, endpoint=False)
+    contour = np.stack([1000 + 800 * np.cos(t), 1000 + 600 * np.sin(3 * t)], axis=1).astype(np.int32)
+    info = {'center': (1000, 1000), 'angle': 0.25, 'bbox': (200, 400, 1600, 1200)}
+    info['contour'] = contour.tolist() if as_list else contour
+    return {'status': 'ok', 'data': [[info]]}
+
+
+def bench(name, encode, payload, repeat):
+    samples = []
+    for _ in range(repeat):
+        elapsed, text = timed(encode, payload)
+        samples.append(elapsed)
+    return {'encoder': name, 'best_ms': min(samples) * 1000, 'bytes': len(text), 'text': text}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--points', type=int, default=50000, help='Points in the contour')
+    parser.add_argument('--repeat', type=int, default=20)
+    options = parser.parse_args()
+
+    payload = contour_payload(options.points, as_list=False)
+    rows = [bench('tolist + json.dumps', lambda p: json.dumps(contour_payload_list(p)), payload, options.repeat)]
+    for name in json_codec.BACKENDS:
+        json_codec.use_backend(name)
+        rows.append(bench('json_codec ' + name, json_codec.dumps, payload, options.repeat))
+
+    expected = json.loads(rows[0]['text'])
+    for row in rows:
+        row['same'] = json.loads(row.pop('text')) == expected
+        row['speedup'] = rows[0]['best_ms'] / row['best_ms']
+    report('%i-point contour reply' % options.points, rows, ['encoder', 'best_ms', 'speedup', 'bytes', 'same'])
+
+
+def contour_payload_list(payload):
+    # What the handlers did before: convert every array before encoding
+    info = dict(payload['data'][0][0])
+    info['contour'] = info['contour'].tolist()
+    return {'status': payload['status'], 'data': [[info]]}
+
+
+if __name__ == '__main__':
+    main()
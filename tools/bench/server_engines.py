@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Compare the THREAD and ASYNC server runmodes.
+
+Usage:
+    uv run python tools/bench/server_engines.py [--connections 200] [--messages 500]
+
+For each runmode a fresh `ghost.py -d --port 0 --runmode <mode>` is spawned.
+The script opens N idle websocket connections (`/ws/push-studio`, which stays
+silent until it gets a command) and records the server's RSS and thread count
+before and after; then it measures the `ping` -> `pong` round trip on one more
+connection while the idle ones stay open, once on a loop-dispatched route and
+once on a worker-dispatched route (`/ws/inter-process`).
+"""
+
+import argparse
+import contextlib
+import time
+
+from _common import WS, Server, latency_summary, process_stats, report
+
+IDLE_ROUTE = '/ws/push-studio'
+LATENCY_ROUTES = ('/ws/push-studio', '/ws/inter-process')
+
+
+def measure_latency(port, route, messages):
+    ws = WS(port, route)
+    samples = []
+    try:
+        for _ in range(messages):
+            t = time.perf_counter()
+            ws.send('ping')
+            ws.frame()
+            samples.append(time.perf_counter() - t)
+    finally:
+        ws.close()
+    return samples
+
+
+def run(runmode, connections, messages):
+    server = Server(['--runmode', runmode])
+    idle = []
+    try:
+        time.sleep(0.5)
+        rss_before, threads_before = process_stats(server.proc.pid)
+        for _ in range(connections):
+            idle.append(WS(server.port, IDLE_ROUTE))
+        time.sleep(1.0)
+        rss_after, threads_after = process_stats(server.proc.pid)
+
+        row = {
+            'runmode': runmode,
+            'idle_conns': connections,
+            'threads': '%i -> %i' % (threads_before, threads_after),
+            'rss_per_conn_kb': (rss_after - rss_before) / 1024.0 / max(connections, 1),
+        }
+        for route in LATENCY_ROUTES:
+            stats = latency_summary(measure_latency(server.port, route, messages))
+            name = route.rsplit('/', 1)[-1]
+            row['%s_p50_ms' % name] = stats['p50_ms']
+            row['%s_p99_ms' % name] = stats['p99_ms']
+        return row
+    finally:
+        for ws in idle:
+            with contextlib.suppress(Exception):
+                ws.close()
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--connections', type=int, default=200, help='Idle websocket connections')
+    parser.add_argument('--messages', type=int, default=500, help='Round trips per latency sample')
+    options = parser.parse_args()
+
+    rows = [run(mode, options.connections, options.messages) for mode in ('thread', 'async')]
+    columns = ['runmode', 'idle_conns', 'threads', 'rss_per_conn_kb']
+    for route in LATENCY_ROUTES:
+        name = route.rsplit('/', 1)[-1]
+        columns += ['%s_p50_ms' % name, '%s_p99_ms' % name]
+    report('server runmodes', rows, columns)
+
+
+if __name__ == '__main__':
+    main()
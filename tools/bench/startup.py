@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Startup time of ghost.py up to the ready line, and the first connections after it.
+
+Usage:
+    uv run python tools/bench/startup.py [--runs 5] [--route /ws/utils]
+
+Each run spawns `ghost.py -d --port 0` and measures:
+
+    ready      spawn -> `{"type": "ready"}` line on stdout
+    ver        ready line -> first frame of /ws/ver
+    first      then -> 101 of the first connection to --route (imports its
+               handler module, or waits for the warm-up importing it)
+
+once as is and once with --warm-routes. Set FLUX_GHOST_CERT_DIR to a folder
+holding certificates to include the HTTPS setup.
+"""
+
+import argparse
+import time
+
+from _common import WS, Server, latency_summary, report
+
+
+def run_once(route, extra_args):
+    t = time.perf_counter()
+    server = Server(extra_args)
+    ready = time.perf_counter()
+    try:
+        ws = WS(server.port, '/ws/ver')
+        ws.frame()
+        ver = time.perf_counter()
+        ws.close()
+        ws = WS(server.port, route)
+        first = time.perf_counter()
+        ws.close()
+    finally:
+        server.stop()
+    return ready - t, ver - ready, first - ver
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--route', type=str, default='/ws/utils')
+    options = parser.parse_args()
+
+    rows = []
+    for mode, extra_args in (('default', None), ('warm-routes', ['--warm-routes'])):
+        runs = [run_once(options.route, extra_args) for _ in range(options.runs)]
+        for idx, case in enumerate(('ready', 'ver', 'first')):
+            rows.append(dict(mode=mode, case=case, runs=len(runs), **latency_summary([r[idx] for r in runs])))
+    report('startup', rows, ['mode', 'case', 'runs', 'p50_ms', 'p99_ms', 'mean_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Static asset throughput of FileHandler (fluxghost/http_handlers/file_handler.py).
+
+Usage:
+    uv run python tools/bench/static_assets.py [--clients 4] [--requests 400] [--large-mb 32]
+
+Spawns `ghost.py -d --port 0 --assets <tmp>` on a temporary folder holding a
+64 KB script and a --large-mb binary. Each client is a separate process with
+one keep-alive connection. Cases:
+
+    small      GET of the 64 KB script (served from the memory cache)
+    revalidate GET of the script with the If-None-Match of the first reply
+    large      GET of the large binary (sendfile)
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from _common import Server, report
+
+SMALL_NAME = 'bundle.js'
+LARGE_NAME = 'large.bin'
+
+
+def client(port, path, requests, revalidate, queue):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {}
+    if revalidate:
+        conn.request('GET', path)
+        resp = conn.getresponse()
+        resp.read()
+        etag = resp.getheader('ETag')
+        if etag:
+            headers['If-None-Match'] = etag
+    received = 0
+    statuses = set()
+    t = time.perf_counter()
+    for _ in range(requests):
+        conn.request('GET', path, headers=headers)
+        resp = conn.getresponse()
+        received += len(resp.read())
+        statuses.add(resp.status)
+    queue.put((time.perf_counter() - t, received, statuses))
+    conn.close()
+
+
+def run_case(port, name, path, clients, requests, revalidate=False):
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=client, args=(port, path, requests, revalidate, queue)) for _ in range(clients)]
+    t = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    results = [queue.get() for _ in procs]
+    wall = time.perf_counter() - t
+    for proc in procs:
+        proc.join()
+
+    total = clients * requests
+    received = sum(r[1] for r in results)
+    statuses = set().union(*(r[2] for r in results))
+    return {
+        'case': name,
+        'requests': total,
+        'status': ','.join(str(s) for s in sorted(statuses)),
+        'req_per_s': total / wall,
+        'MB_per_s': received / wall / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=400, help='Requests per client for the small cases')
+    parser.add_argument('--large-mb', type=int, default=32)
+    options = parser.parse_args()
+
+    assets = tempfile.mkdtemp()
+    with open(os.path.join(assets, SMALL_NAME), 'wb') as f:
+        f.write(os.urandom(2**16))
+    with open(os.path.join(assets, LARGE_NAME), 'wb') as f:
+        f.write(os.urandom(options.large_mb * 2**20))
+
+    server = Server(['--assets', assets])
+    try:
+        large_requests = max(1, options.requests // 40)
+        rows = [
+            run_case(server.port, 'small', '/' + SMALL_NAME, options.clients, options.requests),
+            run_case(server.port, 'revalidate', '/' + SMALL_NAME, options.clients, options.requests, revalidate=True),
+            run_case(server.port, 'large', '/' + LARGE_NAME, options.clients, large_requests),
+        ]
+    finally:
+        server.stop()
+        shutil.rmtree(assets, ignore_errors=True)
+    report('static assets', rows, ['case', 'requests', 'status', 'req_per_s', 'MB_per_s'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Peak memory of a binary upload through the websocket codec and BinaryUploadHelper.
+
+Usage:
+    uv run python tools/bench/upload_memory.py [--size 33554432] [--chunk 131072] [--spool]
+
+Runs in-process over a socketpair: a child process sends the upload as
+masked binary frames of --chunk bytes (Beam Studio uses 128 KB), the handler
+collects it with BinaryUploadHelper. Reports the tracemalloc peak while
+receiving, as a multiple of the upload size, and checks the bytes arrived
+intact. With --spool each case also runs with the upload spooled to a temp
+file (`SPOOL_THRESHOLD = 0`), whose mapped pages are not on the heap.
+"""
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import socket
+import tracemalloc
+
+from _common import report
+from ws_codec import masked_frame
+
+from fluxghost.api import misc
+from fluxghost.api.misc import BinaryHelperMixin, BinaryUploadHelper
+from fluxghost.utils.websocket import WebSocketHandler
+
+
+class UploadHandler(BinaryHelperMixin, WebSocketHandler):
+    result = None
+
+    def on_uploaded(self, buf):
+        self.result = hashlib.md5(buf).hexdigest()
+
+
+def feed(sock, payload, chunk):
+    for offset in range(0, len(payload), chunk):
+        sock.sendall(masked_frame(payload[offset : offset + chunk]))
+
+
+def bench(size, chunk, spool=False):
+    misc.configure_uploads(spool_threshold=0 if spool else size)
+    payload = os.urandom(size)
+    server_side, client_side = socket.socketpair()
+    handler = UploadHandler(server_side, ('bench', 0), None)
+    writer = multiprocessing.get_context('fork').Process(target=feed, args=(client_side, payload, chunk))
+    writer.start()
+
+    tracemalloc.start()
+    handler.set_binary_helper(BinaryUploadHelper(size, handler.on_uploaded))
+    while handler.result is None:
+        handler.do_recv()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    writer.join()
+
+    server_side.close()
+    client_side.close()
+    return {
+        'size': size,
+        'chunk': chunk,
+        'spool': spool,
+        'peak_MB': peak / 2**20,
+        'peak/size': peak / size,
+        'intact': handler.result == hashlib.md5(payload).hexdigest(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--size', type=int, default=2**25, help='Upload size')
+    parser.add_argument('--chunk', type=int, action='append', help='Frame size, may be repeated')
+    parser.add_argument('--spool', action='store_true', help='Also measure spooled uploads')
+    options = parser.parse_args()
+
+    rows = []
+    for chunk in options.chunk or [2**17, 2**20, options.size]:
+        for spool in (False, True) if options.spool else (False,):
+            rows.append(bench(options.size, chunk, spool))
+    report('upload peak memory', rows, ['size', 'chunk', 'spool', 'peak_MB', 'peak/size', 'intact'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Throughput of CPU-bound commands with 1, 2, 4 and 8 `--workers`.
+
+Usage:
+    uv run python tools/bench/workers.py [--workers 1,2,4,8] [--clients 16] [--requests 20] [--size 3000]
+
+For each worker count a fresh `ghost.py -d --port 0 --workers N` is spawned
+and C client threads each send R `get_convex_hull` requests (the framing
+helper of Beam Studio: PNG decode, threshold, contours) on /ws/utils, each
+on a new connection, so the kernel spreads them over the N processes. The
+table shows requests per second and the latency of one request; expect it
+to scale up to the number of CPU cores only.
+"""
+
+import argparse
+import io
+import os
+import threading
+import time
+
+from _common import WS, Server, latency_summary, report
+from PIL import Image, ImageDraw
+
+
+def make_png(size):
+    image = Image.new('RGBA', (size, size), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for i in range(0, size // 2, 40):
+        draw.ellipse((i, i, size - i, size - i // 2), outline=(0, 0, 0, 255), width=3)
+    out = io.BytesIO()
+    image.save(out, format='PNG')
+    return out.getvalue()
+
+
+def convex_hull(port, png):
+    ws = WS(port, '/ws/utils', timeout=120)
+    try:
+        ws.send('get_convex_hull %d' % len(png))
+        ws.json_until(lambda m: m.get('status') == 'continue')
+        ws.send(png, opcode=2)
+        return ws.json_until(lambda m: m.get('status') in ('ok', 'error'))
+    finally:
+        ws.close()
+
+
+def run(workers, clients, requests, png):
+    server = Server(['--workers', str(workers)])
+    samples = []
+    errors = []
+    lock = threading.Lock()
+
+    def client():
+        for _ in range(requests):
+            t = time.perf_counter()
+            try:
+                convex_hull(server.port, png)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                samples.append(time.perf_counter() - t)
+
+    try:
+        convex_hull(server.port, png)
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        t = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - t
+    finally:
+        server.stop()
+
+    stats = latency_summary(samples)
+    return {
+        'workers': workers,
+        'requests': len(samples),
+        'errors': len(errors),
+        'req_per_s': len(samples) / elapsed,
+        'p50_ms': stats['p50_ms'],
+        'p99_ms': stats['p99_ms'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--workers', default='1,2,4,8', help='Comma separated worker counts')
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent client threads')
+    parser.add_argument('--requests', type=int, default=20, help='Requests per client')
+    parser.add_argument('--size', type=int, default=3000, help='Width and height of the image, in pixels')
+    options = parser.parse_args()
+
+    png = make_png(options.size)
+    rows = [run(int(n), options.clients, options.requests, png) for n in options.workers.split(',')]
+    report(
+        'get_convex_hull, %ix%i px, %i clients, %i CPUs' % (options.size, options.size, options.clients, os.cpu_count()),
+        rows,
+        ['workers', 'requests', 'errors', 'req_per_s', 'p50_ms', 'p99_ms'],
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the websocket frame codec (fluxghost/utils/websocket.py).
+
+Usage:
+    uv run python tools/bench/ws_codec.py [--size 1048576] [--total 268435456]
+
+Runs in-process over a socketpair, no server needed:
+
+    send   WebSocketHandler.send_binary() of --size byte messages, a child
+           process on the other end drains the socket
+    recv   WebSocketHandler.do_recv() of masked --size byte binary frames, a
+           child process on the other end writes a prebuilt stream
+"""
+
+import argparse
+import os
+import socket
+import struct
+import multiprocessing
+import time
+
+from _common import report
+
+from fluxghost.utils.websocket import WebSocketHandler
+
+
+def peer(target, *args):
+    # A process, not a thread: the peer must not compete for the GIL
+    proc = multiprocessing.get_context('fork').Process(target=target, args=args)
+    proc.start()
+    return proc
+
+
+def drain(sock, expected):
+    received = 0
+    buf = bytearray(2**20)
+    while received < expected:
+        n = sock.recv_into(buf)
+        if not n:
+            break
+        received += n
+    sock.sendall(b'.')
+
+
+def bench_send(size, total):
+    server_side, client_side = socket.socketpair()
+    handler = WebSocketHandler(server_side, ('bench', 0), None)
+    count = max(1, total // size)
+    payload = bytes(size)
+    header = 2 if size < 126 else (4 if size < 2**16 else 10)
+    reader = peer(drain, client_side, count * (size + header))
+
+    t = time.perf_counter()
+    for _ in range(count):
+        handler.send_binary(payload)
+    handler.flush()
+    # wait for the peer to confirm it read everything
+    server_side.recv(1)
+    elapsed = time.perf_counter() - t
+    reader.join()
+
+    server_side.close()
+    client_side.close()
+    return {'case': 'send', 'size': size, 'messages': count, 'MB/s': count * size / elapsed / 2**20}
+
+
+class CountingHandler(WebSocketHandler):
+    received = 0
+
+    def on_binary_message(self, buf):
+        self.received += len(buf)
+
+
+def masked_frame(payload):
+    mask = os.urandom(4)
+    n = len(payload)
+    if n < 126:
+        header = struct.pack('>BB', 0x82, 0x80 | n)
+    elif n < 2**16:
+        header = struct.pack('>BBH', 0x82, 0x80 | 126, n)
+    else:
+        header = struct.pack('>BBQ', 0x82, 0x80 | 127, n)
+    key = (mask * (n // 4 + 1))[:n]
+    body = (int.from_bytes(payload, 'little') ^ int.from_bytes(key, 'little')).to_bytes(n, 'little')
+    return header + mask + body
+
+
+def feed(sock, frame, count):
+    for _ in range(count):
+        sock.sendall(frame)
+
+
+def bench_recv(size, total):
+    server_side, client_side = socket.socketpair()
+    handler = CountingHandler(server_side, ('bench', 0), None)
+    count = max(1, total // size)
+    frame = masked_frame(os.urandom(size))
+
+    t = time.perf_counter()
+    writer = peer(feed, client_side, frame, count)
+    while handler.received < count * size:
+        handler.do_recv()
+    elapsed = time.perf_counter() - t
+    writer.join()
+
+    server_side.close()
+    client_side.close()
+    return {'case': 'recv', 'size': size, 'messages': count, 'MB/s': count * size / elapsed / 2**20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--size', type=int, action='append', help='Message size, may be repeated')
+    parser.add_argument('--total', type=int, default=2**28, help='Bytes per case')
+    parser.add_argument('--case', choices=['send', 'recv'], action='append', help='Only run these cases')
+    options = parser.parse_args()
+    sizes = options.size or [4016, 2**16, 2**20, 2**24]
+
+    cases = options.case or ['send', 'recv']
+
+    rows = []
+    if 'send' in cases:
+        rows += [bench_send(size, options.total) for size in sizes]
+    if 'recv' in cases:
+        rows += [bench_recv(size, options.total) for size in sizes]
+    report('websocket codec', rows, ['case', 'size', 'messages', 'MB/s'])
+
+
+if __name__ == '__main__':
+    main()
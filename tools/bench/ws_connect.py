@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Websocket connection setup time (routing in fluxghost/http_websocket_route.py).
+
+Usage:
+    uv run python tools/bench/ws_connect.py [--connections 300] [--lookups 100000]
+
+Cases:
+
+    lookup     get_match_ws_service() for every route in turn, in-process
+    first      connect -> 101 of the first connection to each route, i.e.
+               including the import of its handler module
+    connect    connect -> 101 of later connections to the same routes
+    warm       `first` again on a server started with --warm-routes, after
+               the warm-up had a second to finish
+
+Each `ghost.py -d --port 0` is a fresh process, so `first` sees cold imports.
+"""
+
+import argparse
+import time
+
+from _common import WS, Server, latency_summary, report
+
+ROUTES = ('/ws/push-studio', '/ws/inter-process', '/ws/utils', '/ws/camera-calibration', '/ws/opencv')
+LOOKUP_PATHS = ('ver', 'push-studio', 'inter-process?token=1', 'camera-calibration', 'opencv', 'utils')
+
+
+def connect(port, route):
+    t = time.perf_counter()
+    ws = WS(port, route)
+    elapsed = time.perf_counter() - t
+    ws.close()
+    return elapsed
+
+
+def run_lookups(lookups):
+    from fluxghost.http_websocket_route import get_match_ws_service
+
+    for path in LOOKUP_PATHS:
+        get_match_ws_service(path)
+    t = time.perf_counter()
+    for i in range(lookups):
+        get_match_ws_service(LOOKUP_PATHS[i % len(LOOKUP_PATHS)])
+    elapsed = time.perf_counter() - t
+    return {'case': 'lookup', 'samples': lookups, 'mean_ms': elapsed / lookups * 1000}
+
+
+def first_connections(extra_args=None, wait=0.0):
+    server = Server(extra_args)
+    try:
+        time.sleep(wait)
+        return [connect(server.port, route) for route in ROUTES]
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--connections', type=int, default=300, help='Connections for the `connect` case')
+    parser.add_argument('--lookups', type=int, default=100000)
+    options = parser.parse_args()
+
+    rows = [run_lookups(options.lookups)]
+
+    server = Server()
+    try:
+        first = [connect(server.port, route) for route in ROUTES]
+        samples = [connect(server.port, ROUTES[i % len(ROUTES)]) for i in range(options.connections)]
+    finally:
+        server.stop()
+    rows.append(dict(case='first', samples=len(first), **latency_summary(first)))
+    rows.append(dict(case='connect', samples=len(samples), **latency_summary(samples)))
+
+    warm = first_connections(['--warm-routes'], wait=1.0)
+    rows.append(dict(case='warm', samples=len(warm), **latency_summary(warm)))
+
+    report('websocket connection setup', rows, ['case', 'samples', 'p50_ms', 'p99_ms', 'mean_ms'])
+
+
+if __name__ == '__main__':
+    main()